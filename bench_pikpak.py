@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the PikPak Link Extractor.
+
+Starts a local stand-in for the PikPak API, its CDN and the Dropbox API in a
+child process, points the app at it through PIKPAK_API_BASE /
+PIKPAK_DROPBOX_CONTENT_URL / PIKPAK_DROPBOX_API_URL and measures:
+  list    files/s for list_share_files (cold cache)
+  links   links/s for /api/links (cold cache)
+  upload  MB/s, peak RSS and peak temp disk for /api/dropbox-upload
+
+Run: python bench_pikpak.py --folders 50 --files 20 --size 4 --latency 30
+Any PIKPAK_* setting (PIKPAK_ENGINE, PIKPAK_TRANSFER_MODE, ...) applies as usual.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+MB = 1024 * 1024
+FILLER = bytes(range(256)) * 4096  # 1MB of file content, repeated
+
+
+def build_tree(folders, files_per_folder, file_size, branching):
+    """Share tree as {parent_id: [entries]}: `folders` folders, `branching` children each, files in every folder."""
+    tree = {"": []}
+    ids = [""]
+    for i in range(folders):
+        parent = ids[i // branching] if i else ""
+        tree[parent].append({"kind": "drive#folder", "id": f"fo{i}", "name": f"Pasta {i}"})
+        tree[f"fo{i}"] = []
+        ids.append(f"fo{i}")
+    n = 0
+    for folder in ids:
+        for _ in range(files_per_folder):
+            n += 1
+            tree[folder].append({
+                "kind": "drive#file", "id": f"fi{n}", "name": f"video{n}.mp4",
+                "size": str(file_size), "mime_type": "video/mp4",
+            })
+    return tree
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """PikPak share API + CDN + Dropbox content/RPC endpoints on one port."""
+
+    protocol_version = "HTTP/1.1"
+    wbufsize = 1 << 16
+    tree = {}
+    sizes = {}
+    latency = 0.0
+    bandwidth = 0.0
+    error_rate = 0.0
+    api_rps = 0.0
+    api_window = []
+    sessions = {}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, obj, code=200):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if code == 503:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def throttle(self, nbytes):
+        if self.bandwidth:
+            time.sleep(nbytes / self.bandwidth)
+
+    def begin(self):
+        time.sleep(self.latency)
+        return random.random() >= self.error_rate
+
+    def read_body(self):
+        remaining = int(self.headers.get("Content-Length") or 0)
+        total = remaining
+        while remaining:
+            piece = self.rfile.read(min(remaining, MB))
+            if not piece:
+                break
+            remaining -= len(piece)
+            self.throttle(len(piece))
+        return total
+
+    def over_api_rate(self):
+        """PikPak-style throttling: more than api_rps API calls in the last second get a 429."""
+        if not self.api_rps:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self.api_window and self.api_window[0] < now - 1:
+                self.api_window.pop(0)
+            if len(self.api_window) >= self.api_rps:
+                return True
+            self.api_window.append(now)
+        return False
+
+    def do_GET(self):
+        if not self.begin():
+            return self.send_json({"error": "unavailable"}, 503)
+        url = urlparse(self.path)
+        if url.path.startswith("/drive/") and self.over_api_rate():
+            return self.send_json({"error": "too_many_requests", "error_description": "slow down"}, 429)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == "/drive/v1/share":
+            return self.send_json({"title": "Bench", "pass_code_token": ""})
+        if url.path == "/drive/v1/share/detail":
+            entries = self.tree.get(q.get("parent_id", ""), [])
+            start, limit = int(q.get("page_token") or 0), int(q.get("limit", 100))
+            more = start + limit < len(entries)
+            return self.send_json({"files": entries[start:start + limit], "next_page_token": str(start + limit) if more else ""})
+        if url.path == "/drive/v1/share/file_info":
+            file_id = q.get("file_id", "")
+            if file_id not in self.sizes:
+                return self.send_json({"error": "file_not_found", "error_description": "not found"}, 404)
+            link = f"http://{self.headers['Host']}/cdn/{file_id}?e={int(time.time()) + 3600}"
+            return self.send_json({"file_info": {"web_content_link": link}})
+        if url.path.startswith("/cdn/"):
+            return self.send_file(self.sizes.get(url.path[5:], 0))
+        self.send_json({"error": "not_found"}, 404)
+
+    def send_file(self, size):
+        start, end = 0, size - 1
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if m:
+            start, end = int(m.group(1)), min(int(m.group(2) or end), end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        pos = start
+        while pos <= end:
+            n = min(MB, end + 1 - pos)
+            self.wfile.write(FILLER[:n])
+            self.throttle(n)
+            pos += n
+
+    def do_POST(self):
+        if self.headers.get("Content-Type") == "application/json":
+            arg = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            nbytes = 0
+        else:
+            arg = json.loads(self.headers.get("Dropbox-API-Arg") or "{}")
+            nbytes = self.read_body()
+        if not self.begin():
+            return self.send_json({"error": "unavailable"}, 503)
+        endpoint = urlparse(self.path).path.split("/2/", 1)[-1]
+        with self.lock:
+            if endpoint == "users/get_current_account":
+                return self.send_json({"name": {"display_name": "Bench"}, "email": "bench@localhost"})
+            if endpoint == "files/list_folder":
+                return self.send_json({"entries": [], "cursor": "", "has_more": False})
+            if endpoint == "files/upload":
+                return self.send_json({"path_display": arg["path"], "size": nbytes})
+            if endpoint == "files/upload_session/start":
+                session_id = f"s{len(self.sessions)}"
+                self.sessions[session_id] = {"size": nbytes, "concurrent": arg.get("session_type") == "concurrent"}
+                return self.send_json({"session_id": session_id})
+            if endpoint in ("files/upload_session/append_v2", "files/upload_session/finish"):
+                cursor = arg["cursor"]
+                session = self.sessions.get(cursor["session_id"])
+                if session is None:
+                    return self.send_json({"error_summary": "lookup_failed/not_found/"}, 409)
+                if session["concurrent"]:
+                    # Blocks may arrive in any order; only their total is checked at finish
+                    if endpoint.endswith("finish") and session["size"] != cursor["offset"]:
+                        return self.send_json({"error_summary": "lookup_failed/incorrect_offset/"}, 409)
+                elif session["size"] != cursor["offset"]:
+                    return self.send_json({"error_summary": "lookup_failed/incorrect_offset/"}, 409)
+                session["size"] += nbytes
+                if endpoint.endswith("finish"):
+                    return self.send_json({"path_display": arg["commit"]["path"], "size": session["size"]})
+                return self.send_json(None)
+            if endpoint == "files/upload_session/finish_batch":
+                return self.send_json({".tag": "complete", "entries": [
+                    {".tag": "success", "path_display": e["commit"]["path"], "size": self.sessions[e["cursor"]["session_id"]]["size"]}
+                    for e in arg["entries"]
+                ]})
+        self.send_json({"error": "not_found"}, 404)
+
+
+def serve(ready, tree, latency, bandwidth, error_rate, api_rps):
+    StandIn.tree = tree
+    StandIn.sizes = {e["id"]: int(e["size"]) for entries in tree.values() for e in entries if "size" in e}
+    StandIn.latency, StandIn.bandwidth, StandIn.error_rate, StandIn.api_rps = latency, bandwidth, error_rate, api_rps
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.daemon_threads = True
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+class Sampler:
+    """Samples this process's RSS and the size of a directory until stopped; keeps the peaks."""
+
+    def __init__(self, directory, interval=0.05):
+        self.directory = directory
+        self.interval = interval
+        self.peak_rss = self.peak_disk = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stop.is_set():
+            self.peak_rss = max(self.peak_rss, current_rss())
+            self.peak_disk = max(self.peak_disk, directory_size(self.directory))
+            self.stop.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def directory_size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark with local PikPak/Dropbox stand-ins")
+    parser.add_argument("--folders", type=int, default=40, help="folders in the share")
+    parser.add_argument("--files", type=int, default=25, help="files per folder (root included)")
+    parser.add_argument("--branching", type=int, default=4, help="subfolders per folder")
+    parser.add_argument("--size", type=float, default=2, help="size of every file, in MB")
+    parser.add_argument("--latency", type=float, default=20, help="per-request latency of the stand-ins, in ms")
+    parser.add_argument("--bandwidth", type=float, default=0, help="per-connection bandwidth in MB/s (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with 503")
+    parser.add_argument("--api-rps", type=float, default=0, help="PikPak API calls per second before 429s (0 = no limit)")
+    parser.add_argument("--upload-files", type=int, default=20, help="files sent to /api/dropbox-upload")
+    parser.add_argument("--skip", default="", help="comma-separated phases to skip: list,links,upload")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    skip = set(filter(None, args.skip.split(",")))
+
+    tree = build_tree(args.folders, args.files, int(args.size * MB), args.branching)
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, daemon=True,
+                                     args=(ready, tree, args.latency / 1000, args.bandwidth * MB, args.error_rate,
+                                           args.api_rps))
+    server.start()
+    base = f"http://127.0.0.1:{ready.get(timeout=10)}"
+
+    workdir = tempfile.mkdtemp(prefix="pikpak-bench-")
+    os.environ["PIKPAK_API_BASE"] = base
+    os.environ["PIKPAK_DROPBOX_CONTENT_URL"] = base + "/2"
+    os.environ["PIKPAK_DROPBOX_API_URL"] = base + "/2"
+    os.environ.setdefault("PIKPAK_JOURNAL", "")
+    tempfile.tempdir = workdir  # so tempfile-mode downloads land where the sampler looks
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import pikpak_core
+    import pikpak_extractor
+    engine, client = pikpak_extractor.engine, pikpak_extractor.app.test_client()
+    results = {"engine": pikpak_core.ENGINE, "mode": pikpak_core.TRANSFER_MODE}
+    try:
+        files = []
+        if "list" not in skip or "links" not in skip or "upload" not in skip:
+            t = time.perf_counter()
+            files = engine.list_share_files("bench", fresh=True)
+            elapsed = time.perf_counter() - t
+            results["list"] = {"files": len(files), "seconds": round(elapsed, 3), "files_per_s": round(len(files) / elapsed, 1)}
+
+        if "links" not in skip:
+            pikpak_core.link_cache.invalidate()
+            t = time.perf_counter()
+            data = client.post("/api/links", json={"share_id": "bench", "files": files}).get_json()
+            elapsed = time.perf_counter() - t
+            ok = sum(1 for link in data.get("files", []) if link.get("download_url"))
+            results["links"] = {"links": ok, "seconds": round(elapsed, 3), "links_per_s": round(ok / elapsed, 1)}
+
+        if "upload" not in skip:
+            selection = files[:args.upload_files]
+            total_bytes = sum(int(f["size"]) for f in selection)
+            with Sampler(workdir) as sampler:
+                t = time.perf_counter()
+                resp = client.post("/api/dropbox-upload", json={
+                    "token": "bench", "folder": "/Bench", "share_id": "bench", "files": selection,
+                })
+                events = [json.loads(line[6:]) for line in resp.data.decode().splitlines() if line.startswith("data: ")]
+                elapsed = time.perf_counter() - t
+            done = sum(1 for e in events if e["type"] == "done")
+            results["upload"] = {
+                "files": done, "errors": sum(1 for e in events if e["type"] == "error"),
+                "mb": round(total_bytes / MB, 1), "seconds": round(elapsed, 3),
+                "mb_per_s": round(total_bytes / MB / elapsed, 1),
+                "peak_rss_mb": round(sampler.peak_rss / MB, 1), "peak_disk_mb": round(sampler.peak_disk / MB, 1),
+            }
+    finally:
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"engine={results['engine']} mode={results['mode']}")
+    for phase, r in results.items():
+        if isinstance(r, dict):
+            print(f"  {phase:<7}" + "  ".join(f"{k}={v}" for k, v in r.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,759 @@
+"""
+asyncio engine for the PikPak Link Extractor.
+
+Listing, link resolution, CDN download and Dropbox upload as coroutines on a
+single event loop (aiohttp), so hundreds of in-flight HTTP operations share
+one thread instead of needing a pool thread each. Caches, the transfer
+journal and all response parsing are shared with pikpak_core.
+
+AsyncEngine runs the loop on a background thread and exposes the same
+blocking calls as pikpak_core (get_share_info, list_share_files,
+share_file_index, crawl_share_pages, resolve_links, run_transfers), so the Flask routes work
+with either engine. Enable with PIKPAK_ENGINE=async.
+Requires: pip install aiohttp
+"""
+
+import asyncio
+import atexit
+import json
+import queue
+import re
+import threading
+import time
+
+import aiohttp
+
+import pikpak_core as core
+import pikpak_metrics as metrics
+from pikpak_core import (
+    USER_AGENT, CHUNK_SIZE, LIST_WORKERS, LINK_WORKERS, HTTP_POOL_SIZE, HTTP_RETRIES, RETRY_STATUSES,
+    PIKPAK_RETRY_STATUSES, POST_RETRY_STATUSES, DOWNLOAD_CHUNK, STREAM_BUFFER_CHUNKS, TRANSFER_WORKERS,
+    DROPBOX_MAX_SESSIONS,
+    BATCH_COMMIT, BATCH_COMMIT_SIZE, BATCH_COMMIT_WINDOW, DOWNLOAD_SEGMENTS, SEGMENT_SIZE, SEGMENTED_MIN_SIZE,
+    UPLOAD_CONCURRENCY, SKIP_EXISTING, VERIFY_HASH,
+    share_cache, listing_cache, link_cache,
+    get_headers, FileIndex, listing_key, folders_to_list, link_ttl, download_link_from_info,
+    ChunkSizer, upload_block_limit, use_concurrent_upload, DropboxContentHasher, DownloadCheck,
+    add_folder_entries, find_existing, limiter_for, is_throttled, api_error_body, check_content_hash,
+    dropbox_tag_summary, dropbox_path_for, file_size, transfer_error_detail, error_class, upstream_endpoint,
+    get_journal, is_corrupt, commit_info, sent_before, resume_point,
+)
+
+# Created on the engine's loop by open_http_session()
+http_session = None
+dropbox_sessions = None
+
+
+async def open_http_session():
+    global http_session, dropbox_sessions
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=HTTP_POOL_SIZE, keepalive_timeout=60)
+    http_session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=600),
+    )
+    dropbox_sessions = asyncio.Semaphore(DROPBOX_MAX_SESSIONS)
+
+async def fetch(method, url, retry_statuses=RETRY_STATUSES, **kwargs):
+    """Send a request, retrying 429/5xx and connection errors with backoff. Returns (status, headers, body).
+
+    As with pikpak_core.UpstreamRetry, a POST is only sent again when it
+    can't have been applied: failed connects and POST_RETRY_STATUSES.
+    """
+    idempotent = method != "POST"
+    for attempt in range(HTTP_RETRIES + 1):
+        last = attempt == HTTP_RETRIES
+        try:
+            started = time.monotonic()
+            async with http_session.request(method, url, **kwargs) as resp:
+                record_response(url, resp.status, started)
+                body = await resp.read()
+                if resp.status in retry_statuses and (idempotent or resp.status in POST_RETRY_STATUSES) and not last:
+                    retry_after = resp.headers.get("Retry-After", "")
+                    await asyncio.sleep(float(retry_after) if retry_after.isdigit() else 0.5 * 2 ** attempt)
+                    continue
+                return resp.status, resp.headers, body
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if last or not (idempotent or isinstance(e, aiohttp.ClientConnectorError)):
+                raise
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+def record_response(url, status, started):
+    endpoint = upstream_endpoint(url)
+    metrics.upstream_seconds.observe(time.monotonic() - started, endpoint=endpoint)
+    metrics.upstream_requests.inc(endpoint=endpoint, status=status)
+
+async def pikpak_get(path, params, share_id):
+    """Async twin of pikpak_core.pikpak_api_get, sharing its per-host AdaptiveLimiter."""
+    url = f"{core.API_BASE}{path}"
+    limiter = limiter_for(url)
+    for attempt in range(HTTP_RETRIES + 1):
+        while delay := limiter.try_acquire():
+            await asyncio.sleep(delay)
+        started = time.monotonic()
+        throttled = True
+        try:
+            # 429s come back here so the limiter sees them
+            status, _, body = await fetch("GET", url, retry_statuses=PIKPAK_RETRY_STATUSES, params=params,
+                                          headers=get_headers(share_id))
+            try:
+                parsed = json.loads(body)
+            except ValueError:
+                parsed = None
+            data = api_error_body(status, parsed, body.decode(errors="replace"))
+            throttled = is_throttled(status, data)
+        finally:
+            limiter.release(time.monotonic() - started, throttled)
+        if not throttled or attempt == HTTP_RETRIES:
+            return data
+        await asyncio.sleep(0.5 * 2 ** attempt)
+
+async def get_share_info(share_id, fresh=False):
+    info = None if fresh else share_cache.get((share_id,))
+    if info is not None:
+        return info
+    info = await pikpak_get("/drive/v1/share", {"share_id": share_id, "thumbnail_size": "SIZE_LARGE"}, share_id)
+    if not info.get("error"):
+        share_cache.set((share_id,), info)
+    return info
+
+async def crawl_share_pages(share_id, pass_code_token="", parent_id="", prefix="", selection=None, known=None):
+    """Async twin of pikpak_core.crawl_share_pages: yields (folder_id, page_no, folder_prefix, entries)."""
+    limit = asyncio.Semaphore(LIST_WORKERS)
+
+    async def fetch_page(folder_id, page_no, folder_prefix, page_token):
+        params = {
+            "share_id": share_id, "parent_id": folder_id,
+            "thumbnail_size": "SIZE_LARGE", "limit": "100", "with_audit": "false",
+        }
+        if pass_code_token:
+            params["pass_code_token"] = pass_code_token
+        if page_token:
+            params["page_token"] = page_token
+        async with limit:
+            data = await pikpak_get("/drive/v1/share/detail", params, share_id)
+        if data.get("error"):
+            raise Exception(data.get("error_description") or data["error"])
+        return folder_id, page_no, folder_prefix, data.get("files", []), data.get("next_page_token", "")
+
+    tasks = {asyncio.create_task(fetch_page(parent_id, 0, prefix, ""))}
+    try:
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                folder_id, page_no, folder_prefix, entries, next_token = task.result()
+                if next_token:
+                    tasks.add(asyncio.create_task(fetch_page(folder_id, page_no + 1, folder_prefix, next_token)))
+                for f in entries:
+                    for sub_id, sub_prefix in folders_to_list(f, folder_prefix, prefix, selection, known):
+                        tasks.add(asyncio.create_task(fetch_page(sub_id, 0, sub_prefix, "")))
+                yield folder_id, page_no, folder_prefix, entries
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def share_file_index(share_id, pass_code_token="", parent_id="", fresh=False, selection=None):
+    key = listing_key(share_id, parent_id, pass_code_token, selection)
+    index = None if fresh else listing_cache.get(key)
+    if index is None:
+        pages = {}
+        async for folder_id, page_no, _, entries in crawl_share_pages(share_id, pass_code_token, parent_id,
+                                                                      selection=selection):
+            pages[folder_id, page_no] = entries
+        index = FileIndex.from_pages(pages, parent_id, selection)
+        listing_cache.set(key, index)
+    return index
+
+async def list_share_files(share_id, pass_code_token="", parent_id="", prefix="", fresh=False, selection=None):
+    index = await share_file_index(share_id, pass_code_token, parent_id, fresh, selection)
+    return index.select(selection, prefix)
+
+async def get_file_download_link(share_id, file_id, pass_code_token="", fresh=False):
+    key = (share_id, file_id)
+    url = None if fresh else link_cache.get(key)
+    if url is None:
+        params = {"share_id": share_id, "file_id": file_id, "pass_code_token": pass_code_token}
+        data = await pikpak_get("/drive/v1/share/file_info", params, share_id)
+        if data.get("error"):
+            raise Exception(data.get("error_description") or data["error"])
+        url = download_link_from_info(data.get("file_info", {}))
+        if url:
+            link_cache.set(key, url, link_ttl(url))
+    return url
+
+async def resolve_links(share_id, files, pass_code_token=""):
+    """Yield (index, entry) as each file's link resolves, at most LINK_WORKERS at a time."""
+    limit = asyncio.Semaphore(LINK_WORKERS)
+
+    async def resolve(i, f):
+        entry = {"id": f["id"], "name": f["name"], "size": f.get("size", "0"), "hash": f.get("hash", ""),
+                 "download_url": ""}
+        async with limit:
+            try:
+                entry["download_url"] = await get_file_download_link(share_id, f["id"], pass_code_token)
+            except Exception as e:
+                entry["error"] = str(e)[:300]
+        return i, entry
+
+    tasks = [asyncio.create_task(resolve(i, f)) for i, f in enumerate(files)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def dropbox_error_text(body):
+    try:
+        ej = json.loads(body)
+        return ej.get("error_summary", ej.get("error", {}).get(".tag", body[:500].decode(errors="replace")))
+    except Exception:
+        return body[:500].decode(errors="replace")
+
+async def dropbox_post(token, endpoint, arg, data=b""):
+    status, _, body = await fetch(
+        "POST", f"{core.DROPBOX_CONTENT_URL}/{endpoint}",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/octet-stream",
+            "Dropbox-API-Arg": json.dumps(arg, ensure_ascii=True),
+        },
+        data=data,
+    )
+    if status != 200:
+        raise Exception(f"Dropbox {endpoint.replace('files/upload_session/', 'session/')} {status}: {dropbox_error_text(body)}")
+    metrics.upload_bytes.inc(len(data))
+    return json.loads(body)
+
+async def dropbox_rpc(token, endpoint, payload):
+    status, _, body = await fetch(
+        "POST", f"{core.DROPBOX_API_URL}/{endpoint}",
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        data=json.dumps(payload, ensure_ascii=True),
+    )
+    if status != 200:
+        raise Exception(f"Dropbox {endpoint} {status}: {dropbox_error_text(body)}")
+    return json.loads(body)
+
+async def dropbox_folder_index(token, folder):
+    """Async twin of pikpak_core.dropbox_folder_index."""
+    index = {}
+    try:
+        page = await dropbox_rpc(token, "files/list_folder", {"path": folder, "recursive": True, "limit": 2000})
+    except Exception as e:
+        if "not_found" in str(e):
+            return index
+        raise
+    while True:
+        add_folder_entries(index, page.get("entries", []))
+        if not page.get("has_more"):
+            return index
+        page = await dropbox_rpc(token, "files/list_folder/continue", {"cursor": page["cursor"]})
+
+async def dropbox_finish_batch(token, entries):
+    result = await dropbox_rpc(token, "files/upload_session/finish_batch", {"entries": entries})
+    job_id = result.get("async_job_id")
+    delay = 0.5
+    while result.get(".tag") in ("async_job_id", "in_progress"):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 5)
+        result = await dropbox_rpc(token, "files/upload_session/finish_batch/check", {"async_job_id": job_id})
+    if result.get(".tag") != "complete":
+        raise Exception(f"Dropbox finish_batch: {dropbox_tag_summary(result)}")
+    return result["entries"]
+
+class DropboxBatchCommitter:
+    """asyncio twin of pikpak_core.DropboxBatchCommitter; submit() returns an asyncio Future."""
+
+    def __init__(self, token, batch_size=BATCH_COMMIT_SIZE, window=BATCH_COMMIT_WINDOW):
+        self.token = token
+        self.batch_size = batch_size
+        self.window = window
+        self.commit_lock = asyncio.Lock()
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def submit(self, entry):
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append((entry, fut))
+        if len(self.pending) >= self.batch_size:
+            self.spawn(self.commit(self.take()))
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, lambda: self.spawn(self.flush()))
+        return fut
+
+    def take(self):
+        batch, self.pending = self.pending, []
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        return batch
+
+    async def flush(self):
+        batch = self.take()
+        if batch:
+            await self.commit(batch)
+
+    async def commit(self, batch):
+        async with self.commit_lock:
+            try:
+                results = await dropbox_finish_batch(self.token, [entry for entry, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                return
+            for (_, fut), res in zip(batch, results):
+                if res.get(".tag") == "success":
+                    fut.set_result(res)
+                else:
+                    fut.set_exception(Exception(f"Dropbox finish_batch: {dropbox_tag_summary(res.get('failure', res))}"))
+
+async def dropbox_upload_chunks(token, chunks, dropbox_path, total_size=0, progress_callback=None, batch=None,
+                                checkpoint=None, resume=None, overwrite=False):
+    """Async twin of pikpak_core.dropbox_upload_chunks; `chunks` is an async iterator, `checkpoint` async."""
+    commit = commit_info(dropbox_path, overwrite)
+    chunks = chunks.__aiter__()
+    current = await anext(chunks, b"")
+    if resume:
+        session_id, offset = resume[:2]
+        following = None
+    else:
+        following = await anext(chunks, None)
+    if following is None and not resume:
+        if batch is not None:
+            started = await dropbox_post(token, "files/upload_session/start", {"close": True}, current)
+            if progress_callback:
+                progress_callback(100)
+            return batch.submit({"cursor": {"session_id": started["session_id"], "offset": len(current)},
+                                 "commit": commit})
+        result = await dropbox_post(token, "files/upload", commit, current)
+        if progress_callback:
+            progress_callback(100)
+        return result
+
+    if not resume:
+        session_id = (await dropbox_post(token, "files/upload_session/start", {"close": False}, current))["session_id"]
+        offset = len(current)
+        if checkpoint:
+            await checkpoint(session_id, offset)
+        current = following
+    async for following in chunks:
+        if progress_callback and total_size:
+            progress_callback(min(int(offset * 100 / total_size), 99))
+        await dropbox_post(token, "files/upload_session/append_v2",
+                           {"cursor": {"session_id": session_id, "offset": offset}, "close": False}, current)
+        offset += len(current)
+        if checkpoint:
+            await checkpoint(session_id, offset)
+        current = following
+    result = await dropbox_post(token, "files/upload_session/finish",
+                                {"cursor": {"session_id": session_id, "offset": offset}, "commit": commit}, current)
+    if progress_callback:
+        progress_callback(100)
+    return result
+
+async def dropbox_upload_concurrent(token, pieces, dropbox_path, total_size=0, progress_callback=None, checkpoint=None,
+                                    resume=None, workers=None, overwrite=False):
+    """Async twin of pikpak_core.dropbox_upload_concurrent; `pieces` is an async iterator, `checkpoint` async."""
+    workers = workers or UPLOAD_CONCURRENCY
+    commit = commit_info(dropbox_path, overwrite)
+    if resume:
+        session_id, offset = resume[:2]
+    else:
+        session_id = (await dropbox_post(token, "files/upload_session/start",
+                                         {"close": False, "session_type": "concurrent"}))["session_id"]
+        offset = 0
+        if checkpoint:
+            await checkpoint(session_id, 0, True)
+    sizer = ChunkSizer(max_size=upload_block_limit(workers))
+    committed = acked = offset
+    accepted = {}
+
+    async def append(start, block, close):
+        started = time.monotonic()
+        await dropbox_post(token, "files/upload_session/append_v2",
+                           {"cursor": {"session_id": session_id, "offset": start}, "close": close}, block)
+        sizer.observe(len(block), time.monotonic() - started)
+        return start, start + len(block)
+
+    blocks = rechunk(pieces, sizer).__aiter__()
+    current = await anext(blocks, None)
+    if current is None and not (resume and offset == total_size):
+        # Nothing left to send: close the session (unless the closing block already landed)
+        await dropbox_post(token, "files/upload_session/append_v2",
+                           {"cursor": {"session_id": session_id, "offset": offset}, "close": True})
+    pending = set()
+    try:
+        while current is not None or pending:
+            if current is not None:
+                following = await anext(blocks, None)
+                pending.add(asyncio.create_task(append(offset, current, following is None)))
+                offset += len(current)
+                current = following
+                if len(pending) < workers and current is not None:
+                    continue
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            errors = [task.exception() for task in done if task.exception()]
+            if errors:
+                raise errors[0]
+            for task in done:
+                start, end = task.result()
+                accepted[start] = end
+                acked += end - start
+            while committed in accepted:
+                committed = accepted.pop(committed)
+            if checkpoint:
+                await checkpoint(session_id, committed, True)
+            if progress_callback and total_size:
+                progress_callback(min(int(acked * 100 / total_size), 99))
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    result = await dropbox_post(token, "files/upload_session/finish",
+                                {"cursor": {"session_id": session_id, "offset": offset}, "commit": commit})
+    if progress_callback:
+        progress_callback(100)
+    return result
+
+
+async def rechunk(pieces, size):
+    next_size = size if callable(size) else lambda: size
+    buf = bytearray()
+    async for piece in pieces:
+        buf += piece
+        while len(buf) >= (n := next_size()):
+            with memoryview(buf) as mv:
+                block = bytes(mv[:n])
+            del buf[:n]
+            yield block
+    if buf:
+        yield bytes(buf)
+
+async def prefetch(pieces, depth):
+    """Read `pieces` in a separate task, keeping at most `depth` items buffered."""
+    q = asyncio.Queue(maxsize=depth)
+
+    async def produce():
+        try:
+            async for item in pieces:
+                await q.put(("item", item))
+            await q.put(("end", None))
+        except Exception as e:
+            await q.put(("error", e))
+
+    task = asyncio.create_task(produce())
+    try:
+        while True:
+            kind, item = await q.get()
+            if kind == "end":
+                return
+            if kind == "error":
+                raise item
+            yield item
+    finally:
+        task.cancel()
+
+async def iter_stream(resp, skip=0):
+    """Yield a response body in DOWNLOAD_CHUNK pieces, dropping the first `skip` bytes."""
+    buf = bytearray()
+    try:
+        async for data in resp.content.iter_any():
+            if skip:
+                dropped = min(skip, len(data))
+                data = data[dropped:]
+                skip -= dropped
+            buf += data
+            if len(buf) >= DOWNLOAD_CHUNK:
+                yield bytes(buf)
+                buf.clear()
+        if buf:
+            yield bytes(buf)
+    finally:
+        resp.release()
+
+async def fetch_range(dl_url, start, end, attempts=3):
+    for attempt in range(attempts):
+        try:
+            status, _, body = await fetch("GET", dl_url,
+                                          headers={"User-Agent": USER_AGENT, "Range": f"bytes={start}-{end - 1}"})
+            if status != 206 or len(body) != end - start:
+                raise Exception(f"Download: segmento {start}-{end} incompleto ({len(body)} bytes, HTTP {status})")
+            return body
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+
+async def iter_segments(dl_url, first_resp, start, end, workers):
+    bounds = iter([(a, min(a + SEGMENT_SIZE, end)) for a in range(start, end, SEGMENT_SIZE)])
+    window = []
+    try:
+        for a, b in bounds:
+            window.append(asyncio.create_task(fetch_range(dl_url, a, b)))
+            if len(window) >= workers:
+                break
+        async for chunk in iter_stream(first_resp):
+            yield chunk
+        while window:
+            data = await window.pop(0)
+            nxt = next(bounds, None)
+            if nxt:
+                window.append(asyncio.create_task(fetch_range(dl_url, *nxt)))
+            for i in range(0, len(data), DOWNLOAD_CHUNK):
+                yield data[i:i + DOWNLOAD_CHUNK]
+    finally:
+        for task in window:
+            task.cancel()
+
+async def open_download(dl_url, start=0, size_hint=0, segments=None):
+    """Async twin of pikpak_core.open_download. Returns (total_size, async pieces)."""
+    segments = segments or DOWNLOAD_SEGMENTS
+    if start and size_hint and start >= size_hint:
+        return size_hint, iter_stream_empty()
+    segmented = segments > 1 and size_hint - start >= SEGMENTED_MIN_SIZE
+    headers = {"User-Agent": USER_AGENT}
+    if segmented:
+        headers["Range"] = f"bytes={start}-{start + SEGMENT_SIZE - 1}"
+    elif start:
+        headers["Range"] = f"bytes={start}-"
+    started = time.monotonic()
+    resp = await http_session.get(dl_url, headers=headers)
+    record_response(dl_url, resp.status, started)
+    if resp.status >= 400:
+        resp.release()
+        raise Exception(f"HTTP {resp.status}: download do PikPak falhou")
+
+    if resp.status != 206:
+        total_size = int(resp.headers.get("Content-Length", 0)) or size_hint
+        return total_size, iter_stream(resp, skip=start)
+    m = re.match(r"bytes (\d+)-(\d+)/(\d+)", resp.headers.get("Content-Range", ""))
+    total_size = int(m.group(3)) if m else size_hint
+    if not segmented or not m:
+        return total_size, iter_stream(resp)
+    return total_size, iter_segments(dl_url, resp, int(m.group(2)) + 1, total_size, segments)
+
+async def iter_stream_empty():
+    return
+    yield
+
+async def iter_download(pieces, total_size, emit, start=0):
+    downloaded = start
+    async for chunk in pieces:
+        downloaded += len(chunk)
+        metrics.download_bytes.inc(len(chunk))
+        if total_size > 0:
+            emit("downloading", percent=min(int(downloaded * 100 / total_size), 100), bytes=downloaded - start)
+        yield chunk
+
+async def transfer_file(token, f, dbx_path, share_id, pass_code_token="", emit=None, mode=None, batch=None,
+                        journal=None):
+    """Async twin of pikpak_core.transfer_file. Always streams; there is no temp-file mode."""
+    emit = emit or (lambda event_type, **fields: None)
+    dl_url = f.get("download_url", "")
+    if not dl_url:
+        dl_url = await get_file_download_link(share_id, f["id"], pass_code_token)
+    if not dl_url:
+        raise Exception("Sem link de download")
+
+    # Journal writes and hashing go through to_thread: SQLite commits and
+    # SHA-1/SHA-256 over 8 MB pieces would stall every transfer on the loop.
+    checkpoint = None
+    if journal:
+        checkpoint = lambda session_id, offset, concurrent=False: asyncio.to_thread(
+            journal.checkpoint, share_id, f["id"], dbx_path, session_id, offset, concurrent)
+        resume = resume_point(await asyncio.to_thread(journal.lookup, share_id, f["id"], dbx_path))
+        if resume:
+            try:
+                return await copy_to_dropbox(token, dl_url, f, dbx_path, emit, batch, checkpoint, resume)
+            except Exception as e:
+                if "lookup_failed" not in str(e):
+                    raise
+                await asyncio.to_thread(journal.forget, share_id, f["id"])
+    return await copy_to_dropbox(token, dl_url, f, dbx_path, emit, batch, checkpoint)
+
+def digest_piece(piece, check, hasher):
+    check.update(piece)
+    if hasher:
+        hasher.update(piece)
+
+async def verify_pieces(pieces, check, hasher=None):
+    async for piece in pieces:
+        await asyncio.to_thread(digest_piece, piece, check, hasher)
+        yield piece
+    check.verify()
+
+async def verify_commit(token, result, hasher, size=0):
+    """Async twin of pikpak_core.verify_commit."""
+    try:
+        return check_content_hash(result, hasher, size)
+    except Exception:
+        try:
+            await dropbox_rpc(token, "files/delete_v2", {"path": result.get("path_lower") or result["path_display"]})
+        except Exception:
+            pass
+        raise
+
+async def checked_commit(token, fut, hasher, size):
+    return await verify_commit(token, await fut, hasher, size)
+
+async def copy_to_dropbox(token, dl_url, f, dbx_path, emit, batch=None, checkpoint=None, resume=None):
+    offset = resume[1] if resume else 0
+    emit("downloading", percent=0)
+    hasher = DropboxContentHasher() if VERIFY_HASH and not offset else None
+    overwrite = bool(f.get("overwrite"))
+    upload_progress = lambda pct: emit("uploading", percent=pct)
+    async with dropbox_sessions:
+        # The download is opened inside the slot, so it isn't left idle (see pikpak_core.copy_to_dropbox)
+        total_size, pieces = await open_download(dl_url, offset, file_size(f))
+        check = DownloadCheck(f, total_size, offset)
+        pieces = verify_pieces(iter_download(pieces, total_size, emit, offset), check, hasher)
+        emit("uploading", percent=int(offset * 100 / total_size) if total_size else 0)
+        if use_concurrent_upload(total_size, resume):
+            result = await dropbox_upload_concurrent(token, prefetch(pieces, STREAM_BUFFER_CHUNKS), dbx_path,
+                                                     total_size, upload_progress, checkpoint, resume,
+                                                     overwrite=overwrite)
+        else:
+            chunks = rechunk(prefetch(pieces, STREAM_BUFFER_CHUNKS), CHUNK_SIZE)
+            result = await dropbox_upload_chunks(token, chunks, dbx_path, total_size, upload_progress, batch,
+                                                 checkpoint, resume, overwrite)
+    if isinstance(result, asyncio.Future):
+        return asyncio.ensure_future(checked_commit(token, result, hasher, total_size))
+    return await verify_commit(token, result, hasher, total_size)
+
+async def run_transfers(token, folder, share_id, pass_code_token, files, emit, mode=None, workers=None,
+                        batch_commit=None, resume=True, skip_existing=None):
+    """Async twin of pikpak_core.run_transfers: same events, same return value."""
+    limit = asyncio.Semaphore(workers or TRANSFER_WORKERS)
+    batch = DropboxBatchCommitter(token) if (BATCH_COMMIT if batch_commit is None else batch_commit) else None
+    journal = await asyncio.to_thread(get_journal) if resume else None
+    index = None
+    if SKIP_EXISTING if skip_existing is None else skip_existing:
+        try:
+            index = await dropbox_folder_index(token, folder)
+        except Exception:
+            pass
+    ok = 0
+
+    async def report(i, result=None, error=None, skipped=False):
+        nonlocal ok
+        if error is not None:
+            if journal and is_corrupt(error):
+                await asyncio.to_thread(journal.forget, share_id, files[i]["id"])  # don't resume into the bad session
+            metrics.files_transferred.inc(result="error", error_class=error_class(error))
+            emit({"type": "error", "index": i, "size": file_size(files[i]), "detail": transfer_error_detail(error)})
+            return
+        metrics.files_transferred.inc(result="skipped" if skipped else "done")
+        ok += 1
+        path = result.get("path_display", "")
+        if journal and not skipped:
+            await asyncio.to_thread(journal.complete, share_id, files[i]["id"], dropbox_path_for(folder, files[i]), path)
+        emit({"type": "done", "index": i, "path": path, "size": file_size(files[i]),
+              **({"skipped": True} if skipped else {})})
+
+    async def await_commit(i, fut):
+        try:
+            result = await fut
+        except Exception as e:
+            return await report(i, error=e)
+        await report(i, result)
+
+    async def work(i, f):
+        async with limit:
+            emit({"type": "start", "index": i, "name": f["name"].split("/")[-1]})
+            file_emit = lambda event_type, **fields: emit({"type": event_type, "index": i, **fields})
+            if journal:
+                prior = await asyncio.to_thread(journal.lookup, share_id, f["id"], dropbox_path_for(folder, f))
+                if sent_before(prior, f):
+                    return await report(i, {"path_display": prior["path"]}, skipped=True)
+            existing = find_existing(index, dropbox_path_for(folder, f), f)
+            if existing:
+                return await report(i, {"path_display": existing["path"]}, skipped=True)
+            metrics.transfers_in_flight.inc()
+            try:
+                result = await transfer_file(token, f, dropbox_path_for(folder, f), share_id, pass_code_token,
+                                             file_emit, mode, batch, journal)
+            except Exception as e:
+                return await report(i, error=e)
+            finally:
+                metrics.transfers_in_flight.dec()
+        # Batched commits are awaited outside the worker slot
+        if isinstance(result, asyncio.Future):
+            return asyncio.create_task(await_commit(i, result))
+        await report(i, result)
+
+    commits = [t for t in await asyncio.gather(*(work(i, f) for i, f in enumerate(files))) if t]
+    if batch:
+        await batch.flush()
+    if commits:
+        await asyncio.gather(*commits)
+    return ok
+
+
+class AsyncEngine:
+    """Runs the coroutines above on one background event loop behind blocking calls."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="pikpak-async", daemon=True)
+        self.thread.start()
+        self.call(open_http_session())
+        atexit.register(self.close)
+
+    def close(self):
+        # Also runs from atexit after an explicit close: a stopped loop would never answer call()
+        if http_session and self.loop.is_running():
+            self.call(http_session.close())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def iterate(self, agen):
+        """Drive an async generator on the loop and yield its items to the calling thread."""
+        q = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    q.put(("item", item))
+                q.put(("end", None))
+            except BaseException as e:
+                q.put(("error", e))
+                raise
+
+        fut = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                kind, item = q.get()
+                if kind == "end":
+                    return
+                if kind == "error":
+                    raise item
+                yield item
+        finally:
+            fut.cancel()
+
+    def get_share_info(self, share_id, fresh=False):
+        return self.call(get_share_info(share_id, fresh))
+
+    def list_share_files(self, share_id, pass_code_token="", parent_id="", prefix="", fresh=False, selection=None):
+        return self.call(list_share_files(share_id, pass_code_token, parent_id, prefix, fresh, selection))
+
+    def share_file_index(self, share_id, pass_code_token="", parent_id="", fresh=False, selection=None):
+        return self.call(share_file_index(share_id, pass_code_token, parent_id, fresh, selection))
+
+    def crawl_share_pages(self, share_id, pass_code_token="", parent_id="", prefix="", selection=None, known=None):
+        return self.iterate(crawl_share_pages(share_id, pass_code_token, parent_id, prefix, selection, known))
+
+    def resolve_links(self, share_id, files, pass_code_token=""):
+        return self.iterate(resolve_links(share_id, files, pass_code_token))
+
+    def run_transfers(self, *args, **kwargs):
+        return self.call(run_transfers(*args, **kwargs))
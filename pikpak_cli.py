@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Headless batch mode for the PikPak Link Extractor: copies every share listed
+in a file to Dropbox without the web UI (and without importing Flask).
+
+Run: python pikpak_cli.py shares.txt --token $DROPBOX_TOKEN --folder /Mirror
+Each line of the file is a share URL (or id), optionally followed by the
+Dropbox folder for it; blank lines and # comments are skipped. Progress is
+printed as one JSON object per line, ending with a "summary" line. The exit
+status is 0 when every file made it, 1 otherwise. Any PIKPAK_* setting
+applies as in the web app, including the journal that lets a rerun pick up
+where an interrupted one stopped. With --sync only what changed since the
+last sync of the same share and folder is sent (see pikpak_core.plan_sync).
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pikpak_core
+from pikpak_core import ENGINE, TRANSFER_MODE, TRANSFER_WORKERS, MAX_TRANSFER_WORKERS, ShareSelection, extract_share_id
+
+PROGRESS_INTERVAL = 1  # min seconds between printed progress lines of one file (--progress)
+
+output_lock = threading.Lock()
+
+
+def emit_line(obj):
+    with output_lock:
+        sys.stdout.write(json.dumps(obj, ensure_ascii=True) + "\n")
+        sys.stdout.flush()
+
+
+def read_shares(path):
+    """[(url, folder or None)] from a shares file ("-" reads stdin)."""
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with f:
+        shares = []
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            url, _, folder = line.partition(" ")
+            shares.append((url, folder.strip() or None))
+        return shares
+
+
+def share_folder(base, title, share_id):
+    """Default destination of a share: a subfolder of `base` named after its title."""
+    name = re.sub(r'[<>:"/\\|?*]', "_", title).strip(" .") or share_id
+    return f"{base}/{name}"
+
+
+def copy_share(engine, args, url, folder, selection):
+    """Copy one share; returns its summary dict (also printed as a "share_done" line)."""
+    share_id = extract_share_id(url)
+    started = time.time()
+    counts = {"ok": 0, "skipped": 0, "failed": 0, "bytes": 0}
+    summary = {"type": "share_done", "share": share_id, "folder": folder, "total": 0, **counts}
+    try:
+        info = engine.get_share_info(share_id)
+        if info.get("error"):
+            raise Exception(info.get("error_description", "Erro"))
+        pass_code_token = info.get("pass_code_token", "")
+        folder = (folder or share_folder(args.folder, info.get("title", ""), share_id)).rstrip("/")
+        sync, skip_existing = None, False if args.no_skip_existing else None
+        if args.sync:
+            sync_id = uuid.uuid4().hex[:12]
+            files, sync = pikpak_core.plan_sync(engine, sync_id, folder, share_id, pass_code_token, selection,
+                                                args.full, args.delete)
+            if not sync["first"]:
+                skip_existing = False
+        else:
+            files = engine.list_share_files(share_id, pass_code_token, selection=selection)
+        summary.update(folder=folder, total=len(files))
+        emit_line({"type": "share", "share": share_id, "title": info.get("title", ""), "folder": folder,
+                   "total": len(files), "bytes": sum(map(pikpak_core.file_size, files)),
+                   **({"sync": sync} if sync else {})})
+        failed_ids = []
+        last_progress = {}
+        lock = threading.Lock()
+
+        def emit(event):
+            kind = event["type"]
+            if kind in pikpak_core.PROGRESS_EVENTS:
+                now = time.monotonic()
+                if not args.progress or now - last_progress.get((event["index"], kind), 0) < PROGRESS_INTERVAL:
+                    return
+                last_progress[event["index"], kind] = now
+            with lock:
+                if kind == "done":
+                    counts["skipped" if event.get("skipped") else "ok"] += 1
+                    counts["bytes"] += 0 if event.get("skipped") else event.get("size", 0)
+                elif kind == "error":
+                    counts["failed"] += 1
+                    failed_ids.append(files[event["index"]]["id"])
+            if kind != "start" or args.progress:
+                emit_line({"share": share_id, "name": files[event["index"]]["name"], **event})
+
+        engine.run_transfers(args.token, folder, share_id, pass_code_token, files, emit, args.mode, args.workers,
+                             None, not args.no_resume, skip_existing)
+        if sync:
+            pikpak_core.commit_sync(sync_id, failed_ids, args.token)
+    except Exception as e:
+        summary["error"] = str(e)[:500]
+    summary.update(counts, seconds=round(time.time() - started, 1))
+    emit_line(summary)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copia compartilhamentos do PikPak para o Dropbox, sem a interface web")
+    parser.add_argument("shares", help='arquivo com uma URL de compartilhamento por linha ("-" lê da entrada padrão)')
+    parser.add_argument("--token", default=os.environ.get("PIKPAK_DROPBOX_TOKEN", ""),
+                        help="token do Dropbox (ou PIKPAK_DROPBOX_TOKEN)")
+    parser.add_argument("--folder", default="/PikPak Downloads",
+                        help="pasta do Dropbox; cada compartilhamento vai numa subpasta com o nome dele")
+    parser.add_argument("--shares", dest="share_workers", type=int, default=2,
+                        help="compartilhamentos processados ao mesmo tempo")
+    parser.add_argument("--workers", type=int, default=TRANSFER_WORKERS,
+                        help="arquivos transferidos ao mesmo tempo por compartilhamento")
+    parser.add_argument("--mode", choices=("stream", "tempfile"), default=TRANSFER_MODE)
+    parser.add_argument("--include", action="append", help="glob de arquivos a incluir (pode repetir)")
+    parser.add_argument("--exclude", action="append", help="glob de arquivos/pastas a ignorar (pode repetir)")
+    parser.add_argument("--max-depth", type=int, help="níveis de subpastas percorridos")
+    parser.add_argument("--min-size", type=int, help="tamanho mínimo, em bytes")
+    parser.add_argument("--max-size", type=int, help="tamanho máximo, em bytes")
+    parser.add_argument("--mime", action="append", help="prefixo de tipo MIME, ex. video/ (pode repetir)")
+    parser.add_argument("--no-resume", action="store_true", help="ignora o diário e envia tudo de novo")
+    parser.add_argument("--no-skip-existing", action="store_true",
+                        help="não pula arquivos que já estão no Dropbox com o mesmo nome e tamanho")
+    parser.add_argument("--sync", action="store_true",
+                        help="envia só o que mudou desde a última sincronização da mesma pasta (PIKPAK_SNAPSHOTS)")
+    parser.add_argument("--full", action="store_true", help="com --sync, lista todas as pastas de novo")
+    parser.add_argument("--delete", action="store_true",
+                        help="com --sync, apaga do Dropbox os arquivos que saíram do compartilhamento")
+    parser.add_argument("--progress", action="store_true", help="também imprime início e progresso de cada arquivo")
+    args = parser.parse_args()
+    if not args.token:
+        parser.error("informe --token ou PIKPAK_DROPBOX_TOKEN")
+    args.folder = args.folder.rstrip("/")
+    args.workers = max(1, min(args.workers, MAX_TRANSFER_WORKERS))
+
+    shares = read_shares(args.shares)
+    selection = ShareSelection.from_params({
+        "include": args.include, "exclude": args.exclude, "max_depth": args.max_depth,
+        "min_size": args.min_size, "max_size": args.max_size, "mime": args.mime,
+    })
+    engine = pikpak_core
+    if ENGINE == "async":
+        from pikpak_async import AsyncEngine
+        engine = AsyncEngine()
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.share_workers)) as pool:
+        results = list(pool.map(lambda share: copy_share(engine, args, share[0], share[1], selection), shares))
+    failed_shares = [r["share"] for r in results if r.get("error") or r["failed"]]
+    emit_line({
+        "type": "summary", "shares": len(results), "failed_shares": failed_shares,
+        "files": sum(r["total"] for r in results), "ok": sum(r["ok"] for r in results),
+        "skipped": sum(r["skipped"] for r in results), "failed": sum(r["failed"] for r in results),
+        "bytes": sum(r["bytes"] for r in results), "seconds": round(time.time() - started, 1),
+    })
+    return 1 if failed_shares else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2155 @@
+"""
+Core engine of the PikPak Link Extractor: PikPak share listing and link
+resolution, Dropbox uploads and the transfer scheduler. Has no Flask
+dependency, so it can be driven by the web app or by other front ends.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import re
+import hashlib
+import fnmatch
+import functools
+import json
+import time
+import zlib
+import tempfile
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from array import array
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+
+import pikpak_metrics as metrics
+
+API_BASE = os.environ.get("PIKPAK_API_BASE", "https://api-drive.mypikpak.net")
+DROPBOX_CONTENT_URL = os.environ.get("PIKPAK_DROPBOX_CONTENT_URL", "https://content.dropboxapi.com/2")
+DROPBOX_API_URL = os.environ.get("PIKPAK_DROPBOX_API_URL", "https://api.dropboxapi.com/2")
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+CLIENT_ID = "YNxT9w7GMdWvEOKa"
+CHUNK_SIZE = 50 * 1024 * 1024  # 50MB chunks for Dropbox upload sessions
+LIST_WORKERS = int(os.environ.get("PIKPAK_LIST_WORKERS", "16"))  # concurrent share/detail folder fetches
+LINK_WORKERS = int(os.environ.get("PIKPAK_LINK_WORKERS", "16"))  # concurrent share/file_info lookups
+HTTP_POOL_SIZE = int(os.environ.get("PIKPAK_HTTP_POOL_SIZE", "32"))  # keep-alive connections per host
+HTTP_RETRIES = int(os.environ.get("PIKPAK_HTTP_RETRIES", "3"))  # retries on 429/5xx, with backoff
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+PIKPAK_RETRY_STATUSES = (500, 502, 503, 504)  # 429s are retried by pikpak_api_get, through the limiter
+POST_RETRY_STATUSES = (429, 503)  # answers that mean a POST was not applied, so sending it again is safe
+API_RATE = float(os.environ.get("PIKPAK_API_RATE", "50"))  # starting PikPak API requests per second
+API_RATE_MAX = float(os.environ.get("PIKPAK_API_RATE_MAX", "1000"))  # the adaptive rate never goes above this
+API_CONCURRENCY = int(os.environ.get("PIKPAK_API_CONCURRENCY", "32"))  # max PikPak API requests in flight (adaptive below it)
+LATENCY_SPIKE_FACTOR = 3  # a response this many times slower than the running baseline counts as throttling
+THROTTLE_ERRORS = ("too_many", "too_frequent", "rate_limit", "captcha")  # PikPak error codes that mean "slow down"
+DOWNLOAD_CHUNK = 8 * 1024 * 1024  # read size for PikPak CDN downloads
+SIMPLE_UPLOAD_MAX = 140 * 1024 * 1024  # files/upload limit for a single request
+UPLOAD_CONCURRENCY = int(os.environ.get("PIKPAK_UPLOAD_CONCURRENCY", "4"))  # append_v2 calls in flight per large file; 1 = sequential session
+CONCURRENT_BLOCK = 4 * 1024 * 1024  # concurrent-session appends must be multiples of this
+UPLOAD_CHUNK_MIN = 8 * 1024 * 1024
+UPLOAD_CHUNK_MAX = 64 * 1024 * 1024
+UPLOAD_CHUNK_SECONDS = 4  # adaptive appends aim to take about this long each
+UPLOAD_MEMORY = int(os.environ.get("PIKPAK_UPLOAD_MEMORY", "512")) * 1024 * 1024  # MB of append blocks all concurrent uploads may hold
+TRANSFER_MODE = os.environ.get("PIKPAK_TRANSFER_MODE", "stream")  # "stream" (no temp file) or "tempfile"
+STREAM_BUFFER_CHUNKS = int(os.environ.get("PIKPAK_STREAM_BUFFER", "4"))  # download chunks buffered ahead of the uploader
+TRANSFER_WORKERS = int(os.environ.get("PIKPAK_TRANSFER_WORKERS", "4"))  # files transferred at once per upload request
+MAX_TRANSFER_WORKERS = 32  # upper bound for the per-request "workers" field
+MAX_PAGE_SIZE = 5000  # largest "limit" /api/list accepts for one page of a listing
+DROPBOX_MAX_SESSIONS = int(os.environ.get("PIKPAK_DROPBOX_SESSIONS", "4"))  # Dropbox uploads in progress, process-wide
+BATCH_COMMIT = os.environ.get("PIKPAK_BATCH_COMMIT", "1") == "1"  # commit small files with finish_batch
+BATCH_COMMIT_SIZE = 1000  # Dropbox's limit for entries in one finish_batch call
+BATCH_COMMIT_WINDOW = float(os.environ.get("PIKPAK_BATCH_WINDOW", "5"))  # max seconds a finished upload waits for its batch
+DOWNLOAD_SEGMENTS = int(os.environ.get("PIKPAK_DOWNLOAD_SEGMENTS", "4"))  # concurrent Range requests per large file
+SEGMENT_SIZE = 16 * 1024 * 1024  # bytes per Range request
+SEGMENTED_MIN_SIZE = 64 * 1024 * 1024  # smaller files are downloaded as a single stream
+LIST_CACHE_TTL = float(os.environ.get("PIKPAK_LIST_CACHE_TTL", "600"))  # seconds a share listing is reused
+LIST_CACHE_SIZE = int(os.environ.get("PIKPAK_LIST_CACHE_SIZE", "128"))  # share listings kept (LRU)
+LINK_CACHE_SIZE = int(os.environ.get("PIKPAK_LINK_CACHE_SIZE", "50000"))  # resolved download links kept (LRU)
+LINK_TTL_DEFAULT = 3600  # for links that don't encode their expiry
+LINK_EXPIRY_MARGIN = 300  # stop reusing a link this many seconds before it expires
+SKIP_EXISTING = os.environ.get("PIKPAK_SKIP_EXISTING", "1") == "1"  # skip files already in the destination with the same name and size
+VERIFY_HASH = os.environ.get("PIKPAK_VERIFY_HASH", "1") == "1"  # check downloads against PikPak's hash and uploads against Dropbox's content_hash
+JOURNAL_PATH = os.environ.get("PIKPAK_JOURNAL", "pikpak_journal.db")  # resumable transfer journal; "" disables it
+ENGINE = os.environ.get("PIKPAK_ENGINE", "threads")  # "threads", or "async" for the asyncio engine (needs aiohttp)
+JOB_WORKERS = int(os.environ.get("PIKPAK_JOB_WORKERS", "2"))  # transfer jobs running at once; the rest wait queued
+JOB_HISTORY = 500  # finished jobs kept for status queries
+TASK_STORE = os.environ.get("PIKPAK_TASK_STORE", "")  # SQLite job store shared with pikpak_worker.py processes; "" runs jobs in-process
+TASK_LEASE = float(os.environ.get("PIKPAK_TASK_LEASE", "60"))  # seconds a claimed file stays with a worker that stopped heartbeating
+TASK_CLAIM = int(os.environ.get("PIKPAK_TASK_CLAIM", "50"))  # most files a worker claims at once, so small ones share finish_batch calls
+TASK_CLAIM_BYTES = int(os.environ.get("PIKPAK_TASK_CLAIM_MB", "256")) * 1024 * 1024  # a claim stops growing at this size (past `workers` files)
+TASK_ATTEMPTS = 3  # a file whose worker was lost this many times is reported as an error
+SNAPSHOT_PATH = os.environ.get("PIKPAK_SNAPSHOTS", "pikpak_snapshots.db")  # share trees sync jobs diff against; "" disables sync
+SNAPSHOT_FIELDS = ("kind", "id", "name", "size", "hash", "mime_type", "modified_time")  # entry fields a snapshot keeps
+SNAPSHOT_STAGED_TTL = 7 * 86400  # seconds a sync job that never finished keeps its staged tree
+DELETE_BATCH_SIZE = 1000  # paths per files/delete_batch call
+
+class UpstreamRetry(Retry):
+    """Retry that only sends a POST again when it can't have been applied.
+
+    Connection errors are retried for any method, and so are
+    POST_RETRY_STATUSES answers. After a read timeout or another 5xx,
+    Dropbox may already have appended or committed, so those POSTs are not
+    repeated (idempotent methods still are).
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST":
+            return status_code in POST_RETRY_STATUSES and status_code in (self.status_forcelist or ())
+        return super().is_retry(method, status_code, has_retry_after)
+
+def make_http_session(pool_size=None, retries=None, retry_statuses=RETRY_STATUSES):
+    """Session with per-host keep-alive pools and retry/backoff on `retry_statuses` (429 and 5xx)."""
+    pool_size = pool_size or HTTP_POOL_SIZE
+    retry = UpstreamRetry(
+        total=HTTP_RETRIES if retries is None else retries,
+        backoff_factor=0.5,
+        status_forcelist=retry_statuses,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    # pool_connections = number of hosts kept, pool_maxsize = connections per host
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(record_response)
+    return session
+
+def upstream_endpoint(url):
+    """Metrics label for an upstream URL: "share/detail", "file_info", "append_v2", ... or "cdn"."""
+    for base in (DROPBOX_CONTENT_URL, DROPBOX_API_URL):
+        if url.startswith(base + "/"):
+            endpoint = url[len(base) + 1:].split("?")[0]
+            return endpoint.replace("files/upload_session/", "").replace("files/", "")
+    if url.startswith(API_BASE + "/drive/v1/"):
+        endpoint = url[len(API_BASE) + 10:].split("?")[0]
+        return "file_info" if endpoint == "share/file_info" else endpoint
+    return "cdn"
+
+def record_response(resp, *args, **kwargs):
+    endpoint = upstream_endpoint(resp.url)
+    metrics.upstream_seconds.observe(resp.elapsed.total_seconds(), endpoint=endpoint)
+    retries = getattr(resp.raw, "retries", None)
+    for attempt in (retries.history if retries else ()):
+        if attempt.status:
+            metrics.upstream_requests.inc(endpoint=endpoint, status=attempt.status)
+    metrics.upstream_requests.inc(endpoint=endpoint, status=resp.status_code)
+
+http_session = make_http_session()
+# A 429 retried inside urllib3 would skip the token bucket and AIMD limit
+pikpak_session = make_http_session(retry_statuses=PIKPAK_RETRY_STATUSES)
+
+class AdaptiveLimiter:
+    """Token bucket plus AIMD concurrency limit for one upstream host.
+
+    A request needs a token (refilled at `rate` per second) and a free slot
+    (at most `limit` in flight). Until the first throttle signal both grow
+    5% per clean response (slow start); after that the rate grows about 5%
+    a second and the limit by one per `limit` responses. A throttle signal
+    (429, a throttling error code in the body, a timeout or a latency spike)
+    cuts both to 70%, the rate from what was actually achieved in the last
+    second, at most once a second so one burst of failures doesn't collapse
+    them.
+    """
+
+    def __init__(self, host, rate=API_RATE, max_rate=API_RATE_MAX, max_concurrency=API_CONCURRENCY):
+        self.host = host
+        self.rate = min(rate, max_rate)
+        self.max_rate = max_rate
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self.limit = float(max(1, max_concurrency // 2))
+        self.max_limit = max_concurrency
+        self.in_flight = 0
+        self.slow_start = True
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.second = int(self.updated)
+        self.done_this_second = self.done_last_second = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token and a slot. Returns 0, or how long to wait before trying again."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.in_flight >= int(self.limit):
+                return 0.02
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return
+            time.sleep(delay)
+
+    def release(self, latency, throttled=False):
+        with self.lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if int(now) != self.second:
+                self.done_last_second = self.done_this_second if int(now) == self.second + 1 else 0
+                self.second, self.done_this_second = int(now), 0
+            self.done_this_second += 1
+            spike = self.baseline is not None and latency > LATENCY_SPIKE_FACTOR * max(self.baseline, 0.05)
+            if not throttled and not spike:
+                self.baseline = latency if self.baseline is None else 0.9 * self.baseline + 0.1 * latency
+                if self.slow_start:
+                    self.rate *= 1.05
+                    self.limit *= 1.05
+                else:
+                    self.rate += 0.05  # ~5% a second at `rate` responses per second
+                    self.limit += 1 / self.limit
+                self.rate = min(self.max_rate, self.rate)
+                self.limit = min(self.max_limit, self.limit)
+            else:
+                metrics.upstream_throttled.inc(host=self.host)
+                if now - self.last_decrease >= 1:
+                    self.last_decrease = now
+                    self.slow_start = False
+                    achieved = self.done_last_second or self.rate
+                    self.rate = max(1.0, 0.7 * min(self.rate, achieved))
+                    self.limit = max(1.0, 0.7 * self.limit)
+            metrics.upstream_concurrency_limit.set(int(self.limit), host=self.host)
+            metrics.upstream_rate_limit.set(round(self.rate, 2), host=self.host)
+
+limiters = {}
+limiters_lock = threading.Lock()
+
+def limiter_for(url):
+    host = urlparse(url).netloc
+    with limiters_lock:
+        if host not in limiters:
+            limiters[host] = AdaptiveLimiter(host)
+        return limiters[host]
+
+def is_throttled(status, data):
+    error = str(data.get("error", "")) + str(data.get("error_code", ""))
+    return status == 429 or any(code in error for code in THROTTLE_ERRORS)
+
+def api_error_body(status, body, text=""):
+    """A PikPak response as a dict that always carries "error" when the status isn't 200."""
+    data = body if isinstance(body, dict) else {}
+    if status != 200 and not data.get("error"):
+        data = {**data, "error": f"http_{status}", "error_description": f"HTTP {status}: {text[:200]}".rstrip(": ")}
+    return data
+
+def pikpak_api_get(path, params, headers):
+    """GET a PikPak API endpoint through its host's AdaptiveLimiter. Returns the JSON body.
+
+    Non-200 responses come back as a body with "error" set; throttled
+    requests are retried with backoff before giving up.
+    """
+    url = f"{API_BASE}{path}"
+    limiter = limiter_for(url)
+    for attempt in range(HTTP_RETRIES + 1):
+        limiter.acquire()
+        started = time.monotonic()
+        throttled = True  # timeouts and connection errors count as congestion too
+        try:
+            resp = pikpak_session.get(url, params=params, headers=headers, timeout=15)
+            try:
+                body = resp.json()
+            except ValueError:
+                body = None
+            data = api_error_body(resp.status_code, body, resp.text)
+            throttled = is_throttled(resp.status_code, data)
+        finally:
+            limiter.release(time.monotonic() - started, throttled)
+        if not is_throttled(resp.status_code, data) or attempt == HTTP_RETRIES:
+            return data
+        time.sleep(0.5 * 2 ** attempt)
+
+dropbox_sessions = threading.BoundedSemaphore(DROPBOX_MAX_SESSIONS)
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a per-entry TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None or item[0] <= time.time():
+                if item is not None:
+                    del self.data[key]
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.data[key] = (time.time() + ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """Drop every entry whose key matches predicate (all of them by default). Returns the count."""
+        with self.lock:
+            keys = [k for k in self.data if predicate is None or predicate(k)]
+            for k in keys:
+                del self.data[k]
+        return len(keys)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+# (share_id,) -> share info response
+share_cache = TTLCache(LIST_CACHE_SIZE, LIST_CACHE_TTL)
+# (share_id, parent_id, pass_code_token) -> FileIndex of the crawl
+listing_cache = TTLCache(LIST_CACHE_SIZE, LIST_CACHE_TTL)
+# (share_id, file_id) -> download url, kept until shortly before the link expires
+link_cache = TTLCache(LINK_CACHE_SIZE, LINK_TTL_DEFAULT)
+
+def extract_share_id(url):
+    m = re.search(r'/s/([A-Za-z0-9_-]+)', url)
+    return m.group(1) if m else url.strip()
+
+@functools.lru_cache(maxsize=1024)
+def get_headers(share_id):
+    # Cached per share; callers must treat the returned dict as read-only
+    return {
+        "User-Agent": USER_AGENT,
+        "Referer": "https://mypikpak.com/",
+        "Origin": "https://mypikpak.com",
+        "X-Client-Id": CLIENT_ID,
+        "X-Device-Id": hashlib.md5(share_id.encode()).hexdigest(),
+    }
+
+def get_share_info(share_id, fresh=False):
+    info = None if fresh else share_cache.get((share_id,))
+    if info is not None:
+        return info
+    info = pikpak_api_get("/drive/v1/share", {"share_id": share_id, "thumbnail_size": "SIZE_LARGE"},
+                          get_headers(share_id))
+    if not info.get("error"):
+        share_cache.set((share_id,), info)
+    return info
+
+def fetch_share_page(share_id, pass_code_token, parent_id, page_token, headers):
+    """Fetch one share/detail page of a folder. Returns (entries, next_page_token)."""
+    params = {
+        "share_id": share_id, "parent_id": parent_id,
+        "thumbnail_size": "SIZE_LARGE", "limit": "100", "with_audit": "false",
+    }
+    if pass_code_token:
+        params["pass_code_token"] = pass_code_token
+    if page_token:
+        params["page_token"] = page_token
+    data = pikpak_api_get("/drive/v1/share/detail", params, headers)
+    if data.get("error"):
+        # An error page must not pass for an empty folder
+        raise Exception(data.get("error_description") or data["error"])
+    return data.get("files", []), data.get("next_page_token", "")
+
+def file_entry(f, prefix=""):
+    return {
+        "id": f.get("id", ""),
+        "name": prefix + f.get("name", ""),
+        "size": f.get("size", "0"),
+        "mime_type": f.get("mime_type", ""),
+        "hash": f.get("hash", ""),
+    }
+
+def listing_key(share_id, parent_id="", pass_code_token="", selection=None):
+    """listing_cache key; a selection that prunes the crawl gets its own entry."""
+    key = (share_id, parent_id, pass_code_token)
+    return key + (selection.crawl_key(),) if selection and selection.prunes() else key
+
+def share_file_index(share_id, pass_code_token="", parent_id="", max_workers=None, fresh=False, selection=None):
+    """A share's FileIndex, reusing a cached crawl of the same folder when possible.
+
+    With a ShareSelection, only the folders and files its path rules allow
+    are crawled and indexed; its size and mime rules are left to
+    FileIndex.select/query so they don't need a crawl of their own.
+    """
+    key = listing_key(share_id, parent_id, pass_code_token, selection)
+    index = None if fresh else listing_cache.get(key)
+    if index is None:
+        pages = {}
+        for folder_id, page_no, _, entries in crawl_share_pages(share_id, pass_code_token, parent_id,
+                                                                max_workers=max_workers, selection=selection):
+            pages[folder_id, page_no] = entries
+        index = FileIndex.from_pages(pages, parent_id, selection)
+        listing_cache.set(key, index)
+    return index
+
+def list_share_files(share_id, pass_code_token="", parent_id="", prefix="", max_workers=None, fresh=False,
+                     selection=None):
+    """List a share's files, reusing a cached crawl of the same folder when possible."""
+    index = share_file_index(share_id, pass_code_token, parent_id, max_workers, fresh, selection)
+    return index.select(selection, prefix)
+
+def folder_unchanged(known, f):
+    """Whether folder entry `f` still shows the modified_time `known` has for it (see folders_to_list)."""
+    return bool(known and f.get("modified_time")) and known.get(f.get("id"), (None,))[0] == f["modified_time"]
+
+def folders_to_list(f, folder_prefix, prefix="", selection=None, known=None):
+    """(folder_id, folder_prefix) pairs a crawl lists for entry `f` of the folder at `folder_prefix`.
+
+    A subfolder is listed unless the selection rules it out. `known` maps
+    folder ids to (modified_time, subfolder entries) from an earlier crawl:
+    a folder whose modified_time hasn't changed still holds the same entries,
+    so it isn't listed itself, but the folders right under it are, since a
+    change further down only shows in the modified_time of the folder that
+    holds it.
+    """
+    if f.get("kind") != "drive#folder":
+        return []
+    sub_prefix = folder_prefix + f.get("name", "") + "/"
+    if selection is not None and not selection.wants_folder(sub_prefix[len(prefix):]):
+        return []
+    if not folder_unchanged(known, f):
+        return [(f["id"], sub_prefix)]
+    return [pair for child in known[f["id"]][1] for pair in folders_to_list(child, sub_prefix, prefix, selection)]
+
+def crawl_share_pages(share_id, pass_code_token="", parent_id="", prefix="", max_workers=None, selection=None,
+                      known=None):
+    """Crawl a share breadth-first, yielding every share/detail page as soon as it arrives.
+
+    Yields (folder_id, page_no, folder_prefix, entries). Sibling folders, and
+    the next page of each folder, are fetched concurrently on a bounded pool.
+    Subfolders a ShareSelection rules out are never fetched, nor are those
+    unchanged since a previous crawl according to `known` (see folders_to_list).
+    """
+    headers = get_headers(share_id)
+    pool = ThreadPoolExecutor(max_workers=max_workers or LIST_WORKERS)
+    pending = {}
+
+    def submit(folder_id, page_no, folder_prefix, page_token=""):
+        fut = pool.submit(fetch_share_page, share_id, pass_code_token, folder_id, page_token, headers)
+        pending[fut] = (folder_id, page_no, folder_prefix)
+
+    try:
+        submit(parent_id, 0, prefix)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                folder_id, page_no, folder_prefix = pending.pop(fut)
+                entries, next_token = fut.result()
+                if next_token:
+                    submit(folder_id, page_no + 1, folder_prefix, next_token)
+                for f in entries:
+                    for sub_id, sub_prefix in folders_to_list(f, folder_prefix, prefix, selection, known):
+                        submit(sub_id, 0, sub_prefix)
+                yield folder_id, page_no, folder_prefix, entries
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def share_folder_entries(pages, folder_id):
+    """A crawled folder's entries across all of its pages, in order."""
+    page_no = 0
+    while (folder_id, page_no) in pages:
+        yield from pages[folder_id, page_no]
+        page_no += 1
+
+def split_patterns(patterns):
+    """A comma-separated string or a list of globs/prefixes as a clean list."""
+    if isinstance(patterns, str):
+        patterns = patterns.split(",")
+    return [p.strip().lstrip("/") for p in patterns or () if p and p.strip()]
+
+def optional_int(value):
+    return int(value) if value not in (None, "") else None
+
+def glob_matcher(patterns):
+    """A path -> bool test that's true when any of the globs matches (case-insensitive).
+
+    A pattern with a "/" is matched against the whole path, one without it
+    against the file name only, so "*.mkv" works at any depth.
+    """
+    patterns = split_patterns(patterns)
+    compile_any = lambda globs: re.compile("|".join(map(fnmatch.translate, globs)), re.IGNORECASE) if globs else None
+    path_rx = compile_any([p for p in patterns if "/" in p])
+    name_rx = compile_any([p for p in patterns if "/" not in p])
+    return lambda path: bool((name_rx and name_rx.match(path.rsplit("/", 1)[-1])) or (path_rx and path_rx.match(path)))
+
+class ShareSelection:
+    """The part of a share to list: include/exclude globs, folder depth, size bounds and mime prefixes.
+
+    Path rules are checked while crawling, so folders that can't hold a
+    wanted file are never requested from share/detail. Globs follow
+    glob_matcher; an exclude glob also drops a folder whose path it matches.
+    max_depth counts folder levels below the listed one (0 = only its own
+    files). Size bounds are inclusive bytes.
+    """
+
+    def __init__(self, include=(), exclude=(), max_depth=None, min_size=None, max_size=None, mime=()):
+        self.include = split_patterns(include)
+        self.exclude = split_patterns(exclude)
+        self.max_depth = max_depth
+        self.min_size = min_size
+        self.max_size = max_size
+        self.mime = split_patterns(mime)
+        self.include_match = glob_matcher(self.include) if self.include else None
+        self.exclude_match = glob_matcher(self.exclude) if self.exclude else None
+        # Folder pruning by include globs only works when they all name a path;
+        # a bare "*.mkv" can match at any depth
+        self.include_dirs = None
+        if self.include and all("/" in p for p in self.include):
+            self.include_dirs = [p.lower().split("/")[:-1] for p in self.include]
+
+    @classmethod
+    def from_params(cls, data):
+        """From request fields include, exclude, max_depth, min_size, max_size and mime; None if all are empty."""
+        selection = cls(data.get("include"), data.get("exclude"), optional_int(data.get("max_depth")),
+                        optional_int(data.get("min_size")), optional_int(data.get("max_size")), data.get("mime"))
+        if selection.prunes() or selection.mime or selection.min_size is not None or selection.max_size is not None:
+            return selection
+        return None
+
+    def prunes(self):
+        return bool(self.include or self.exclude or self.max_depth is not None)
+
+    def crawl_key(self):
+        return tuple(self.include), tuple(self.exclude), self.max_depth
+
+    def wants_folder(self, path):
+        """Whether to crawl the folder at `path` ("A/B/", relative to the listed folder)."""
+        parts = path.rstrip("/").split("/")
+        if self.max_depth is not None and len(parts) > self.max_depth:
+            return False
+        if self.exclude_match and self.exclude_match(path.rstrip("/")):
+            return False
+        return self.include_dirs is None or any(self.could_contain(dirs, parts) for dirs in self.include_dirs)
+
+    @staticmethod
+    def could_contain(dirs, parts):
+        # Segments compare one to one until one with a "*", which may span
+        # several; only the part of that one before the "*" still has to match
+        for pattern, part in zip(dirs, parts):
+            if "*" in pattern:
+                return fnmatch.fnmatchcase(part.lower(), pattern.split("*")[0] + "*")
+            if not fnmatch.fnmatchcase(part.lower(), pattern):
+                return False
+        return True
+
+    def wants_path(self, path):
+        if self.include_match and not self.include_match(path):
+            return False
+        return not (self.exclude_match and self.exclude_match(path))
+
+    def wants_file(self, f, path):
+        size = file_size(f)
+        return (self.wants_path(path) and f.get("mime_type", "").startswith(tuple(self.mime) or ("",))
+                and (self.min_size is None or size >= self.min_size)
+                and (self.max_size is None or size <= self.max_size))
+
+class FileIndex:
+    """Compact listing of a crawled share: one row per file, kept in column arrays.
+
+    Folder paths are stored once and rows refer to them by number, and
+    sizes, gcids and mime types are packed, so a 100k-file share costs an id
+    and a name string per file instead of a dict with the full path repeated.
+    files() rebuilds the usual file_entry dicts; query() pages, sorts and
+    filters without building them for every row.
+    """
+
+    __slots__ = ("folders", "mime_types", "ids", "names", "sizes", "folder", "mime", "hashes", "orders")
+
+    def __init__(self):
+        self.folders = [""]  # folder paths with their trailing "/"; 0 is the listed folder itself
+        self.mime_types = []
+        self.ids = []
+        self.names = []
+        self.sizes = array("q")
+        self.folder = array("I")
+        self.mime = array("H")
+        self.hashes = bytearray()  # 20-byte gcid per row, zeros when the listing had none
+        self.orders = {}
+
+    @classmethod
+    def from_pages(cls, pages, parent_id="", selection=None):
+        """Build from crawled {(folder_id, page_no): entries} pages, rows in depth-first order.
+
+        Only files passing the selection's path rules are indexed.
+        """
+        index = cls()
+        mimes = {}
+        stack = [(share_folder_entries(pages, parent_id), 0)]
+        while stack:
+            f = next(stack[-1][0], None)
+            if f is None:
+                stack.pop()
+                continue
+            path = index.folders[stack[-1][1]] + f.get("name", "")
+            if f.get("kind") == "drive#folder":
+                if selection is None or selection.wants_folder(path + "/"):
+                    index.folders.append(path + "/")
+                    stack.append((share_folder_entries(pages, f["id"]), len(index.folders) - 1))
+            elif selection is None or selection.wants_path(path):
+                index.add(f, stack[-1][1], mimes)
+        return index
+
+    def add(self, f, folder_no, mimes):
+        mime_type = f.get("mime_type", "")
+        if mime_type not in mimes:
+            mimes[mime_type] = len(self.mime_types)
+            self.mime_types.append(mime_type)
+        gcid = f.get("hash") or ""
+        self.ids.append(f.get("id", ""))
+        self.names.append(f.get("name", ""))
+        self.sizes.append(int(f.get("size") or 0))
+        self.folder.append(folder_no)
+        self.mime.append(mimes[mime_type])
+        self.hashes += bytes.fromhex(gcid) if re.fullmatch(r"[0-9A-Fa-f]{40}", gcid) else bytes(20)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def path(self, row):
+        return self.folders[self.folder[row]] + self.names[row]
+
+    def entry(self, row, prefix=""):
+        gcid = self.hashes[row * 20:row * 20 + 20]
+        return {
+            "id": self.ids[row],
+            "name": prefix + self.path(row),
+            "size": str(self.sizes[row]),
+            "mime_type": self.mime_types[self.mime[row]],
+            "hash": gcid.hex().upper() if any(gcid) else "",
+        }
+
+    def files(self, prefix="", start=0, stop=None):
+        return [self.entry(row, prefix) for row in range(start, len(self) if stop is None else stop)]
+
+    def order(self, sort=""):
+        """Rows sorted by "name" (full path) or "size"; listing order otherwise. Cached per sort key."""
+        if sort not in ("name", "size"):
+            return range(len(self))
+        rows = self.orders.get(sort)
+        if rows is None:
+            key = (lambda row: self.path(row).lower()) if sort == "name" else self.sizes.__getitem__
+            rows = self.orders[sort] = array("I", sorted(range(len(self)), key=key))
+        return rows
+
+    def matching(self, rows, glob="", mime="", min_size=None, max_size=None):
+        """The rows that pass every given filter, in the order given."""
+        # Cheapest tests first, each as one pass over the survivors
+        sizes = self.sizes
+        if min_size is not None:
+            rows = [row for row in rows if sizes[row] >= min_size]
+        if max_size is not None:
+            rows = [row for row in rows if sizes[row] <= max_size]
+        if mime:
+            prefixes = tuple(split_patterns(mime))
+            allowed = {n for n, mime_type in enumerate(self.mime_types) if mime_type.startswith(prefixes)}
+            rows = [row for row in rows if self.mime[row] in allowed]
+        if glob:
+            match_path = glob_matcher(glob)
+            rows = [row for row in rows if match_path(self.path(row))]
+        return rows
+
+    def select(self, selection=None, prefix=""):
+        """file_entry dicts for the rows that pass a ShareSelection's size and mime rules (all without one)."""
+        rows = range(len(self))
+        if selection:
+            rows = self.matching(rows, "", selection.mime, selection.min_size, selection.max_size)
+        return [self.entry(row, prefix) for row in rows]
+
+    def query(self, offset=0, limit=100, sort="", desc=False, glob="", mime="", min_size=None, max_size=None):
+        """Returns (number of matching rows, file_entry dicts for one page of them).
+
+        `glob` takes comma-separated patterns (see glob_matcher), `mime`
+        comma-separated prefixes such as "video/", and the size bounds are
+        inclusive, in bytes.
+        """
+        rows = self.order(sort)
+        if desc:
+            rows = rows[::-1]
+        rows = self.matching(rows, glob, mime, min_size, max_size)
+        return len(rows), [self.entry(row) for row in rows[offset:offset + limit]]
+
+def link_ttl(url):
+    """Seconds a PikPak download link stays usable, from the expiry in its query string."""
+    query = parse_qs(urlparse(url).query)
+    for name in ("e", "expire", "expires"):
+        value = query.get(name, [""])[0]
+        if value.isdigit():
+            return int(value) - time.time() - LINK_EXPIRY_MARGIN
+    return LINK_TTL_DEFAULT
+
+def get_file_download_link(share_id, file_id, pass_code_token="", fresh=False):
+    key = (share_id, file_id)
+    url = None if fresh else link_cache.get(key)
+    if url is None:
+        url = fetch_file_download_link(share_id, file_id, pass_code_token)
+        if url:
+            link_cache.set(key, url, link_ttl(url))
+    return url
+
+def fetch_file_download_link(share_id, file_id, pass_code_token=""):
+    headers = get_headers(share_id)
+    params = {"share_id": share_id, "file_id": file_id, "pass_code_token": pass_code_token}
+    data = pikpak_api_get("/drive/v1/share/file_info", params, headers)
+    if data.get("error"):
+        raise Exception(data.get("error_description") or data["error"])
+    return download_link_from_info(data.get("file_info", {}))
+
+def download_link_from_info(fi):
+    """Pick the best download URL out of a share/file_info "file_info" object."""
+    wcl = fi.get("web_content_link", "")
+    if wcl:
+        return wcl
+    links = fi.get("links", {})
+    if links:
+        for v in links.values():
+            if v.get("url"):
+                return v["url"]
+    medias = fi.get("medias", [])
+    for m in medias:
+        link = m.get("link", {})
+        if link and link.get("url"):
+            return link["url"]
+    return ""
+
+def resolve_link(share_id, f, pass_code_token=""):
+    """Resolve one file's link. Failures are reported in the entry's "error" field."""
+    entry = {"id": f["id"], "name": f["name"], "size": f.get("size", "0"), "hash": f.get("hash", ""),
+             "download_url": ""}
+    try:
+        entry["download_url"] = get_file_download_link(share_id, f["id"], pass_code_token)
+    except Exception as e:
+        entry["error"] = str(e)[:300]
+    return entry
+
+def resolve_links(share_id, files, pass_code_token="", max_workers=None):
+    """Resolve links on a bounded pool, yielding (index, entry) as each one completes."""
+    with ThreadPoolExecutor(max_workers=max_workers or LINK_WORKERS) as pool:
+        futures = {pool.submit(resolve_link, share_id, f, pass_code_token): i for i, f in enumerate(files)}
+        try:
+            for fut in as_completed(futures):
+                yield futures[fut], fut.result()
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+
+def dropbox_error_detail(resp):
+    detail = resp.text[:500]
+    try:
+        ej = resp.json()
+        detail = ej.get("error_summary", ej.get("error", {}).get(".tag", detail))
+    except:
+        pass
+    return detail
+
+def dropbox_post(token, endpoint, arg, data=b"", timeout=600):
+    """POST to a Dropbox content endpoint. Returns the JSON result or raises Exception."""
+    resp = http_session.post(
+        f"{DROPBOX_CONTENT_URL}/{endpoint}",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/octet-stream",
+            "Dropbox-API-Arg": json.dumps(arg, ensure_ascii=True),
+        },
+        data=data, timeout=timeout
+    )
+    if resp.status_code != 200:
+        raise Exception(f"Dropbox {endpoint.replace('files/upload_session/', 'session/')} {resp.status_code}: {dropbox_error_detail(resp)}")
+    metrics.upload_bytes.inc(len(data))
+    return resp.json()
+
+def dropbox_rpc(token, endpoint, payload):
+    """POST JSON to a Dropbox RPC endpoint. Returns the JSON result or raises Exception."""
+    resp = http_session.post(
+        f"{DROPBOX_API_URL}/{endpoint}",
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        data=json.dumps(payload, ensure_ascii=True), timeout=60
+    )
+    if resp.status_code != 200:
+        raise Exception(f"Dropbox {endpoint} {resp.status_code}: {dropbox_error_detail(resp)}")
+    return resp.json()
+
+def dropbox_folder_index(token, folder):
+    """Map path_lower -> {"path", "size", "content_hash"} for every file under `folder`.
+
+    Lists the folder recursively with list_folder/continue. A folder that
+    doesn't exist yet gives an empty index.
+    """
+    index = {}
+    try:
+        page = dropbox_rpc(token, "files/list_folder", {"path": folder, "recursive": True, "limit": 2000})
+    except Exception as e:
+        if "not_found" in str(e):
+            return index
+        raise
+    while True:
+        add_folder_entries(index, page.get("entries", []))
+        if not page.get("has_more"):
+            return index
+        page = dropbox_rpc(token, "files/list_folder/continue", {"cursor": page["cursor"]})
+
+def add_folder_entries(index, entries):
+    for e in entries:
+        if e.get(".tag") == "file":
+            index[e["path_lower"]] = {"path": e.get("path_display", ""), "size": e.get("size", 0),
+                                      "content_hash": e.get("content_hash", "")}
+
+def find_existing(index, dbx_path, f):
+    """The index entry for a file already at `dbx_path` with the same size, or None."""
+    existing = index.get(dbx_path.lower()) if index else None
+    if existing and existing["size"] == file_size(f):
+        return existing
+    return None
+
+class BlockHasher:
+    """Hash of block hashes computed incrementally: `algorithm` over the digest of every `block_size` block."""
+
+    def __init__(self, algorithm, block_size):
+        self.algorithm = algorithm
+        self.block_size = block_size
+        self.overall = algorithm()
+        self.block = algorithm()
+        self.block_len = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            n = min(self.block_size - self.block_len, len(view))
+            self.block.update(view[:n])
+            self.block_len += n
+            view = view[n:]
+            if self.block_len == self.block_size:
+                self.overall.update(self.block.digest())
+                self.block = self.algorithm()
+                self.block_len = 0
+
+    def hexdigest(self):
+        overall = self.overall.copy()
+        if self.block_len:
+            overall.update(self.block.digest())
+        return overall.hexdigest()
+
+class DropboxContentHasher(BlockHasher):
+    """Dropbox content_hash: SHA-256 over the SHA-256 of every 4MiB block."""
+
+    def __init__(self):
+        super().__init__(hashlib.sha256, CONCURRENT_BLOCK)
+
+def gcid_block_size(size):
+    block = 256 * 1024
+    while size / block > 512 and block < 2 * 1024 * 1024:
+        block *= 2
+    return block
+
+class PikPakGcidHasher(BlockHasher):
+    """PikPak's file "hash" (gcid): SHA-1 over the SHA-1 of every block, 256KiB-2MiB depending on the size."""
+
+    def __init__(self, size):
+        super().__init__(hashlib.sha1, gcid_block_size(size))
+
+class DownloadCheck:
+    """Checks a download as it passes: the byte count, and PikPak's gcid when the listing had one.
+
+    A resumed download only covers the tail of the file, so only its length
+    is checked.
+    """
+
+    def __init__(self, f, total_size, offset=0):
+        self.name = f["name"].split("/")[-1]
+        self.expected_size = total_size - offset if total_size else 0
+        self.expected_hash = (f.get("hash") or "").upper() if VERIFY_HASH and total_size and not offset else ""
+        self.hasher = PikPakGcidHasher(total_size) if self.expected_hash else None
+        self.received = 0
+
+    def update(self, data):
+        self.received += len(data)
+        if self.hasher:
+            self.hasher.update(data)
+
+    def verify(self):
+        if self.expected_size and self.received != self.expected_size:
+            raise Exception(f"Download incompleto: {self.received} de {self.expected_size} bytes ({self.name})")
+        if self.hasher and self.hasher.hexdigest().upper() != self.expected_hash:
+            raise Exception(f"Arquivo baixado nao confere com o hash do PikPak ({self.name})")
+
+CORRUPT_ERRORS = ("Download incompleto", "Arquivo baixado nao confere", "content_hash do Dropbox nao confere",
+                  "Tamanho no Dropbox nao confere")
+
+def is_corrupt(e):
+    """True if `e` is a failed DownloadCheck, content_hash or size check.
+
+    The upload session then holds bytes that can't be trusted, and a resumed
+    download is only checked for length, so such a file starts over.
+    """
+    return str(e).startswith(CORRUPT_ERRORS)
+
+def hash_pieces(pieces, hasher):
+    for piece in pieces:
+        hasher.update(piece)
+        yield piece
+
+def verify_pieces(pieces, check):
+    """Feed pieces to a DownloadCheck; a bad download raises before the consumer sees the end, so it's never committed."""
+    for piece in pieces:
+        check.update(piece)
+        yield piece
+    check.verify()
+
+def check_content_hash(result, hasher, size=0):
+    """Raise if Dropbox's content_hash for a committed file differs from the bytes we sent.
+
+    A resumed upload isn't hashed, so its size is checked against `size`:
+    blocks a lost run had in flight past its checkpoint can leave a
+    concurrent session holding more than the file.
+    """
+    if size and result.get("size") not in (None, size):
+        raise Exception(f"Tamanho no Dropbox nao confere com o arquivo enviado: {result['size']} de {size} bytes "
+                        f"({result.get('path_display', '')})")
+    expected = result.get("content_hash") if hasher else None
+    if expected and expected != hasher.hexdigest():
+        raise Exception(f"content_hash do Dropbox nao confere com o arquivo enviado ({result.get('path_display', '')})")
+    return result
+
+def verify_commit(token, result, hasher, size=0):
+    """check_content_hash, deleting the committed file when it fails.
+
+    find_existing only compares name and size, so a corrupt copy left in
+    Dropbox would be skipped as already uploaded on every rerun.
+    """
+    try:
+        return check_content_hash(result, hasher, size)
+    except Exception:
+        try:
+            dropbox_rpc(token, "files/delete_v2", {"path": result.get("path_lower") or result["path_display"]})
+        except Exception:
+            pass
+        raise
+
+def future_then(fut, fn):
+    """A Future for fn(fut.result()), failing if either fut or fn fails."""
+    out = Future()
+
+    def done(f):
+        try:
+            out.set_result(fn(f.result()))
+        except Exception as e:
+            out.set_exception(e)
+
+    fut.add_done_callback(done)
+    return out
+
+def dropbox_tag_summary(obj):
+    """Flatten a nested Dropbox union like {".tag": "path", "path": {".tag": "conflict", ...}}."""
+    tags = []
+    while isinstance(obj, dict) and obj.get(".tag"):
+        tags.append(obj[".tag"])
+        obj = obj.get(obj[".tag"])
+    return "/".join(tags) or "unknown"
+
+def dropbox_batch(token, endpoint, entries):
+    """Run a Dropbox batch call, polling its /check until done. Returns one result entry per input entry."""
+    result = dropbox_rpc(token, endpoint, {"entries": entries})
+    job_id = result.get("async_job_id")
+    delay = 0.5
+    while result.get(".tag") in ("async_job_id", "in_progress"):
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
+        result = dropbox_rpc(token, f"{endpoint}/check", {"async_job_id": job_id})
+    if result.get(".tag") != "complete":
+        raise Exception(f"Dropbox {endpoint.rsplit('/', 1)[-1]}: {dropbox_tag_summary(result)}")
+    return result["entries"]
+
+def dropbox_finish_batch(token, entries):
+    """Commit closed upload sessions in one call. Returns one result entry per input entry."""
+    return dropbox_batch(token, "files/upload_session/finish_batch", entries)
+
+def dropbox_delete_paths(token, paths):
+    """Delete files, DELETE_BATCH_SIZE per call. Paths that are already gone are not an error."""
+    for start in range(0, len(paths), DELETE_BATCH_SIZE):
+        chunk = paths[start:start + DELETE_BATCH_SIZE]
+        results = dropbox_batch(token, "files/delete_batch", [{"path": path} for path in chunk])
+        for path, res in zip(chunk, results):
+            if res.get(".tag") == "failure" and "not_found" not in dropbox_tag_summary(res.get("failure")):
+                raise Exception(f"Dropbox delete_batch {path}: {dropbox_tag_summary(res.get('failure'))}")
+
+class DropboxBatchCommitter:
+    """Groups closed upload sessions into finish_batch commits.
+
+    submit() returns a Future resolved with the file's metadata once its batch
+    is committed. A batch is sent when it reaches BATCH_COMMIT_SIZE entries or
+    when its oldest entry has waited BATCH_COMMIT_WINDOW seconds.
+    """
+
+    def __init__(self, token, batch_size=BATCH_COMMIT_SIZE, window=BATCH_COMMIT_WINDOW):
+        self.token = token
+        self.batch_size = batch_size
+        self.window = window
+        self.lock = threading.Lock()
+        self.commit_lock = threading.Lock()  # one finish_batch at a time per job
+        self.pending = []
+        self.futures = []
+        self.timer = None
+
+    def submit(self, entry):
+        fut = Future()
+        with self.lock:
+            self.pending.append((entry, fut))
+            self.futures.append(fut)
+            batch = self.take() if len(self.pending) >= self.batch_size else None
+            if batch is None and self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if batch:
+            self.commit(batch)
+        return fut
+
+    def take(self):
+        # Caller holds self.lock
+        batch, self.pending = self.pending, []
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        return batch
+
+    def flush(self):
+        with self.lock:
+            batch = self.take()
+        if batch:
+            self.commit(batch)
+
+    def commit(self, batch):
+        with self.commit_lock:
+            try:
+                results = dropbox_finish_batch(self.token, [entry for entry, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                return
+            for (_, fut), res in zip(batch, results):
+                if res.get(".tag") == "success":
+                    fut.set_result(res)
+                else:
+                    fut.set_exception(Exception(f"Dropbox finish_batch: {dropbox_tag_summary(res.get('failure', res))}"))
+
+    def close(self):
+        """Commit whatever is still pending and wait for every submitted file."""
+        self.flush()
+        wait(self.futures)
+        with self.commit_lock:
+            pass  # done-callbacks run inside commit(); let the last one finish
+
+def commit_info(dropbox_path, overwrite=False):
+    """Commit arguments for an upload: a new file never replaces another (autorename), a sync update does."""
+    if overwrite:
+        return {"path": dropbox_path, "mode": "overwrite", "mute": False}
+    return {"path": dropbox_path, "mode": "add", "autorename": True, "mute": False}
+
+def dropbox_upload_chunks(token, chunks, dropbox_path, total_size=0, progress_callback=None, batch=None,
+                          checkpoint=None, resume=None, overwrite=False):
+    """Upload an iterable of byte blocks as one Dropbox file.
+
+    A single block goes through files/upload; anything longer opens an upload
+    session, appends every block and finishes with the last one. Only the
+    current block and one block of lookahead are held in memory.
+
+    With a DropboxBatchCommitter, a single-block file is uploaded as a closed
+    session instead and a Future for its commit is returned.
+
+    checkpoint(session_id, offset) is called after every accepted block.
+    resume=(session_id, offset, ...) continues an existing session; `chunks`
+    must then start at that offset. With `overwrite` the commit replaces a
+    file already at `dropbox_path`.
+    """
+    commit = commit_info(dropbox_path, overwrite)
+    chunks = iter(chunks)
+    current = next(chunks, b"")
+    if resume:
+        session_id, offset = resume[:2]
+        following = None
+    else:
+        following = next(chunks, None)
+    if following is None and not resume:
+        if batch is not None:
+            session_id = dropbox_post(token, "files/upload_session/start", {"close": True}, current)["session_id"]
+            if progress_callback:
+                progress_callback(100)
+            return batch.submit({"cursor": {"session_id": session_id, "offset": len(current)}, "commit": commit})
+        result = dropbox_post(token, "files/upload", commit, current)
+        if progress_callback:
+            progress_callback(100)
+        return result
+
+    if not resume:
+        session_id = dropbox_post(token, "files/upload_session/start", {"close": False}, current)["session_id"]
+        offset = len(current)
+        if checkpoint:
+            checkpoint(session_id, offset)
+        current = following
+    for following in chunks:
+        if progress_callback and total_size:
+            progress_callback(min(int(offset * 100 / total_size), 99))
+        dropbox_post(token, "files/upload_session/append_v2",
+                     {"cursor": {"session_id": session_id, "offset": offset}, "close": False}, current)
+        offset += len(current)
+        if checkpoint:
+            checkpoint(session_id, offset)
+        current = following
+    result = dropbox_post(token, "files/upload_session/finish",
+                          {"cursor": {"session_id": session_id, "offset": offset}, "commit": commit}, current)
+    if progress_callback:
+        progress_callback(100)
+    return result
+
+class ChunkSizer:
+    """Picks the next append size from the measured per-request throughput.
+
+    Aims for appends of about UPLOAD_CHUNK_SECONDS each, so slow links send
+    smaller blocks (less memory, cheaper retries) and fast or high-latency
+    links send bigger ones. Sizes are multiples of CONCURRENT_BLOCK, at most
+    `max_size`. Call the instance to get the current size.
+    """
+
+    def __init__(self, size=16 * 1024 * 1024, target=UPLOAD_CHUNK_SECONDS, max_size=UPLOAD_CHUNK_MAX):
+        self.max_size = max_size
+        self.size = min(size, max_size)
+        self.target = target
+        self.rate = None
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        return self.size
+
+    def observe(self, nbytes, seconds):
+        with self.lock:
+            rate = nbytes / max(seconds, 0.001)
+            self.rate = rate if self.rate is None else 0.7 * self.rate + 0.3 * rate
+            size = int(self.rate * self.target) // CONCURRENT_BLOCK * CONCURRENT_BLOCK
+            self.size = min(max(size, UPLOAD_CHUNK_MIN), self.max_size)
+
+def upload_block_limit(workers):
+    """Largest append block of a concurrent upload with `workers` appends in flight.
+
+    An upload holds up to workers + 2 blocks (those in flight, the next one
+    and the one being filled) and DROPBOX_MAX_SESSIONS uploads run at once,
+    so blocks are capped to keep all of them within UPLOAD_MEMORY.
+    """
+    share = UPLOAD_MEMORY // max(DROPBOX_MAX_SESSIONS, 1) // (workers + 2)
+    return min(max(share // CONCURRENT_BLOCK * CONCURRENT_BLOCK, CONCURRENT_BLOCK), UPLOAD_CHUNK_MAX)
+
+def use_concurrent_upload(total_size, resume=None):
+    if resume:
+        return len(resume) > 2 and resume[2]
+    return UPLOAD_CONCURRENCY > 1 and total_size > SIMPLE_UPLOAD_MAX
+
+def dropbox_upload_concurrent(token, pieces, dropbox_path, total_size=0, progress_callback=None, checkpoint=None,
+                              resume=None, workers=None, overwrite=False):
+    """Upload byte pieces through a concurrent upload session, several append_v2 calls in flight.
+
+    `pieces` are regrouped into blocks sized by a ChunkSizer and capped by
+    upload_block_limit. The last block is appended with close=True and
+    finish carries no data, as concurrent sessions require.
+    checkpoint(session_id, offset, True) records the end of the contiguous
+    run of accepted blocks; resume=(session_id, offset, True) appends the
+    rest of the file from there.
+    """
+    workers = workers or UPLOAD_CONCURRENCY
+    commit = commit_info(dropbox_path, overwrite)
+    if resume:
+        session_id, offset = resume[:2]
+    else:
+        session_id = dropbox_post(token, "files/upload_session/start",
+                                  {"close": False, "session_type": "concurrent"})["session_id"]
+        offset = 0
+        if checkpoint:
+            checkpoint(session_id, 0, True)
+    sizer = ChunkSizer(max_size=upload_block_limit(workers))
+    committed = acked = offset
+    accepted = {}  # start -> end of blocks accepted past the contiguous run
+
+    def append(start, block, close):
+        started = time.monotonic()
+        dropbox_post(token, "files/upload_session/append_v2",
+                     {"cursor": {"session_id": session_id, "offset": start}, "close": close}, block)
+        sizer.observe(len(block), time.monotonic() - started)
+        return start, start + len(block)
+
+    blocks = rechunk(pieces, sizer)
+    current = next(blocks, None)
+    if current is None and not (resume and offset == total_size):
+        # Nothing left to send: close the session (unless the closing block already landed)
+        dropbox_post(token, "files/upload_session/append_v2",
+                     {"cursor": {"session_id": session_id, "offset": offset}, "close": True})
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while current is not None or pending:
+                if current is not None:
+                    following = next(blocks, None)
+                    pending.add(pool.submit(append, offset, current, following is None))
+                    offset += len(current)
+                    current = following
+                    if len(pending) < workers and current is not None:
+                        continue
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    start, end = fut.result()
+                    accepted[start] = end
+                    acked += end - start
+                while committed in accepted:
+                    committed = accepted.pop(committed)
+                if checkpoint:
+                    checkpoint(session_id, committed, True)
+                if progress_callback and total_size:
+                    progress_callback(min(int(acked * 100 / total_size), 99))
+        except BaseException:
+            for fut in pending:
+                fut.cancel()
+            raise
+    result = dropbox_post(token, "files/upload_session/finish",
+                          {"cursor": {"session_id": session_id, "offset": offset}, "commit": commit})
+    if progress_callback:
+        progress_callback(100)
+    return result
+
+def dropbox_upload_file(token, tmp_path, actual_size, dropbox_path, progress_callback=None, batch=None,
+                        checkpoint=None, overwrite=False):
+    """Upload a local temp file to Dropbox. Returns result dict or raises Exception."""
+    with open(tmp_path, 'rb') as f:
+        if use_concurrent_upload(actual_size):
+            pieces = iter(lambda: f.read(DOWNLOAD_CHUNK), b"")
+            return dropbox_upload_concurrent(token, pieces, dropbox_path, actual_size, progress_callback, checkpoint,
+                                             overwrite=overwrite)
+        if actual_size <= SIMPLE_UPLOAD_MAX:  # <=140MB: simple upload
+            chunks = [f.read()]
+        else:
+            chunks = iter(lambda: f.read(CHUNK_SIZE), b"")
+        return dropbox_upload_chunks(token, chunks, dropbox_path, actual_size, progress_callback, batch,
+                                     checkpoint, overwrite=overwrite)
+
+class TransferJournal:
+    """SQLite journal of transfers, keyed by share id + file id.
+
+    Records the destination path of every file, the open upload session and
+    last committed offset while it uploads, and the result once it is
+    committed. A restarted job skips finished files and continues open
+    sessions from their offset.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS transfers (
+                share_id TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                dropbox_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                session_id TEXT,
+                committed_offset INTEGER NOT NULL DEFAULT 0,
+                result_path TEXT,
+                updated REAL NOT NULL,
+                PRIMARY KEY (share_id, file_id))""")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(transfers)")]
+            if "concurrent" not in columns:
+                self.conn.execute("ALTER TABLE transfers ADD COLUMN concurrent INTEGER NOT NULL DEFAULT 0")
+
+    def lookup(self, share_id, file_id, dropbox_path):
+        """Journal row for this file, or None if it was never started for this destination."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status, session_id, committed_offset, result_path, concurrent FROM transfers "
+                "WHERE share_id = ? AND file_id = ? AND dropbox_path = ?",
+                (share_id, file_id, dropbox_path)).fetchone()
+        if not row:
+            return None
+        return {"status": row[0], "session_id": row[1], "offset": row[2], "path": row[3], "concurrent": bool(row[4])}
+
+    def checkpoint(self, share_id, file_id, dropbox_path, session_id, offset, concurrent=False):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO transfers "
+                "(share_id, file_id, dropbox_path, status, session_id, committed_offset, concurrent, updated) "
+                "VALUES (?, ?, ?, 'uploading', ?, ?, ?, ?)",
+                (share_id, file_id, dropbox_path, session_id, offset, int(concurrent), time.time()))
+
+    def complete(self, share_id, file_id, dropbox_path, result_path):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO transfers "
+                "(share_id, file_id, dropbox_path, status, result_path, updated) "
+                "VALUES (?, ?, ?, 'done', ?, ?)",
+                (share_id, file_id, dropbox_path, result_path, time.time()))
+
+    def forget(self, share_id, file_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM transfers WHERE share_id = ? AND file_id = ?", (share_id, file_id))
+
+    def result_path(self, share_id, file_id, folder):
+        """Where the file was committed when it was last sent to `folder` (autorenamed or not), or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT dropbox_path, result_path FROM transfers WHERE share_id = ? AND file_id = ? AND status = 'done'",
+                (share_id, file_id)).fetchone()
+        if row and row[1] and row[0].rsplit("/", 1)[0].lower() == folder.lower():
+            return row[1]
+        return None
+
+journal_lock = threading.Lock()
+journal = None
+
+def get_journal():
+    """Open the process-wide TransferJournal on first use (None when disabled)."""
+    global journal
+    if not JOURNAL_PATH:
+        return None
+    with journal_lock:
+        if journal is None:
+            journal = TransferJournal(JOURNAL_PATH)
+    return journal
+
+class SnapshotStore:
+    """SQLite store of share trees for sync jobs, one per share + destination folder.
+
+    A snapshot is a crawl's {(folder_id, page_no): entries} pages cut down
+    to SNAPSHOT_FIELDS. A sync job stages the tree it listed under its id,
+    with the cleanup to do once its transfers are over (see plan_sync), and
+    commits it then, without the files that failed, so those come up as new
+    or changed again on the next run.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS snapshots (
+                key TEXT PRIMARY KEY,
+                pages BLOB NOT NULL,
+                taken REAL NOT NULL)""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS staged (
+                job_id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                pages BLOB NOT NULL,
+                created REAL NOT NULL)""")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(staged)")]
+            if "cleanup" not in columns:
+                self.conn.execute("ALTER TABLE staged ADD COLUMN cleanup TEXT NOT NULL DEFAULT '{}'")
+
+    @staticmethod
+    def pack(pages):
+        rows = [[folder_id, page_no, [{k: f[k] for k in SNAPSHOT_FIELDS if k in f} for f in entries]]
+                for (folder_id, page_no), entries in pages.items()]
+        return zlib.compress(json.dumps(rows, separators=(",", ":")).encode())
+
+    @staticmethod
+    def unpack(blob):
+        return {(folder_id, page_no): entries for folder_id, page_no, entries in json.loads(zlib.decompress(blob))}
+
+    def load(self, key):
+        """The committed pages for `key`, or None if it was never synced."""
+        with self.lock:
+            row = self.conn.execute("SELECT pages FROM snapshots WHERE key = ?", (key,)).fetchone()
+        return self.unpack(row[0]) if row else None
+
+    def stage(self, job_id, key, pages, cleanup=None):
+        blob = self.pack(pages)
+        with self.lock:
+            self.conn.execute("DELETE FROM staged WHERE created < ?", (time.time() - SNAPSHOT_STAGED_TTL,))
+            self.conn.execute("INSERT OR REPLACE INTO staged (job_id, key, pages, created, cleanup) "
+                              "VALUES (?, ?, ?, ?, ?)", (job_id, key, blob, time.time(), json.dumps(cleanup or {})))
+
+    def cleanup(self, job_id):
+        """The cleanup plan_sync staged with `job_id`'s tree ({} if none)."""
+        with self.lock:
+            row = self.conn.execute("SELECT cleanup FROM staged WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def commit(self, job_id, failed_ids=()):
+        """Make the tree staged by `job_id` the snapshot of its key, minus the files in `failed_ids`.
+
+        A failed file that replaced an older one keeps that one's entry, so
+        it is still a changed file next time.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT key, pages, cleanup FROM staged WHERE job_id = ?", (job_id,)).fetchone()
+        if not row:
+            return
+        failed_ids = set(failed_ids)
+        replaced = {k: v for k, v in json.loads(row[2]).get("replaced", {}).items() if k in failed_ids}
+        blob = self.pack(without_files(self.unpack(row[1]), failed_ids, replaced)) if failed_ids else row[1]
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("INSERT OR REPLACE INTO snapshots (key, pages, taken) VALUES (?, ?, ?)",
+                              (row[0], blob, time.time()))
+            self.conn.execute("DELETE FROM staged WHERE job_id = ?", (job_id,))
+            self.conn.execute("COMMIT")
+
+snapshots_lock = threading.Lock()
+snapshots = None
+
+def get_snapshots():
+    """Open the process-wide SnapshotStore on first use (None when disabled)."""
+    global snapshots
+    if not SNAPSHOT_PATH:
+        return None
+    with snapshots_lock:
+        if snapshots is None:
+            snapshots = SnapshotStore(SNAPSHOT_PATH)
+    return snapshots
+
+def without_files(pages, file_ids, replaced=None):
+    """Crawled pages minus the files in `file_ids`. Every folder above one of
+    them loses its modified_time, so the next sync crawls down to it again.
+    A file in `replaced` (id -> old id, size and hash) gets those back instead."""
+    replaced = replaced or {}
+    parent = {f["id"]: folder_id for (folder_id, _), entries in pages.items()
+              for f in entries if f.get("kind") == "drive#folder"}
+    stale = set()
+    for (folder_id, _), entries in pages.items():
+        if any(f.get("id") in file_ids for f in entries):
+            while folder_id in parent and folder_id not in stale:
+                stale.add(folder_id)
+                folder_id = parent[folder_id]
+    return {key: [{k: v for k, v in f.items() if k != "modified_time"} if f.get("id") in stale else
+                  {**f, **replaced[f["id"]]} if f.get("id") in replaced else f
+                  for f in entries if f.get("id") not in file_ids or f["id"] in replaced]
+            for key, entries in pages.items()}
+
+def rechunk(pieces, size):
+    """Regroup an iterable of byte strings into blocks of `size` bytes (the last may be short).
+
+    `size` may also be a callable, asked again before every block.
+    """
+    next_size = size if callable(size) else lambda: size
+    buf = bytearray()
+    for piece in pieces:
+        buf += piece
+        while len(buf) >= (n := next_size()):
+            with memoryview(buf) as mv:
+                block = bytes(mv[:n])
+            del buf[:n]
+            yield block
+    if buf:
+        yield bytes(buf)
+
+def prefetch(iterable, depth):
+    """Drive `iterable` on a background thread, keeping at most `depth` items buffered."""
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(("item", item)):
+                    return
+            put(("end", None))
+        except Exception as e:
+            put(("error", e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            kind, item = q.get()
+            if kind == "end":
+                return
+            if kind == "error":
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def fetch_range(dl_url, start, end, attempts=3):
+    """Download bytes [start, end) of a CDN file in one Range request, retrying short reads."""
+    for attempt in range(attempts):
+        try:
+            resp = http_session.get(dl_url, timeout=60,
+                                    headers={"User-Agent": USER_AGENT, "Range": f"bytes={start}-{end - 1}"})
+            resp.raise_for_status()
+            if resp.status_code != 206 or len(resp.content) != end - start:
+                raise Exception(f"Download: segmento {start}-{end} incompleto ({len(resp.content)} bytes)")
+            return resp.content
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+
+def iter_segments(dl_url, first_resp, start, end, workers):
+    """Yield first_resp's body, then bytes [start, end) fetched as concurrent SEGMENT_SIZE ranges, in order.
+
+    At most `workers` segments are in flight or waiting to be consumed.
+    """
+    bounds = ((a, min(a + SEGMENT_SIZE, end)) for a in range(start, end, SEGMENT_SIZE))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    window = []
+    try:
+        for a, b in bounds:
+            window.append(pool.submit(fetch_range, dl_url, a, b))
+            if len(window) >= workers:
+                break
+        with first_resp:
+            for chunk in first_resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                if chunk:
+                    yield chunk
+        while window:
+            data = window.pop(0).result()
+            nxt = next(bounds, None)
+            if nxt:
+                window.append(pool.submit(fetch_range, dl_url, *nxt))
+            for i in range(0, len(data), DOWNLOAD_CHUNK):
+                yield data[i:i + DOWNLOAD_CHUNK]
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def iter_stream(dl_resp, skip=0):
+    with dl_resp:
+        for chunk in dl_resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk = chunk[dropped:]
+                skip -= dropped
+            if chunk:
+                yield chunk
+
+def open_download(dl_url, start=0, size_hint=0, segments=None):
+    """Open a PikPak CDN download at byte `start`. Returns (total_size, pieces).
+
+    For large files the first request asks for just the first segment. If the
+    server answers 206, ranges are supported and the rest of the file is
+    fetched as concurrent Range requests, reassembled in order. A plain 200
+    means no range support and the file is read as a single stream.
+    """
+    segments = segments or DOWNLOAD_SEGMENTS
+    if start and size_hint and start >= size_hint:
+        return size_hint, iter(())
+    segmented = segments > 1 and size_hint - start >= SEGMENTED_MIN_SIZE
+    headers = {"User-Agent": USER_AGENT}
+    if segmented:
+        headers["Range"] = f"bytes={start}-{start + SEGMENT_SIZE - 1}"
+    elif start:
+        headers["Range"] = f"bytes={start}-"
+    resp = http_session.get(dl_url, stream=True, timeout=30, headers=headers)
+    try:
+        resp.raise_for_status()
+    except Exception:
+        resp.close()
+        raise
+
+    if resp.status_code != 206:
+        # Server ignored the Range header: one stream from byte 0
+        total_size = int(resp.headers.get("content-length", 0)) or size_hint
+        return total_size, iter_stream(resp, skip=start)
+    m = re.match(r"bytes (\d+)-(\d+)/(\d+)", resp.headers.get("content-range", ""))
+    total_size = int(m.group(3)) if m else size_hint
+    if not segmented or not m:
+        return total_size, iter_stream(resp)
+    return total_size, iter_segments(dl_url, resp, int(m.group(2)) + 1, total_size, segments)
+
+def iter_download(pieces, total_size, emit, start=0):
+    """Pass download pieces through, reporting progress from byte `start`."""
+    downloaded = start
+    for chunk in pieces:
+        downloaded += len(chunk)
+        metrics.download_bytes.inc(len(chunk))
+        if total_size > 0:
+            emit("downloading", percent=min(int(downloaded * 100 / total_size), 100), bytes=downloaded - start)
+        yield chunk
+
+def transfer_file(token, f, dbx_path, share_id, pass_code_token="", emit=None, mode=None, batch=None,
+                  journal=None):
+    """Copy one PikPak file into Dropbox. Returns the committed file's metadata.
+
+    In "stream" mode download chunks are piped straight into an upload session
+    through a small bounded buffer, so nothing touches disk and the download
+    overlaps the upload. "tempfile" mode downloads the whole file first.
+
+    With a DropboxBatchCommitter, small files return a Future for their
+    commit instead (see dropbox_upload_chunks). With a TransferJournal, the
+    upload session is checkpointed after every block and an open session
+    from an earlier run is continued where it stopped.
+    """
+    emit = emit or (lambda event_type, **fields: None)
+    mode = mode or TRANSFER_MODE
+
+    # Get fresh download link
+    dl_url = f.get("download_url", "")
+    if not dl_url:
+        dl_url = get_file_download_link(share_id, f["id"], pass_code_token)
+    if not dl_url:
+        raise Exception("Sem link de download")
+
+    checkpoint = None
+    if journal:
+        checkpoint = lambda session_id, offset, concurrent=False: journal.checkpoint(
+            share_id, f["id"], dbx_path, session_id, offset, concurrent)
+        resume = resume_point(journal.lookup(share_id, f["id"], dbx_path))
+        if resume:
+            try:
+                # Resuming always streams: only the missing tail is downloaded
+                return copy_to_dropbox(token, dl_url, f, dbx_path, emit, "stream", batch, checkpoint, resume)
+            except Exception as e:
+                if "lookup_failed" not in str(e):
+                    raise
+                # Session expired or its offset no longer matches: start the file over
+                journal.forget(share_id, f["id"])
+    return copy_to_dropbox(token, dl_url, f, dbx_path, emit, mode, batch, checkpoint)
+
+def copy_to_dropbox(token, dl_url, f, dbx_path, emit, mode, batch=None, checkpoint=None, resume=None):
+    offset = resume[1] if resume else 0
+    emit("downloading", percent=0)
+    tmp_path = None
+    on_disk = 0
+    # A resumed upload only sees the tail of the file, so it can't be hashed here
+    hasher = DropboxContentHasher() if VERIFY_HASH and not offset else None
+    overwrite = bool(f.get("overwrite"))  # a changed file in a sync replaces its old copy
+    upload_progress = lambda pct: emit("uploading", percent=pct)
+
+    def download():
+        # Opened only once it will be read: a CDN stream left idle while
+        # waiting for a session slot gets cut and fails as a short read
+        total_size, pieces = open_download(dl_url, offset, file_size(f))
+        pieces = verify_pieces(iter_download(pieces, total_size, emit, offset), DownloadCheck(f, total_size, offset))
+        return total_size, hash_pieces(pieces, hasher) if hasher else pieces
+
+    try:
+        if mode != "tempfile":
+            with dropbox_sessions:
+                total_size, pieces = download()
+                emit("uploading", percent=int(offset * 100 / total_size) if total_size else 0)
+                if use_concurrent_upload(total_size, resume):
+                    result = dropbox_upload_concurrent(token, prefetch(pieces, STREAM_BUFFER_CHUNKS), dbx_path,
+                                                       total_size, upload_progress, checkpoint, resume,
+                                                       overwrite=overwrite)
+                else:
+                    chunks = rechunk(prefetch(pieces, STREAM_BUFFER_CHUNKS), CHUNK_SIZE)
+                    result = dropbox_upload_chunks(token, chunks, dbx_path, total_size, upload_progress, batch,
+                                                   checkpoint, resume, overwrite)
+        else:
+            # Phase 1: Download from PikPak to temp file
+            total_size, pieces = download()
+            tmp_fd, tmp_path = tempfile.mkstemp(suffix='.tmp')
+            with os.fdopen(tmp_fd, 'wb') as tmp_file:
+                for chunk in pieces:
+                    tmp_file.write(chunk)
+                    metrics.temp_disk_bytes.inc(len(chunk))
+                    on_disk += len(chunk)
+
+            # Phase 2: Upload from temp file to Dropbox
+            actual_size = os.path.getsize(tmp_path)
+            with dropbox_sessions:
+                emit("uploading", percent=0)
+                result = dropbox_upload_file(token, tmp_path, actual_size, dbx_path, upload_progress, batch,
+                                             checkpoint, overwrite)
+        if isinstance(result, Future):
+            return future_then(result, lambda res: verify_commit(token, res, hasher, total_size))
+        return verify_commit(token, result, hasher, total_size)
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.unlink(tmp_path)
+            except:
+                pass
+        metrics.temp_disk_bytes.dec(on_disk)
+
+def transfer_error_detail(e):
+    detail = str(e)
+    if hasattr(e, 'response') and e.response is not None:
+        try:
+            ej = e.response.json()
+            detail = ej.get("error_summary", ej.get("error", {}).get(".tag", detail))
+        except:
+            detail = f"HTTP {e.response.status_code}: {e.response.text[:300]}"
+    return detail[:500]
+
+def error_class(e):
+    """Short, low-cardinality label for a failed transfer, for metrics."""
+    if isinstance(e, requests.Timeout):
+        return "timeout"
+    if isinstance(e, requests.ConnectionError):
+        return "connection"
+    detail = transfer_error_detail(e)
+    m = re.match(r"Dropbox \S+ (\d{3}): ([a-z_]+)", detail)
+    if m:
+        return f"dropbox_{m.group(2)}"
+    m = re.match(r"Dropbox \S+ (\d{3})", detail) or re.match(r"HTTP (\d{3})", detail)
+    if m:
+        return f"{'dropbox' if detail.startswith('Dropbox') else 'http'}_{m.group(1)}"
+    if detail == "Sem link de download":
+        return "no_link"
+    return "other"
+
+def file_size(f):
+    return int(f.get("size", 0) or 0)
+
+def sent_before(prior, f):
+    """Whether journal row `prior` says `f` is already in Dropbox; a sync's changed file is sent again."""
+    return bool(prior) and prior["status"] == "done" and not f.get("overwrite")
+
+def resume_point(prior):
+    """(session_id, offset, concurrent) of the upload session journal row `prior` left open, or None."""
+    if prior and prior["status"] == "uploading" and prior["session_id"]:
+        return prior["session_id"], prior["offset"], prior["concurrent"]
+    return None
+
+def dropbox_path_for(folder, f):
+    if f.get("dropbox_path"):
+        return f["dropbox_path"]  # a sync's changed file goes where its old copy is
+    fname = f["name"].split("/")[-1]
+    # Sanitize filename for Dropbox
+    safe_fname = re.sub(r'[<>:"|?*]', '_', fname)
+    return f"{folder}/{safe_fname}"
+
+def run_transfers(token, folder, share_id, pass_code_token, files, emit, mode=None, workers=None,
+                  batch_commit=None, resume=True, skip_existing=None):
+    """Transfer files on a pool of `workers` threads. Returns how many succeeded.
+
+    Every start/downloading/uploading/done/error event is passed to
+    emit(event) tagged with the file's index, so events from different files
+    interleave. With batch_commit, small files are committed through
+    finish_batch and their done/error events arrive when their batch lands.
+    With resume, files the journal already lists as done for the same
+    destination are reported done without being transferred again. With
+    skip_existing, so are files the destination folder already holds with
+    the same name and size.
+    """
+    batch = DropboxBatchCommitter(token) if (BATCH_COMMIT if batch_commit is None else batch_commit) else None
+    journal = get_journal() if resume else None
+    index = None
+    if SKIP_EXISTING if skip_existing is None else skip_existing:
+        try:
+            index = dropbox_folder_index(token, folder)
+        except Exception:
+            pass  # no listing (e.g. token without files.metadata.read): upload everything
+    ok = 0
+    ok_lock = threading.Lock()
+
+    def report(i, result=None, error=None, skipped=False):
+        nonlocal ok
+        if error is not None:
+            if journal and is_corrupt(error):
+                journal.forget(share_id, files[i]["id"])  # don't resume into the bad session
+            metrics.files_transferred.inc(result="error", error_class=error_class(error))
+            emit({"type": "error", "index": i, "size": file_size(files[i]), "detail": transfer_error_detail(error)})
+            return
+        metrics.files_transferred.inc(result="skipped" if skipped else "done")
+        with ok_lock:
+            ok += 1
+        path = result.get("path_display", "")
+        if journal and not skipped:
+            journal.complete(share_id, files[i]["id"], dropbox_path_for(folder, files[i]), path)
+        emit({"type": "done", "index": i, "path": path, "size": file_size(files[i]),
+              **({"skipped": True} if skipped else {})})
+
+    def work(i, f):
+        emit({"type": "start", "index": i, "name": f["name"].split("/")[-1]})
+        file_emit = lambda event_type, **fields: emit({"type": event_type, "index": i, **fields})
+        if journal:
+            prior = journal.lookup(share_id, f["id"], dropbox_path_for(folder, f))
+            if sent_before(prior, f):
+                return report(i, {"path_display": prior["path"]}, skipped=True)
+        existing = find_existing(index, dropbox_path_for(folder, f), f)
+        if existing:
+            return report(i, {"path_display": existing["path"]}, skipped=True)
+        metrics.transfers_in_flight.inc()
+        try:
+            result = transfer_file(token, f, dropbox_path_for(folder, f), share_id, pass_code_token,
+                                   file_emit, mode, batch, journal)
+        except Exception as e:
+            return report(i, error=e)
+        finally:
+            metrics.transfers_in_flight.dec()
+        if isinstance(result, Future):
+            result.add_done_callback(lambda fut: report(i, None if fut.exception() else fut.result(), fut.exception()))
+        else:
+            report(i, result)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers or TRANSFER_WORKERS) as pool:
+            list(pool.map(work, range(len(files)), files))
+    finally:
+        if batch:
+            batch.close()
+    return ok
+
+
+def snapshot_key(share_id, folder, selection=None):
+    """SnapshotStore key; a selection that prunes the crawl gets its own snapshot."""
+    return json.dumps([share_id, folder.lower(), selection.crawl_key() if selection and selection.prunes() else None])
+
+def plan_sync(engine, job_id, folder, share_id, pass_code_token="", selection=None, full=False, delete=False):
+    """Diff a share against its last snapshot for `folder`. Returns (files to transfer, summary).
+
+    The share is listed through `engine`, taking from the snapshot the
+    entries of every folder whose modified_time hasn't changed (the folders
+    under it are still listed, see folders_to_list; `full` lists everything
+    again). New files and files whose id, size or hash changed are returned
+    for run_transfers, the changed ones marked "overwrite", with the path
+    of their old Dropbox copy (as the journal recorded it) in "dropbox_path"
+    so their commit replaces it. With `delete`, the copies of files gone
+    from the share are deleted by commit_sync once the transfers are over.
+    The new tree is staged under `job_id` for commit_sync.
+    """
+    store = get_snapshots()
+    if store is None:
+        raise Exception("Sincronizacao desativada: PIKPAK_SNAPSHOTS esta vazio")
+    key = snapshot_key(share_id, folder, selection)
+    previous = store.load(key) or {}
+    known = None
+    if previous and not full:
+        subfolders = {}
+        for (folder_id, _), entries in previous.items():
+            subfolders.setdefault(folder_id, []).extend(f for f in entries if f.get("kind") == "drive#folder")
+        known = {f["id"]: (f["modified_time"], subfolders[f["id"]]) for entries in subfolders.values()
+                 for f in entries if f.get("modified_time") and f["id"] in subfolders}
+    pages = {}
+    for folder_id, page_no, _, entries in engine.crawl_share_pages(share_id, pass_code_token, selection=selection,
+                                                                   known=known):
+        pages[folder_id, page_no] = entries
+    reused = [f["id"] for entries in list(pages.values()) for f in entries
+              if f.get("kind") == "drive#folder" and (f["id"], 0) not in pages and folder_unchanged(known, f)]
+    for folder_id in reused:
+        page_no = 0
+        while (folder_id, page_no) in previous:
+            pages[folder_id, page_no] = previous[folder_id, page_no]
+            page_no += 1
+
+    new_files = FileIndex.from_pages(pages, "", selection).select(selection)
+    old_files = FileIndex.from_pages(previous, "", selection).select(selection) if previous else []
+    old = {f["name"]: f for f in old_files}
+    unchanged = lambda f: f["name"] in old and (f["id"], f["size"], f["hash"]) == (
+        old[f["name"]]["id"], old[f["name"]]["size"], old[f["name"]]["hash"])
+    journal = get_journal()
+    # An earlier run may have committed a file under an autorenamed name
+    copy_path = lambda f: (journal and journal.result_path(share_id, f["id"], folder)) or dropbox_path_for(folder, f)
+    files, replaced, forget = [], {}, []
+    for f in new_files:
+        if unchanged(f):
+            continue
+        prior = old.get(f["name"])
+        if prior:
+            # Committed over the old copy, which stays until then
+            f = {**f, "overwrite": True, "dropbox_path": copy_path(prior)}
+            replaced[f["id"]] = {k: prior[k] for k in ("id", "size", "hash")}
+            if prior["id"] != f["id"]:
+                forget.append(prior["id"])  # so the old id coming back is sent again
+        files.append(f)
+    names = {f["name"] for f in new_files}
+    removed = [f for f in old_files if f["name"] not in names]
+    paths = []
+    if delete:
+        # Files are flattened into `folder`, so a removed file's name may be used by one still there
+        kept = {dropbox_path_for(folder, f).lower() for f in files if f.get("overwrite")}
+        kept.update(copy_path(f).lower() for f in new_files if unchanged(f))
+        gone = [f for f in removed if copy_path(f).lower() not in kept]
+        paths = sorted({copy_path(f) for f in gone})
+        forget += [f["id"] for f in gone]
+    store.stage(job_id, key, pages, {"share_id": share_id, "delete": paths, "forget": forget, "replaced": replaced})
+    return files, {
+        "first": not previous, "added": len(files) - len(replaced), "changed": len(replaced),
+        "removed": len(removed), "deleted": len(paths), "unchanged": len(new_files) - len(files),
+        "reused_folders": len(reused),
+    }
+
+def commit_sync(job_id, failed_ids=(), token=""):
+    """Finish the sync plan_sync staged for `job_id`, once its transfers are over.
+
+    Deletes the Dropbox copies of the files gone from the share (with
+    `delete`) and records the tree as the share's snapshot, minus the files
+    that failed. If a delete fails, the snapshot isn't recorded, so the next
+    sync plans the same deletes again.
+    """
+    store = get_snapshots()
+    if not store:
+        return
+    cleanup = store.cleanup(job_id)
+    if cleanup.get("delete"):
+        dropbox_delete_paths(token, cleanup["delete"])
+    journal = get_journal()
+    if journal:
+        for file_id in cleanup.get("forget", ()):
+            journal.forget(cleanup["share_id"], file_id)
+    store.commit(job_id, failed_ids)
+
+PROGRESS_EVENTS = ("downloading", "uploading")
+PROGRESS_TICK = 0.25  # seconds between batched "progress" events on a job's event stream
+
+class ProgressTracker:
+    """Folds a job's per-chunk progress events into one compact "progress" event per tick.
+
+    Each batch lists [index, download %, upload %] for the files that moved
+    since the last tick, with the job's download rate in bytes/s and an ETA
+    in seconds for the bytes still to go.
+    """
+
+    def __init__(self):
+        self.total_bytes = 0
+        self.settled = 0  # sizes of files that finished, failed or were skipped
+        self.seen = {}  # index -> bytes downloaded this run
+        self.percent = {}  # index -> [download %, upload %]
+        self.changed = set()
+        self.moved = 0
+        self.rate = 0.0
+        self.last_tick = time.monotonic()
+
+    def update(self, event):
+        kind, i = event.get("type"), event.get("index")
+        if kind == "job":
+            self.total_bytes = event.get("bytes", 0)
+        elif kind in PROGRESS_EVENTS:
+            if not self.percent:
+                self.last_tick = time.monotonic()  # idle until now: don't average over the gap
+            self.percent.setdefault(i, [0, None])[kind == "uploading"] = event.get("percent", 0)
+            self.changed.add(i)
+            if "bytes" in event:
+                self.moved += max(event["bytes"] - self.seen.get(i, 0), 0)
+                self.seen[i] = event["bytes"]
+        elif kind in ("done", "error"):
+            self.settled += event.get("size", 0)
+            self.seen.pop(i, None)
+            self.percent.pop(i, None)
+            self.changed.discard(i)
+
+    def active(self):
+        return bool(self.percent)
+
+    def tick(self):
+        """The batch for the time since the last tick, or None when nothing is in progress."""
+        now = time.monotonic()
+        elapsed, self.last_tick = now - self.last_tick, now
+        if elapsed > 0:
+            current = self.moved / elapsed
+            self.rate = current if not self.rate else 0.7 * self.rate + 0.3 * current
+        self.moved = 0
+        if not self.percent:
+            self.rate = 0.0
+            return None
+        remaining = max(self.total_bytes - self.settled - sum(self.seen.values()), 0)
+        batch = {"type": "progress", "files": [[i, *self.percent[i]] for i in sorted(self.changed)],
+                 "bps": int(self.rate), "eta": int(remaining / self.rate) if self.rate and self.total_bytes else None}
+        self.changed.clear()
+        return batch
+
+# Ends the SSE streams of running jobs on shutdown, so the server isn't kept
+# up by its open connections while the jobs drain
+SHUTDOWN_EVENT = {"type": "shutdown", "error": "Servidor reiniciando; se o envio parar, envie de novo que ele continua "
+                                               "de onde parou"}
+
+class TransferJob:
+    """One queued transfer and its event log.
+
+    start/done/error/complete events are kept with a sequence number so a
+    client can re-attach and replay from where it left off; progress events
+    only keep the latest one per file.
+    """
+
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.status = "queued"
+        self.error = ""
+        self.created = time.time()
+        self.started = self.finished = None
+        self.total = self.ok = self.failed = 0
+        self.events = []
+        self.progress = {}
+        self.subscribers = set()
+        self.detached = None  # event that ended the live subscriptions, see detach()
+        self.lock = threading.Lock()
+
+    def emit(self, event):
+        with self.lock:
+            seq = None
+            if event.get("type") in PROGRESS_EVENTS:
+                self.progress[event["index"]] = event
+            else:
+                self.progress.pop(event.get("index"), None)
+                self.events.append(event)
+                seq = len(self.events)
+                if event["type"] == "done":
+                    self.ok += 1
+                elif event["type"] == "error":
+                    self.failed += 1
+            for q in self.subscribers:
+                q.put((seq, event))
+
+    def subscribe(self, after=0):
+        """Returns (backlog, queue): logged events after seq `after` plus current progress, then live events.
+
+        The queue receives (seq, event) tuples (seq is None for progress) and
+        None once the job has finished or was detached.
+        """
+        q = queue.Queue()
+        with self.lock:
+            backlog = [(seq, e) for seq, e in enumerate(self.events[after:], after + 1)]
+            backlog += [(None, e) for e in self.progress.values()]
+            if self.finished is None and self.detached is None:
+                self.subscribers.add(q)
+            else:
+                if self.finished is None:
+                    backlog.append((None, self.detached))
+                q.put(None)
+        return backlog, q
+
+    def detach(self, event):
+        """End every live subscription with `event` (not logged); the job itself goes on."""
+        with self.lock:
+            if self.finished is not None:
+                return
+            self.detached = event
+            for q in self.subscribers:
+                q.put((None, event))
+                q.put(None)
+            self.subscribers.clear()
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def run(self, engine):
+        p = self.params
+        with self.lock:
+            if self.status != "queued":  # cancelled while it waited
+                return
+            self.status, self.started = "running", time.time()
+        try:
+            share_id, pass_code_token, files = p.get("share_id", ""), p.get("pass_code_token", ""), p.get("files")
+            sync = None
+            if not files:
+                share_id = extract_share_id(p["url"]) if p.get("url") else share_id
+                info = engine.get_share_info(share_id)
+                if info.get("error"):
+                    raise Exception(info.get("error_description", "Erro"))
+                pass_code_token = info.get("pass_code_token", "")
+                selection = ShareSelection.from_params(p)
+                if p.get("sync"):
+                    files, sync = plan_sync(engine, self.id, p["folder"], share_id, pass_code_token, selection,
+                                            p.get("full"), p.get("delete"))
+                else:
+                    files = engine.list_share_files(share_id, pass_code_token, selection=selection)
+                p["share_id"] = share_id
+            self.total = len(files)
+            self.emit({"type": "job", "id": self.id, "total": self.total, "bytes": sum(map(file_size, files)),
+                       **({"sync": sync} if sync else {})})
+            # After the first sync the snapshot says what is in the folder, no need to list it
+            skip_existing = p.get("skip_existing") if not sync or sync["first"] else False
+            engine.run_transfers(p["token"], p["folder"], share_id, pass_code_token, files, self.emit,
+                                 p.get("mode"), p.get("workers"), p.get("batch_commit"), p.get("resume", True),
+                                 skip_existing)
+            if sync:
+                commit_sync(self.id, [files[e["index"]]["id"] for e in self.events if e["type"] == "error"],
+                            p["token"])
+            self.status = "done"
+        except Exception as e:
+            self.status, self.error = "failed", str(e)[:500]
+        finally:
+            self.finish()
+
+    def cancel(self, error):
+        """Fail the job if it has not started yet. Returns whether it was cancelled."""
+        with self.lock:
+            if self.status != "queued":
+                return False
+            self.status, self.error = "failed", error
+        self.finish()
+        return True
+
+    def finish(self):
+        self.emit({"type": "complete", "ok": self.ok, "total": self.total,
+                   **({"error": self.error} if self.error else {})})
+        with self.lock:
+            self.finished = time.time()
+            for q in self.subscribers:
+                q.put(None)
+            self.subscribers.clear()
+
+    def summary(self):
+        return {
+            "id": self.id, "status": self.status, "error": self.error,
+            "share_id": self.params.get("share_id") or self.params.get("url", ""),
+            "folder": self.params.get("folder", ""),
+            "total": self.total, "ok": self.ok, "failed": self.failed,
+            "created": self.created, "started": self.started, "finished": self.finished,
+        }
+
+class JobQueue:
+    """Runs TransferJobs on a bounded pool, independent of any HTTP request.
+
+    `engine` is anything with get_share_info, list_share_files and
+    run_transfers: this module or pikpak_async.AsyncEngine.
+    """
+
+    def __init__(self, engine, workers=None, history=JOB_HISTORY):
+        self.engine = engine
+        self.history = history
+        self.pool = ThreadPoolExecutor(max_workers=workers or JOB_WORKERS, thread_name_prefix="pikpak-job")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.closed = None  # monotonic time close() was called
+
+    def submit(self, params):
+        job = TransferJob(uuid.uuid4().hex[:12], params)
+        with self.lock:
+            if self.closed is not None:
+                raise Exception("Servidor encerrando, tente de novo em instantes")
+            self.jobs[job.id] = job
+            finished = [j.id for j in self.jobs.values() if j.finished is not None]
+            for job_id in finished[:max(len(self.jobs) - self.history, 0)]:
+                del self.jobs[job_id]
+        self.pool.submit(job.run, self.engine)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [job.summary() for job in self.jobs.values()]
+
+    def close(self):
+        """Stop taking jobs and fail the queued ones; running jobs go on, but their event streams end."""
+        with self.lock:
+            if self.closed is None:
+                self.closed = time.monotonic()
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            if not job.cancel("Servidor encerrado antes do envio comecar; envie de novo"):
+                job.detach(SHUTDOWN_EVENT)
+
+    def drain(self, timeout):
+        """close(), then wait until `timeout` seconds after closing for the running jobs.
+
+        Returns how many were still running. Their uploads are checkpointed in
+        the journal, so sending them again continues from the last chunk.
+        """
+        self.close()
+        deadline = self.closed + timeout
+        while True:
+            with self.lock:
+                running = sum(job.finished is None for job in self.jobs.values())
+            if not running or time.monotonic() >= deadline:
+                return running
+            time.sleep(0.5)
@@ -7,20 +7,36 @@ Open: http://localhost:5000
 """
 
 from flask import Flask, render_template_string, request, jsonify, Response
-import requests
-import re
-import hashlib
 import json
-import time
-import tempfile
 import os
+import queue
+import time
 
-app = Flask(__name__)
+import pikpak_core
+import pikpak_metrics
+from pikpak_core import (
+    ENGINE, TASK_STORE, TRANSFER_MODE, TRANSFER_WORKERS, MAX_TRANSFER_WORKERS, MAX_PAGE_SIZE,
+    http_session, share_cache, listing_cache, link_cache,
+    extract_share_id, file_entry, FileIndex, ShareSelection, listing_key, optional_int, JobQueue,
+    ProgressTracker, PROGRESS_EVENTS, PROGRESS_TICK,
+)
+
+# The routes only call get_share_info, list_share_files, share_file_index,
+# crawl_share_pages, resolve_links and run_transfers, which both engines provide.
+engine = pikpak_core
+if ENGINE == "async":
+    from pikpak_async import AsyncEngine
+    engine = AsyncEngine()
+
+# Background transfers, shared by /api/jobs and /api/dropbox-upload. With a
+# task store they only get queued here and pikpak_worker.py processes run them.
+if TASK_STORE:
+    from pikpak_worker import StoreJobQueue
+    jobs = StoreJobQueue(TASK_STORE)
+else:
+    jobs = JobQueue(engine)
 
-API_BASE = "https://api-drive.mypikpak.net"
-USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
-CLIENT_ID = "YNxT9w7GMdWvEOKa"
-CHUNK_SIZE = 50 * 1024 * 1024  # 50MB chunks for Dropbox upload sessions
+app = Flask(__name__)
 
 HTML_TEMPLATE = r"""<!DOCTYPE html>
 <html lang="pt-BR">
@@ -219,6 +235,11 @@ HTML_TEMPLATE = r"""<!DOCTYPE html>
             while (b >= 1024 && i < u.length-1) { b /= 1024; i++; }
             return b.toFixed(1)+' '+u[i];
         }
+        function fmtEta(s) {
+            if (s < 60) return s + 's';
+            if (s < 3600) return Math.floor(s / 60) + 'min ' + (s % 60) + 's';
+            return Math.floor(s / 3600) + 'h ' + Math.floor(s % 3600 / 60) + 'min';
+        }
         function setStatus(t, m) {
             const el = document.getElementById('status');
             el.className = 'status ' + t;
@@ -256,6 +277,50 @@ HTML_TEMPLATE = r"""<!DOCTYPE html>
             }
         }
 
+        async function readLines(resp, onEvent) {
+            // Feed each line of an NDJSON response to onEvent as it arrives
+            const reader = resp.body.getReader();
+            const decoder = new TextDecoder();
+            let buf = '';
+            while (true) {
+                const {done, value} = await reader.read();
+                if (done) break;
+                buf += decoder.decode(value, {stream: true});
+                const lines = buf.split('\n');
+                buf = lines.pop();
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    let ev;
+                    try { ev = JSON.parse(line); } catch(e) { continue; }
+                    onEvent(ev);
+                }
+            }
+        }
+
+        function fileCard(f, i) {
+            let html = '<div class="file-card"><div class="file-info">';
+            html += '<span class="file-name">' + f.name + '</span>';
+            html += '<span class="file-size">' + fmtSize(f.size) + '</span>';
+            html += '</div><div class="file-actions" id="fa-' + i + '">';
+            html += '<span style="color:#888;font-size:13px">Resolvendo...</span>';
+            html += '</div></div>';
+            return html;
+        }
+
+        function renderLink(i, f) {
+            const el = document.getElementById('fa-' + i);
+            if (!el) return;
+            const dl = f.download_url || '';
+            let html = '';
+            if (dl) {
+                html += '<a href="' + dl + '" target="_blank" class="btn-dl btn-primary">&#11015; Download</a>';
+                html += '<button class="btn-copy" onclick="cpText(decodeURIComponent(\'' + encodeURIComponent(dl) + '\'), this)">Copiar Link</button>';
+            } else {
+                html += '<span style="color:#ea6666;font-size:13px"' + (f.error ? ' title="' + f.error.replace(/"/g, '&quot;') + '"' : '') + '>Link indisponivel</span>';
+            }
+            el.innerHTML = html;
+        }
+
         async function extractLinks() {
             const url = document.getElementById('shareUrl').value.trim();
             if (!url) return;
@@ -266,58 +331,60 @@ HTML_TEMPLATE = r"""<!DOCTYPE html>
             extractedFiles = [];
             setStatus('loading', 'Listando arquivos do PikPak...');
             try {
-                const r1 = await fetch('/api/list', {
+                // Rows are appended page by page while the server is still crawling
+                const results = document.getElementById('results');
+                const listed = [];
+                const r1 = await fetch('/api/list/stream', {
                     method: 'POST', headers: {'Content-Type': 'application/json'},
                     body: JSON.stringify({url})
                 });
-                const d1 = await r1.json();
-                if (!d1.success) { setStatus('error', 'Erro: ' + d1.error); return; }
-                if (d1.files.length === 0) { setStatus('error', 'Nenhum arquivo encontrado.'); return; }
-                shareInfo = { share_id: d1.share_id, pass_code_token: d1.pass_code_token, share_name: d1.share_name };
+                await readLines(r1, function(ev) {
+                    if (ev.type === 'error') throw new Error(ev.error);
+                    if (ev.type === 'share') {
+                        shareInfo = { share_id: ev.share_id, pass_code_token: ev.pass_code_token, share_name: ev.share_name };
+                        if (ev.share_name) results.insertAdjacentHTML('beforeend', '<div class="folder-name">&#128193; ' + ev.share_name + '</div>');
+                    } else if (ev.type === 'files') {
+                        let html = '';
+                        ev.files.forEach(function(f) { html += fileCard(f, listed.length); listed.push(f); });
+                        results.insertAdjacentHTML('beforeend', html);
+                        setStatus('loading', 'Listando arquivos do PikPak... ' + listed.length);
+                    }
+                });
+                if (listed.length === 0) { setStatus('error', 'Nenhum arquivo encontrado.'); return; }
+                results.insertAdjacentHTML('beforeend', '<div id="linksSummary"></div>');
+                extractedFiles = listed.map(f => ({id: f.id, name: f.name, size: f.size, download_url: ''}));
 
-                setStatus('loading', 'Extraindo links de ' + d1.files.length + ' arquivo(s)...');
-                const r2 = await fetch('/api/links', {
+                setStatus('loading', 'Extraindo links de ' + listed.length + ' arquivo(s)...');
+                const r2 = await fetch('/api/links/stream', {
                     method: 'POST', headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({ share_id: d1.share_id, pass_code_token: d1.pass_code_token, files: d1.files })
+                    body: JSON.stringify({ share_id: shareInfo.share_id, pass_code_token: shareInfo.pass_code_token, files: listed })
+                });
+                let resolved = 0;
+                await readLines(r2, function(ev) {
+                    if (ev.type === 'error') throw new Error(ev.error);
+                    if (ev.type !== 'link') return;
+                    resolved++;
+                    extractedFiles[ev.index].download_url = ev.download_url || '';
+                    renderLink(ev.index, ev);
+                    setStatus('loading', 'Extraindo links... ' + resolved + '/' + extractedFiles.length);
                 });
-                const d2 = await r2.json();
-                if (!d2.success) { setStatus('error', 'Erro: ' + d2.error); return; }
 
-                extractedFiles = d2.files;
                 const withLinks = extractedFiles.filter(f => f.download_url);
                 setStatus('success', withLinks.length + '/' + extractedFiles.length + ' link(s) extraido(s)!');
-
-                let html = '';
-                if (d1.share_name) html += '<div class="folder-name">&#128193; ' + d1.share_name + '</div>';
-                let allLinks = [];
-                extractedFiles.forEach(function(f) {
-                    const dl = f.download_url || '';
-                    if (dl) allLinks.push(dl);
-                    html += '<div class="file-card"><div class="file-info">';
-                    html += '<span class="file-name">' + f.name + '</span>';
-                    html += '<span class="file-size">' + fmtSize(f.size) + '</span>';
-                    html += '</div><div class="file-actions">';
-                    if (dl) {
-                        html += '<a href="' + dl + '" target="_blank" class="btn-dl btn-primary">&#11015; Download</a>';
-                        html += '<button class="btn-copy" onclick="cpText(decodeURIComponent(\'' + encodeURIComponent(dl) + '\'), this)">Copiar Link</button>';
-                    } else {
-                        html += '<span style="color:#ea6666;font-size:13px">Link indisponivel</span>';
-                    }
-                    html += '</div></div>';
-                });
+                const allLinks = withLinks.map(f => f.download_url);
                 if (allLinks.length > 0) {
                     const enc = encodeURIComponent(allLinks.join('\n'));
-                    html += '<div class="summary"><strong>' + allLinks.length + ' link(s) de download</strong><br/>';
-                    html += '<button class="btn-copy-all" onclick="cpText(decodeURIComponent(\'' + enc + '\'), this)">&#128203; Copiar Todos os Links</button></div>';
+                    let shtml = '<div class="summary"><strong>' + allLinks.length + ' link(s) de download</strong><br/>';
+                    shtml += '<button class="btn-copy-all" onclick="cpText(decodeURIComponent(\'' + enc + '\'), this)">&#128203; Copiar Todos os Links</button></div>';
+                    document.getElementById('linksSummary').innerHTML = shtml;
                 }
-                document.getElementById('results').innerHTML = html;
 
                 // Show Dropbox section if there are downloadable files
                 const videos = extractedFiles.filter(f => f.download_url);
                 if (videos.length > 0) {
                     document.getElementById('dropboxSection').style.display = 'block';
-                    if (d1.share_name) {
-                        document.getElementById('dbxFolder').value = '/PikPak Downloads/' + d1.share_name.replace(/[<>:"|?*]/g, '_');
+                    if (shareInfo.share_name) {
+                        document.getElementById('dbxFolder').value = '/PikPak Downloads/' + shareInfo.share_name.replace(/[<>:"|?*]/g, '_');
                     }
                 }
             } catch (e) {
@@ -364,6 +431,27 @@ HTML_TEMPLATE = r"""<!DOCTYPE html>
                 const decoder = new TextDecoder();
                 let buf = '';
                 let done_count = 0;
+                let rateText = '', summary = '';
+                // Events only update this state; the DOM is redrawn at most once per frame
+                const rows = {};
+                const dirty = new Set();
+                let scheduled = false;
+                const setRow = (idx, fields) => { rows[idx] = Object.assign(rows[idx] || {}, fields); dirty.add(idx); };
+                const render = () => {
+                    scheduled = false;
+                    for (const idx of dirty) {
+                        const r = rows[idx];
+                        const icon = document.querySelector('#up-' + idx + ' .upload-icon');
+                        const st = document.getElementById('upst-' + idx);
+                        const errEl = document.getElementById('uperr-' + idx);
+                        if (icon && r.icon) icon.textContent = r.icon;
+                        if (st) { st.textContent = r.text; st.className = 'upload-status ' + r.cls; }
+                        if (errEl && r.error) { errEl.textContent = r.error; errEl.style.display = 'block'; }
+                    }
+                    dirty.clear();
+                    document.getElementById('totalBar').style.width = (done_count/videos.length*100) + '%';
+                    document.getElementById('totalText').textContent = summary || (done_count + '/' + videos.length + ' arquivos' + rateText);
+                };
 
                 while (true) {
                     const {done, value} = await reader.read();
@@ -376,35 +464,35 @@ HTML_TEMPLATE = r"""<!DOCTYPE html>
                         try {
                             const ev = JSON.parse(line.slice(6));
                             const idx = ev.index;
-                            const icon = document.querySelector('#up-' + idx + ' .upload-icon');
-                            const st = document.getElementById('upst-' + idx);
-                            const errEl = document.getElementById('uperr-' + idx);
                             if (ev.type === 'start') {
-                                if (icon) icon.textContent = '\u23F3';
-                                if (st) { st.textContent = 'Baixando do PikPak...'; st.className = 'upload-status active'; }
-                            } else if (ev.type === 'downloading') {
-                                if (st) { st.textContent = 'Baixando ' + ev.percent + '%'; st.className = 'upload-status active'; }
-                            } else if (ev.type === 'uploading') {
-                                if (st) { st.textContent = 'Enviando pro Dropbox ' + ev.percent + '%'; st.className = 'upload-status active'; }
+                                setRow(idx, {icon: '\u23F3', text: 'Baixando do PikPak...', cls: 'active'});
+                            } else if (ev.type === 'progress') {
+                                // One batch per tick: [index, download %, upload %] for the files that moved.
+                                // In stream mode both phases run at once, so show them together
+                                for (const [i, down, up] of ev.files) {
+                                    let txt = 'Baixando ' + down + '%';
+                                    if (up !== null) {
+                                        txt = down < 100 ? txt + ' / Enviando ' + up + '%' : 'Enviando pro Dropbox ' + up + '%';
+                                    }
+                                    setRow(i, {text: txt, cls: 'active'});
+                                }
+                                rateText = ev.bps ? ' - ' + fmtSize(ev.bps) + '/s' + (ev.eta !== null ? ', falta ' + fmtEta(ev.eta) : '') : '';
                             } else if (ev.type === 'done') {
                                 done_count++;
-                                if (icon) icon.textContent = '\u2705';
-                                if (st) { st.textContent = 'Enviado!'; st.className = 'upload-status done'; }
-                                document.getElementById('totalBar').style.width = (done_count/videos.length*100) + '%';
-                                document.getElementById('totalText').textContent = done_count + '/' + videos.length + ' arquivos';
+                                setRow(idx, {icon: '\u2705', text: ev.skipped ? 'Ja estava no Dropbox' : 'Enviado!', cls: 'done'});
                             } else if (ev.type === 'error') {
                                 done_count++;
-                                if (icon) icon.textContent = '\u274C';
-                                if (st) { st.textContent = 'Erro'; st.className = 'upload-status fail'; }
-                                if (errEl && ev.detail) { errEl.textContent = ev.detail; errEl.style.display = 'block'; }
-                                document.getElementById('totalBar').style.width = (done_count/videos.length*100) + '%';
-                                document.getElementById('totalText').textContent = done_count + '/' + videos.length + ' arquivos';
+                                setRow(idx, {icon: '\u274C', text: 'Erro', cls: 'fail', error: ev.detail});
                             } else if (ev.type === 'complete') {
-                                document.getElementById('totalText').textContent = 'Concluido! ' + ev.ok + '/' + ev.total + ' enviados com sucesso';
+                                summary = ev.error ? 'Erro: ' + ev.error : 'Concluido! ' + ev.ok + '/' + ev.total + ' enviados com sucesso';
+                            } else if (ev.type === 'shutdown') {
+                                summary = ev.error;
                             }
                         } catch(e) {}
                     }
+                    if (!scheduled) { scheduled = true; requestAnimationFrame(render); }
                 }
+                render();
             } catch (e) {
                 alert('Erro na conexao: ' + e.message);
             } finally {
@@ -418,237 +506,9 @@ HTML_TEMPLATE = r"""<!DOCTYPE html>
 </body>
 </html>"""
 
-def extract_share_id(url):
-    m = re.search(r'/s/([A-Za-z0-9_-]+)', url)
-    return m.group(1) if m else url.strip()
-
-def get_headers(share_id):
-    return {
-        "User-Agent": USER_AGENT,
-        "Referer": "https://mypikpak.com/",
-        "Origin": "https://mypikpak.com",
-        "X-Client-Id": CLIENT_ID,
-        "X-Device-Id": hashlib.md5(share_id.encode()).hexdigest(),
-    }
-
-def get_share_info(share_id):
-    resp = requests.get(
-        f"{API_BASE}/drive/v1/share",
-        params={"share_id": share_id, "thumbnail_size": "SIZE_LARGE"},
-        headers=get_headers(share_id), timeout=15
-    )
-    return resp.json()
-
-def list_share_files(share_id, pass_code_token="", parent_id="", prefix=""):
-    all_files = []
-    page_token = ""
-    headers = get_headers(share_id)
-    while True:
-        params = {
-            "share_id": share_id, "parent_id": parent_id,
-            "thumbnail_size": "SIZE_LARGE", "limit": "100", "with_audit": "false",
-        }
-        if pass_code_token:
-            params["pass_code_token"] = pass_code_token
-        if page_token:
-            params["page_token"] = page_token
-        resp = requests.get(f"{API_BASE}/drive/v1/share/detail", params=params, headers=headers, timeout=15)
-        data = resp.json()
-        for f in data.get("files", []):
-            name = prefix + f.get("name", "")
-            if f.get("kind") == "drive#folder":
-                sub = list_share_files(share_id, pass_code_token, f["id"], name + "/")
-                all_files.extend(sub)
-            else:
-                all_files.append({
-                    "id": f.get("id", ""),
-                    "name": name,
-                    "size": f.get("size", "0"),
-                    "mime_type": f.get("mime_type", ""),
-                })
-        next_t = data.get("next_page_token", "")
-        if not next_t:
-            break
-        page_token = next_t
-    return all_files
-
-def get_file_download_link(share_id, file_id, pass_code_token=""):
-    headers = get_headers(share_id)
-    params = {"share_id": share_id, "file_id": file_id, "pass_code_token": pass_code_token}
-    resp = requests.get(f"{API_BASE}/drive/v1/share/file_info", params=params, headers=headers, timeout=15)
-    data = resp.json()
-    fi = data.get("file_info", {})
-    wcl = fi.get("web_content_link", "")
-    if wcl:
-        return wcl
-    links = fi.get("links", {})
-    if links:
-        for v in links.values():
-            if v.get("url"):
-                return v["url"]
-    medias = fi.get("medias", [])
-    for m in medias:
-        link = m.get("link", {})
-        if link and link.get("url"):
-            return link["url"]
-    return ""
-
-
-def dropbox_upload_file(token, tmp_path, actual_size, dropbox_path, progress_callback=None):
-    """Upload a local temp file to Dropbox. Returns result dict or raises Exception."""
-    dbx_headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/octet-stream",
-    }
-
-    if actual_size <= 140 * 1024 * 1024:  # <=140MB: simple upload
-        with open(tmp_path, 'rb') as f:
-            data = f.read()
-        if progress_callback:
-            progress_callback(50)
-        resp = requests.post(
-            "https://content.dropboxapi.com/2/files/upload",
-            headers={
-                **dbx_headers,
-                "Dropbox-API-Arg": json.dumps({
-                    "path": dropbox_path,
-                    "mode": "add",
-                    "autorename": True,
-                    "mute": False,
-                }, ensure_ascii=True)
-            },
-            data=data, timeout=600
-        )
-        if resp.status_code != 200:
-            error_detail = resp.text[:500]
-            try:
-                ej = resp.json()
-                error_detail = ej.get("error_summary", ej.get("error", {}).get(".tag", error_detail))
-            except:
-                pass
-            raise Exception(f"Dropbox {resp.status_code}: {error_detail}")
-        if progress_callback:
-            progress_callback(100)
-        return resp.json()
-    else:
-        # Large file: upload session with chunks
-        with open(tmp_path, 'rb') as f:
-            first_chunk = f.read(CHUNK_SIZE)
-
-        # Start session WITH first chunk
-        start_resp = requests.post(
-            "https://content.dropboxapi.com/2/files/upload_session/start",
-            headers={
-                **dbx_headers,
-                "Dropbox-API-Arg": json.dumps({"close": False}, ensure_ascii=True)
-            },
-            data=first_chunk, timeout=600
-        )
-        if start_resp.status_code != 200:
-            error_detail = start_resp.text[:500]
-            try:
-                ej = start_resp.json()
-                error_detail = ej.get("error_summary", ej.get("error", {}).get(".tag", error_detail))
-            except:
-                pass
-            raise Exception(f"Dropbox session/start {start_resp.status_code}: {error_detail}")
-
-        session_id = start_resp.json()["session_id"]
-        offset = len(first_chunk)
-        if progress_callback:
-            progress_callback(int(offset * 100 / actual_size))
-
-        with open(tmp_path, 'rb') as f:
-            f.seek(offset)
-            while True:
-                chunk = f.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-
-                remaining_after = actual_size - offset - len(chunk)
-
-                if remaining_after <= 0:
-                    # Finish session with last chunk
-                    finish_resp = requests.post(
-                        "https://content.dropboxapi.com/2/files/upload_session/finish",
-                        headers={
-                            **dbx_headers,
-                            "Dropbox-API-Arg": json.dumps({
-                                "cursor": {"session_id": session_id, "offset": offset},
-                                "commit": {
-                                    "path": dropbox_path,
-                                    "mode": "add",
-                                    "autorename": True,
-                                    "mute": False,
-                                }
-                            }, ensure_ascii=True)
-                        },
-                        data=chunk, timeout=600
-                    )
-                    if finish_resp.status_code != 200:
-                        error_detail = finish_resp.text[:500]
-                        try:
-                            ej = finish_resp.json()
-                            error_detail = ej.get("error_summary", error_detail)
-                        except:
-                            pass
-                        raise Exception(f"Dropbox session/finish {finish_resp.status_code}: {error_detail}")
-                    if progress_callback:
-                        progress_callback(100)
-                    return finish_resp.json()
-                else:
-                    # Append chunk
-                    append_resp = requests.post(
-                        "https://content.dropboxapi.com/2/files/upload_session/append_v2",
-                        headers={
-                            **dbx_headers,
-                            "Dropbox-API-Arg": json.dumps({
-                                "cursor": {"session_id": session_id, "offset": offset},
-                                "close": False
-                            }, ensure_ascii=True)
-                        },
-                        data=chunk, timeout=600
-                    )
-                    if append_resp.status_code != 200:
-                        error_detail = append_resp.text[:500]
-                        try:
-                            ej = append_resp.json()
-                            error_detail = ej.get("error_summary", error_detail)
-                        except:
-                            pass
-                        raise Exception(f"Dropbox session/append {append_resp.status_code}: {error_detail}")
-                    offset += len(chunk)
-                    if progress_callback:
-                        progress_callback(int(offset * 100 / actual_size))
-
-        # Edge case: finish with empty data
-        finish_resp = requests.post(
-            "https://content.dropboxapi.com/2/files/upload_session/finish",
-            headers={
-                **dbx_headers,
-                "Dropbox-API-Arg": json.dumps({
-                    "cursor": {"session_id": session_id, "offset": offset},
-                    "commit": {
-                        "path": dropbox_path,
-                        "mode": "add",
-                        "autorename": True,
-                        "mute": False,
-                    }
-                }, ensure_ascii=True)
-            },
-            data=b"", timeout=600
-        )
-        if finish_resp.status_code != 200:
-            error_detail = finish_resp.text[:500]
-            try:
-                ej = finish_resp.json()
-                error_detail = ej.get("error_summary", error_detail)
-            except:
-                pass
-            raise Exception(f"Dropbox session/finish {finish_resp.status_code}: {error_detail}")
-        if progress_callback:
-            progress_callback(100)
-        return finish_resp.json()
+def sse(event, event_id=None):
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f'{prefix}data: {json.dumps(event, ensure_ascii=True)}\n\n'
 
 
 @app.route("/")
@@ -663,20 +523,87 @@ def api_list():
         if not url:
             return jsonify({"success": False, "error": "URL nao fornecida"})
         share_id = extract_share_id(url)
-        share_info = get_share_info(share_id)
+        fresh = bool(data.get("refresh"))
+        share_info = engine.get_share_info(share_id, fresh)
         if share_info.get("error"):
             return jsonify({"success": False, "error": share_info.get("error_description", "Erro")})
         share_name = share_info.get("title", "")
         pass_code_token = share_info.get("pass_code_token", "")
-        files = list_share_files(share_id, pass_code_token)
-        return jsonify({
-            "success": True, "share_name": share_name,
-            "share_id": share_id, "pass_code_token": pass_code_token,
-            "files": files, "total": len(files)
-        })
+        selection = ShareSelection.from_params(data)
+        index = engine.share_file_index(share_id, pass_code_token, fresh=fresh, selection=selection)
+        result = {"success": True, "share_name": share_name, "share_id": share_id, "pass_code_token": pass_code_token}
+        if "limit" not in data:
+            files = index.select(selection)
+            return jsonify({**result, "files": files, "total": len(files)})
+        # One page of the indexed listing; "total" counts the files matching the filters
+        offset, limit = max(int(data.get("offset") or 0), 0), min(max(int(data["limit"] or 0), 0), MAX_PAGE_SIZE)
+        total, files = index.query(offset, limit, data.get("sort", ""), bool(data.get("desc")), data.get("glob", ""),
+                                   data.get("mime", ""), optional_int(data.get("min_size")),
+                                   optional_int(data.get("max_size")))
+        return jsonify({**result, "files": files, "total": total, "share_total": len(index),
+                        "offset": offset, "limit": limit})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+@app.route("/api/list/stream", methods=["POST"])
+def api_list_stream():
+    """NDJSON variant of /api/list: a "files" line per share/detail page while the crawl runs."""
+    # The body can only be read here, before the response starts; a bad one
+    # is reported as the stream's error line like any other failure
+    error = None
+    try:
+        data = request.get_json()
+        url = data.get("url", "")
+        fresh = bool(data.get("refresh"))
+    except Exception as e:
+        error = e
+
+    def generate():
+        line = lambda obj: json.dumps(obj, ensure_ascii=True) + "\n"
+        try:
+            if error:
+                raise error
+            if not url:
+                yield line({"type": "error", "error": "URL nao fornecida"})
+                return
+            selection = ShareSelection.from_params(data)
+            share_id = extract_share_id(url)
+            share_info = engine.get_share_info(share_id, fresh)
+            if share_info.get("error"):
+                yield line({"type": "error", "error": share_info.get("error_description", "Erro")})
+                return
+            pass_code_token = share_info.get("pass_code_token", "")
+            yield line({
+                "type": "share", "share_name": share_info.get("title", ""),
+                "share_id": share_id, "pass_code_token": pass_code_token,
+            })
+
+            key = listing_key(share_id, "", pass_code_token, selection)
+            cached = None if fresh else listing_cache.get(key)
+            total = 0
+            if cached is not None:
+                files = cached.select(selection)
+                for start in range(0, len(files), 500):
+                    yield line({"type": "files", "files": files[start:start + 500]})
+                total = len(files)
+            else:
+                pages = {}
+                for folder_id, page_no, folder_prefix, entries in engine.crawl_share_pages(
+                        share_id, pass_code_token, selection=selection):
+                    pages[folder_id, page_no] = entries
+                    files = [file_entry(f, folder_prefix) for f in entries if f.get("kind") != "drive#folder" and (
+                        selection is None or selection.wants_file(f, folder_prefix + f.get("name", "")))]
+                    if files:
+                        total += len(files)
+                        yield line({"type": "files", "files": files})
+                listing_cache.set(key, FileIndex.from_pages(pages, selection=selection))
+            yield line({"type": "complete", "total": total})
+        except Exception as e:
+            yield line({"type": "error", "error": str(e)})
+
+    return Response(generate(), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/api/links", methods=["POST"])
 def api_links():
     try:
@@ -684,25 +611,68 @@ def api_links():
         share_id = data.get("share_id", "")
         pass_code_token = data.get("pass_code_token", "")
         files = data.get("files", [])
-        results = []
-        for f in files:
-            dl_url = get_file_download_link(share_id, f["id"], pass_code_token)
-            results.append({
-                "id": f["id"], "name": f["name"],
-                "size": f.get("size", "0"), "download_url": dl_url,
-            })
+        results = [None] * len(files)
+        for i, entry in engine.resolve_links(share_id, files, pass_code_token):
+            results[i] = entry
         return jsonify({"success": True, "files": results})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
+@app.route("/api/links/stream", methods=["POST"])
+def api_links_stream():
+    """NDJSON variant of /api/links: one line per file as soon as its link resolves."""
+    data = request.get_json()
+    share_id = data.get("share_id", "")
+    pass_code_token = data.get("pass_code_token", "")
+    files = data.get("files", [])
+
+    def generate():
+        ok = 0
+        try:
+            for i, entry in engine.resolve_links(share_id, files, pass_code_token):
+                if entry["download_url"]:
+                    ok += 1
+                yield json.dumps({"type": "link", "index": i, **entry}, ensure_ascii=True) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=True) + "\n"
+            return
+        yield json.dumps({"type": "complete", "ok": ok, "total": len(files)}, ensure_ascii=True) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/cache", methods=["GET"])
+def api_cache_stats():
+    return jsonify({
+        "success": True, "shares": share_cache.stats(),
+        "listings": listing_cache.stats(), "links": link_cache.stats(),
+    })
+
+@app.route("/api/cache/invalidate", methods=["POST"])
+def api_cache_invalidate():
+    """Drop cached listings and links for one share, or everything when no share is given."""
+    data = request.get_json(silent=True) or {}
+    share_id = extract_share_id(data.get("share_id") or data.get("url") or "")
+    match = (lambda key: key[0] == share_id) if share_id else None
+    return jsonify({
+        "success": True,
+        "shares": share_cache.invalidate(match),
+        "listings": listing_cache.invalidate(match),
+        "links": link_cache.invalidate(match),
+    })
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(pikpak_metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/api/dropbox-test", methods=["POST"])
 def api_dropbox_test():
     """Test Dropbox token by calling get_current_account."""
     try:
         data = request.get_json()
         token = data.get("token", "")
-        resp = requests.post(
-            "https://api.dropboxapi.com/2/users/get_current_account",
+        resp = http_session.post(
+            f"{pikpak_core.DROPBOX_API_URL}/users/get_current_account",
             headers={"Authorization": f"Bearer {token}", "Content-Type": ""},
             timeout=10
         )
@@ -724,95 +694,131 @@ def api_dropbox_test():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
-@app.route("/api/dropbox-upload", methods=["POST"])
-def api_dropbox_upload():
-    data = request.get_json()
-    token = data.get("token", "")
-    folder = data.get("folder", "/PikPak Downloads").rstrip("/")
-    share_id = data.get("share_id", "")
-    pass_code_token = data.get("pass_code_token", "")
-    files = data.get("files", [])
-
-    def generate():
-        ok = 0
-        for i, f in enumerate(files):
-            fname = f["name"].split("/")[-1]
-            # Sanitize filename for Dropbox
-            safe_fname = re.sub(r'[<>:"|?*]', '_', fname)
-            dbx_path = f"{folder}/{safe_fname}"
+def transfer_params(data):
+    """Job parameters from a request body. Raises on a bad workers value or selection."""
+    ShareSelection.from_params(data)  # the job builds it again later; fail now, with the request
+    return {
+        "token": data.get("token", ""),
+        "folder": data.get("folder", "/PikPak Downloads").rstrip("/"),
+        "url": data.get("url", ""),
+        "share_id": data.get("share_id", ""),
+        "pass_code_token": data.get("pass_code_token", ""),
+        "files": data.get("files", []),
+        "mode": data.get("mode") or TRANSFER_MODE,
+        "workers": min(int(data.get("workers") or TRANSFER_WORKERS), MAX_TRANSFER_WORKERS),
+        "batch_commit": data.get("batch_commit"),
+        "resume": data.get("resume", True),
+        "skip_existing": data.get("skip_existing"),
+        # Sync against the share's last snapshot; needs the job to list the share itself
+        "sync": bool(data.get("sync")),
+        "full": bool(data.get("full")),
+        "delete": bool(data.get("delete")),
+        # Selection applied when the job lists the share itself (no "files")
+        **{k: data[k] for k in ("include", "exclude", "max_depth", "min_size", "max_size", "mime") if k in data},
+    }
 
-            yield f'data: {json.dumps({"type":"start","index":i,"name":fname}, ensure_ascii=True)}\n\n'
+def job_event_stream(job, after=0):
+    """SSE for a job: replays its log after seq `after`, then follows it live until it completes.
 
-            tmp_path = None
-            try:
-                # Get fresh download link
-                dl_url = f.get("download_url", "")
-                if not dl_url:
-                    dl_url = get_file_download_link(share_id, f["id"], pass_code_token)
-                if not dl_url:
-                    yield f'data: {json.dumps({"type":"error","index":i,"detail":"Sem link de download"}, ensure_ascii=True)}\n\n'
+    Per-chunk progress is folded into one "progress" batch every
+    PROGRESS_TICK seconds instead of being sent event by event.
+    """
+    def generate():
+        backlog, q = job.subscribe(after)
+        tracker = ProgressTracker()
+        next_tick = time.monotonic() + PROGRESS_TICK
+        try:
+            for seq, event in backlog:
+                tracker.update(event)
+                if event["type"] not in PROGRESS_EVENTS:
+                    yield sse(event, seq)
+            while True:
+                now = time.monotonic()
+                if now >= next_tick:
+                    batch = tracker.tick()
+                    if batch:
+                        yield sse(batch)
+                    next_tick = now + PROGRESS_TICK
+                try:
+                    item = q.get(timeout=next_tick - now if tracker.active() else 15)
+                except queue.Empty:
+                    if not tracker.active():
+                        yield ": keep-alive\n\n"
                     continue
-
-                # Phase 1: Download from PikPak to temp file
-                yield f'data: {json.dumps({"type":"downloading","index":i,"percent":0}, ensure_ascii=True)}\n\n'
-
-                tmp_fd, tmp_path = tempfile.mkstemp(suffix='.tmp')
-                os.close(tmp_fd)
-
-                dl_resp = requests.get(dl_url, stream=True, timeout=30,
-                                       headers={"User-Agent": USER_AGENT})
-                dl_resp.raise_for_status()
-
-                total_size = int(f.get("size", 0)) or int(dl_resp.headers.get("content-length", 0))
-                downloaded = 0
-                with open(tmp_path, 'wb') as tmp_file:
-                    for chunk in dl_resp.iter_content(chunk_size=8 * 1024 * 1024):
-                        if chunk:
-                            tmp_file.write(chunk)
-                            downloaded += len(chunk)
-                            if total_size > 0:
-                                pct = min(int(downloaded * 100 / total_size), 100)
-                                yield f'data: {json.dumps({"type":"downloading","index":i,"percent":pct}, ensure_ascii=True)}\n\n'
-
-                actual_size = os.path.getsize(tmp_path)
-
-                # Phase 2: Upload from temp file to Dropbox
-                def upload_progress(pct):
-                    pass  # We yield manually below; callback not used in SSE context
-
-                yield f'data: {json.dumps({"type":"uploading","index":i,"percent":0}, ensure_ascii=True)}\n\n'
-                result = dropbox_upload_file(token, tmp_path, actual_size, dbx_path)
-                yield f'data: {json.dumps({"type":"uploading","index":i,"percent":100}, ensure_ascii=True)}\n\n'
-
-                ok += 1
-                yield f'data: {json.dumps({"type":"done","index":i,"path":result.get("path_display","")}, ensure_ascii=True)}\n\n'
-
-            except Exception as e:
-                detail = str(e)
-                if hasattr(e, 'response') and e.response is not None:
-                    try:
-                        ej = e.response.json()
-                        detail = ej.get("error_summary", ej.get("error", {}).get(".tag", detail))
-                    except:
-                        detail = f"HTTP {e.response.status_code}: {e.response.text[:300]}"
-                yield f'data: {json.dumps({"type":"error","index":i,"detail":detail[:500]}, ensure_ascii=True)}\n\n'
-            finally:
-                if tmp_path and os.path.exists(tmp_path):
-                    try:
-                        os.unlink(tmp_path)
-                    except:
-                        pass
-
-        yield f'data: {json.dumps({"type":"complete","ok":ok,"total":len(files)}, ensure_ascii=True)}\n\n'
+                if item is None:
+                    return
+                seq, event = item
+                if not tracker.active():
+                    next_tick = time.monotonic() + PROGRESS_TICK  # first progress after a quiet spell
+                tracker.update(event)
+                if event["type"] not in PROGRESS_EVENTS:
+                    yield sse(event, seq)
+        finally:
+            job.unsubscribe(q)
 
     return Response(generate(), mimetype="text/event-stream",
                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
+@app.route("/api/dropbox-upload", methods=["POST"])
+def api_dropbox_upload():
+    # Runs as a job, so the transfer survives the browser disconnecting and
+    # can be followed again from /api/jobs/<id>/events
+    try:
+        params = transfer_params(request.get_json())
+    except Exception as e:
+        return Response(sse({"type": "complete", "ok": 0, "total": 0, "error": str(e)}),
+                        status=400, mimetype="text/event-stream")
+    try:
+        job = jobs.submit(params)
+    except Exception as e:  # shutting down
+        return Response(sse({"type": "complete", "ok": 0, "total": 0, "error": str(e)}),
+                        status=503, mimetype="text/event-stream")
+    return job_event_stream(job)
+
+@app.route("/api/jobs", methods=["POST"])
+def api_jobs_submit():
+    try:
+        params = transfer_params(request.get_json())
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+    if not params["token"]:
+        return jsonify({"success": False, "error": "Token do Dropbox nao fornecido"})
+    if not params["files"] and not (params["url"] or params["share_id"]):
+        return jsonify({"success": False, "error": "Informe files ou a URL do compartilhamento"})
+    if params["sync"] and params["files"]:
+        return jsonify({"success": False, "error": "sync lista o compartilhamento sozinho: informe a URL, sem files"})
+    try:
+        job = jobs.submit(params)
+    except Exception as e:  # shutting down
+        return jsonify({"success": False, "error": str(e)}), 503
+    return jsonify({"success": True, "job": job.summary()})
+
+@app.route("/api/jobs", methods=["GET"])
+def api_jobs_list():
+    return jsonify({"success": True, "jobs": jobs.list()})
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job nao encontrado"}), 404
+    return jsonify({"success": True, "job": job.summary()})
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def api_job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job nao encontrado"}), 404
+    after = request.headers.get("Last-Event-ID") or request.args.get("after") or "0"
+    return job_event_stream(job, int(after) if after.isdigit() else 0)
 
 if __name__ == "__main__":
+    port = int(os.environ.get("PIKPAK_PORT", "5000"))
     print("=" * 50)
     print("  PikPak Link Extractor v4")
     print("  Com envio em massa para Dropbox!")
-    print("  Abra: http://localhost:5000")
+    print(f"  Abra: http://localhost:{port}")
+    print("  (servidor de desenvolvimento; pra muitos usuarios use pikpak_server.py)")
     print("=" * 50)
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host=os.environ.get("PIKPAK_HOST", "0.0.0.0"), port=port,
+            debug=os.environ.get("PIKPAK_DEBUG") == "1", threaded=True)
@@ -0,0 +1,119 @@
+"""
+Process-wide counters, gauges and histograms for the PikPak Link Extractor,
+rendered in the Prometheus text format by render() (served at /metrics).
+Hand-rolled so the app doesn't need prometheus_client.
+"""
+
+import threading
+
+registry = []
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        if not self.labels and self.kind != "histogram":
+            self.values[()] = 0
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.setdefault(key, [[0] * len(self.buckets), 0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, (counts, count, total) in sorted(self.values.items()):
+                for bound, n in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', bound)])} {n}")
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+upstream_seconds = Histogram(
+    "pikpak_upstream_request_seconds", "Upstream HTTP request latency (until response headers)", ("endpoint",))
+upstream_requests = Counter(
+    "pikpak_upstream_requests_total", "Upstream HTTP responses by status, retried ones included", ("endpoint", "status"))
+download_bytes = Counter("pikpak_download_bytes_total", "Bytes downloaded from the PikPak CDN")
+upload_bytes = Counter("pikpak_upload_bytes_total", "Bytes sent to Dropbox upload endpoints")
+files_transferred = Counter(
+    "pikpak_files_total", "Files finished by /api/dropbox-upload and jobs", ("result", "error_class"))
+transfers_in_flight = Gauge("pikpak_transfers_in_flight", "Files currently being downloaded or uploaded")
+temp_disk_bytes = Gauge("pikpak_temp_disk_bytes", "Bytes held in temp files by tempfile-mode transfers")
+upstream_throttled = Counter(
+    "pikpak_upstream_throttled_total", "Responses treated as throttling (429, throttle error, timeout, latency spike)", ("host",))
+upstream_concurrency_limit = Gauge(
+    "pikpak_upstream_concurrency_limit", "Adaptive in-flight request limit per upstream host", ("host",))
+upstream_rate_limit = Gauge("pikpak_upstream_rate_limit", "Adaptive requests/second limit per upstream host", ("host",))
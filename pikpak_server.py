@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Production server for the PikPak Link Extractor, on gunicorn instead of the
+Flask development server. Every upload keeps an SSE stream open for as long
+as its transfer runs, so the default worker is gthread with many threads per
+process; --worker-class gevent serves the streams cooperatively instead.
+
+On SIGTERM a process stops taking jobs, fails the ones still queued, ends
+the event streams of the running ones with a "shutdown" event and waits up
+to PIKPAK_DRAIN_TIMEOUT seconds for them; Ctrl-C does not wait. Whatever
+was still running resumes from the transfer journal when it is sent again.
+
+Run: pip install gunicorn && python pikpak_server.py --threads 64
+Requires: pip install gunicorn (and gevent for --worker-class gevent)
+"""
+
+import argparse
+import os
+import signal
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+# Read straight from the environment: the engine is only imported by the
+# worker processes, after gevent (when used) has patched them.
+HOST = os.environ.get("PIKPAK_HOST", "0.0.0.0")
+PORT = int(os.environ.get("PIKPAK_PORT", "5000"))
+SERVER_WORKERS = int(os.environ.get("PIKPAK_SERVER_WORKERS", "1"))  # processes; more than one needs PIKPAK_TASK_STORE
+SERVER_THREADS = int(os.environ.get("PIKPAK_SERVER_THREADS", "64"))  # requests (open SSE streams included) per gthread process
+WORKER_CLASS = os.environ.get("PIKPAK_WORKER_CLASS", "gthread")  # "gthread" or "gevent"
+GEVENT_CONNECTIONS = 1000  # simultaneous requests per gevent process
+DRAIN_TIMEOUT = int(os.environ.get("PIKPAK_DRAIN_TIMEOUT", "300"))  # seconds running transfers get to finish on shutdown
+
+
+def post_worker_init(worker):
+    # Stop taking jobs and end the job streams as soon as the signal arrives:
+    # gunicorn only calls worker_exit once the open requests have ended, so
+    # otherwise the drain would start at the SIGKILL deadline.
+    handle_exit = worker.handle_exit
+
+    def stop(signum, frame):
+        from pikpak_extractor import jobs
+        jobs.close()
+        handle_exit(signum, frame)
+
+    signal.signal(signal.SIGTERM, stop)
+
+
+def worker_exit(server, worker):
+    from pikpak_extractor import jobs
+    running = jobs.drain(DRAIN_TIMEOUT if jobs.closed is not None else 0)  # closed: SIGTERM, not Ctrl-C
+    if running:
+        worker.log.warning("%d envio(s) interrompido(s); enviar de novo continua do diario", running)
+        # The job threads would hold the exit until gunicorn's SIGKILL; the
+        # journal already has everything they uploaded.
+        os._exit(0)
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from pikpak_extractor import app
+        return app
+
+
+def main():
+    global DRAIN_TIMEOUT  # read by worker_exit in the forked workers
+    parser = argparse.ArgumentParser(description="Servidor de produção do PikPak Link Extractor (gunicorn)")
+    parser.add_argument("--bind", default=f"{HOST}:{PORT}", help="endereço:porta (PIKPAK_HOST, PIKPAK_PORT)")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS,
+                        help="processos (PIKPAK_SERVER_WORKERS); mais de um precisa de PIKPAK_TASK_STORE")
+    parser.add_argument("--threads", type=int, default=SERVER_THREADS,
+                        help="requisições ao mesmo tempo por processo gthread, contando cada envio acompanhado "
+                             "(PIKPAK_SERVER_THREADS)")
+    parser.add_argument("--worker-class", choices=("gthread", "gevent"), default=WORKER_CLASS,
+                        help="gthread (padrão) ou gevent, cooperativo, para muitas conexões abertas "
+                             "(PIKPAK_WORKER_CLASS)")
+    parser.add_argument("--drain-timeout", type=int, default=DRAIN_TIMEOUT,
+                        help="segundos que os envios em andamento têm pra terminar ao encerrar (PIKPAK_DRAIN_TIMEOUT)")
+    args = parser.parse_args()
+    # Jobs kept in memory are only visible to the process that took them
+    if args.workers > 1 and not os.environ.get("PIKPAK_TASK_STORE"):
+        parser.error("mais de um processo precisa de PIKPAK_TASK_STORE (e de pikpak_worker.py rodando)")
+
+    DRAIN_TIMEOUT = args.drain_timeout
+    options = {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": args.worker_class,
+        "threads": args.threads,
+        "worker_connections": GEVENT_CONNECTIONS,
+        # SIGKILL only after the drain had its chance
+        "graceful_timeout": args.drain_timeout + 30,
+        "keepalive": 30,
+        "accesslog": "-",
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit,
+    }
+    print(f"PikPak Link Extractor em http://{args.bind} ({args.workers} x {args.worker_class})", flush=True)
+    Server(options).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
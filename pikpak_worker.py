@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+"""
+Transfer workers for the PikPak Link Extractor. With PIKPAK_TASK_STORE set,
+the web app only enqueues jobs into that SQLite file and reports on them,
+and any number of `python pikpak_worker.py` processes (on this machine or
+on others sharing the volume) claim the files under a lease and upload
+them. A file whose worker stops heartbeating goes back to the queue and is
+picked up by another worker, continuing from the transfer journal when
+PIKPAK_JOURNAL points at the same volume.
+"""
+
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pikpak_core
+import pikpak_metrics as metrics
+from pikpak_core import (
+    ENGINE, JOB_WORKERS, JOB_HISTORY, TRANSFER_WORKERS, SKIP_EXISTING, TASK_STORE, TASK_LEASE, TASK_CLAIM,
+    TASK_CLAIM_BYTES, TASK_ATTEMPTS, PROGRESS_EVENTS, ShareSelection, extract_share_id, dropbox_folder_index,
+    find_existing, dropbox_path_for, file_size, transfer_error_detail, plan_sync, commit_sync, SHUTDOWN_EVENT,
+)
+
+POLL_SECONDS = 0.5  # how often idle workers and SSE followers look at the store
+PROGRESS_INTERVAL = 0.5  # min seconds between stored progress updates of one file
+EXISTING_TTL = 600  # seconds a worker reuses a job's destination folder listing
+
+
+def without_token(params):
+    """Stored job params (JSON) with the Dropbox token taken out."""
+    params = json.loads(params)
+    params.pop("token", None)
+    return json.dumps(params)
+
+
+class TaskStore:
+    """SQLite store of jobs, their per-file tasks and event logs, shared by the app and the workers.
+
+    A worker claims a task by writing its id and a lease deadline, and
+    renews the lease while it works. Tasks whose lease ran out are claimable
+    again. Jobs started from a share URL are listed by a worker the same way
+    before their tasks exist.
+
+    A job's params hold its Dropbox token until the job finishes, so the
+    file is as sensitive as the token itself.
+    """
+
+    def __init__(self, path, lease=TASK_LEASE):
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT NOT NULL DEFAULT '',
+                    total INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL);
+                CREATE TABLE IF NOT EXISTS tasks (
+                    job_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    file TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    worker TEXT,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    progress TEXT,
+                    PRIMARY KEY (job_id, idx));
+                CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (status, lease_until);
+                CREATE TABLE IF NOT EXISTS events (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    event TEXT NOT NULL);
+                CREATE INDEX IF NOT EXISTS events_job ON events (job_id, seq);""")
+            # Jobs finished before tokens were dropped on finish still have theirs
+            for job_id, params in self.conn.execute(
+                    "SELECT id, params FROM jobs WHERE finished IS NOT NULL AND params LIKE '%\"token\"%'").fetchall():
+                self.conn.execute("UPDATE jobs SET params = ? WHERE id = ?", (without_token(params), job_id))
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    # -- app side --
+
+    def create_job(self, params):
+        job_id = uuid.uuid4().hex[:12]
+        files = params.get("files") or []
+        stored = {k: v for k, v in params.items() if k != "files"}
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO jobs (id, params, status, created) VALUES (?, ?, 'queued', ?)",
+                         (job_id, json.dumps(stored), time.time()))
+            if files:
+                self.add_tasks(conn, job_id, files)
+            evicted = [(row[0],) for row in conn.execute(
+                "SELECT id FROM jobs WHERE finished IS NOT NULL AND id NOT IN "
+                "(SELECT id FROM jobs ORDER BY created DESC LIMIT ?)", (JOB_HISTORY,))]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", evicted)
+            conn.executemany("DELETE FROM tasks WHERE job_id = ?", evicted)
+            conn.executemany("DELETE FROM events WHERE job_id = ?", evicted)
+        return job_id
+
+    def job(self, job_id):
+        rows = self.query("SELECT id, params, status, error, total, created, started, finished FROM jobs WHERE id = ?",
+                          (job_id,))
+        if not rows:
+            return None
+        job = dict(zip(("id", "params", "status", "error", "total", "created", "started", "finished"), rows[0]))
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def job_ids(self):
+        return [row[0] for row in self.query("SELECT id FROM jobs ORDER BY created")]
+
+    def counts(self, job_id):
+        return dict(self.query("SELECT status, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY status", (job_id,)))
+
+    def events_after(self, job_id, seq):
+        return [(s, json.loads(e)) for s, e in
+                self.query("SELECT seq, event FROM events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, seq))]
+
+    def progress(self, job_id):
+        """Latest progress event of every file currently being transferred, by index."""
+        return {idx: json.loads(p) for idx, p in self.query(
+            "SELECT idx, progress FROM tasks WHERE job_id = ? AND status = 'running' AND progress IS NOT NULL",
+            (job_id,))}
+
+    # -- worker side --
+
+    def add_tasks(self, conn, job_id, files, sync=None):
+        conn.executemany("INSERT INTO tasks (job_id, idx, file) VALUES (?, ?, ?)",
+                         ((job_id, i, json.dumps(f)) for i, f in enumerate(files)))
+        conn.execute("UPDATE jobs SET status = 'running', total = ?, worker = NULL, started = ? WHERE id = ?",
+                     (len(files), time.time(), job_id))
+        self.append_event(conn, job_id, {"type": "job", "id": job_id, "total": len(files),
+                                         "bytes": sum(map(file_size, files)), **({"sync": sync} if sync else {})})
+
+    def append_event(self, conn, job_id, event):
+        conn.execute("INSERT INTO events (job_id, event) VALUES (?, ?)", (job_id, json.dumps(event)))
+
+    def log(self, job_id, event):
+        with self.transaction() as conn:
+            self.append_event(conn, job_id, event)
+
+    def claim_listing(self, worker):
+        """Claim a job that still has to be listed from its share URL. Returns (job_id, params) or None."""
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute("SELECT id, params FROM jobs WHERE status = 'queued' OR "
+                               "(status = 'listing' AND lease_until < ?) ORDER BY created LIMIT 1", (now,)).fetchone()
+            if not row:
+                return None
+            conn.execute("UPDATE jobs SET status = 'listing', worker = ?, lease_until = ? WHERE id = ?",
+                         (worker, now + self.lease, row[0]))
+        return row[0], json.loads(row[1])
+
+    def finish_listing(self, job_id, params, files, sync=None):
+        with self.transaction() as conn:
+            conn.execute("UPDATE jobs SET params = ? WHERE id = ?", (json.dumps(params), job_id))
+            self.add_tasks(conn, job_id, files, sync)
+            if not files:
+                self.finish_job(conn, job_id)
+
+    def fail_job(self, job_id, error):
+        with self.transaction() as conn:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (error[:500], job_id))
+            self.finish_job(conn, job_id)
+
+    def claim_tasks(self, worker):
+        """Claim queued (or abandoned) files of the oldest job with any, in order.
+
+        The worker sends them the job's `workers` at a time. A claim takes at
+        least that many files and then stops at TASK_CLAIM_BYTES or
+        TASK_CLAIM files, so small files come in big batches that share
+        finish_batch commits while large ones are left for other workers.
+
+        Returns (job_id, params, [(index, file)]) or None. Files whose
+        worker was lost TASK_ATTEMPTS times are failed instead of claimed.
+        """
+        now = time.time()
+        claimable = "job_id = ? AND (status = 'queued' OR (status = 'running' AND lease_until < ?))"
+        with self.transaction() as conn:
+            row = conn.execute("SELECT job_id FROM tasks WHERE status = 'queued' OR "
+                               "(status = 'running' AND lease_until < ?) ORDER BY rowid LIMIT 1", (now,)).fetchone()
+            if not row:
+                return None
+            job_id = row[0]
+            params = json.loads(conn.execute("SELECT params FROM jobs WHERE id = ?", (job_id,)).fetchone()[0])
+            workers = params.get("workers") or TRANSFER_WORKERS
+            claimed = []
+            claimed_bytes = 0
+            for idx, f, status, attempts in conn.execute(
+                    f"SELECT idx, file, status, attempts FROM tasks WHERE {claimable} ORDER BY idx LIMIT ?",
+                    (job_id, now, max(workers, TASK_CLAIM))).fetchall():
+                if len(claimed) >= workers and claimed_bytes >= TASK_CLAIM_BYTES:
+                    break
+                if status == "running" and attempts >= TASK_ATTEMPTS:
+                    self.finish_task_in(conn, job_id, idx, {
+                        "type": "error", "index": idx, "size": file_size(json.loads(f)),
+                        "detail": f"Worker perdido {attempts} vezes durante o envio deste arquivo"})
+                    continue
+                conn.execute("UPDATE tasks SET status = 'running', worker = ?, lease_until = ?, attempts = ?, "
+                             "progress = NULL WHERE job_id = ? AND idx = ?",
+                             (worker, now + self.lease, attempts + 1, job_id, idx))
+                claimed.append((idx, json.loads(f)))
+                claimed_bytes += file_size(claimed[-1][1])
+        return (job_id, params, claimed) if claimed else None
+
+    def heartbeat(self, worker):
+        until = time.time() + self.lease
+        with self.transaction() as conn:
+            conn.execute("UPDATE tasks SET lease_until = ? WHERE worker = ? AND status = 'running'", (until, worker))
+            conn.execute("UPDATE jobs SET lease_until = ? WHERE worker = ? AND status = 'listing'", (until, worker))
+
+    def set_progress(self, job_id, idx, event):
+        with self.transaction() as conn:
+            conn.execute("UPDATE tasks SET progress = ? WHERE job_id = ? AND idx = ? AND status = 'running'",
+                         (json.dumps(event), job_id, idx))
+
+    def finish_task(self, job_id, idx, event):
+        """Record a file's result. Returns True if it was the job's last file."""
+        with self.transaction() as conn:
+            return self.finish_task_in(conn, job_id, idx, event)
+
+    def finish_task_in(self, conn, job_id, idx, event):
+        # A file can finish twice if its lease ran out while the first worker
+        # was still on it; only the first result is logged.
+        changed = conn.execute("UPDATE tasks SET status = ?, progress = NULL WHERE job_id = ? AND idx = ? "
+                               "AND status NOT IN ('done', 'error')", (event["type"], job_id, idx)).rowcount
+        if not changed:
+            return False
+        self.append_event(conn, job_id, event)
+        if conn.execute("SELECT 1 FROM tasks WHERE job_id = ? AND status NOT IN ('done', 'error') LIMIT 1",
+                        (job_id,)).fetchone():
+            return False
+        self.finish_job(conn, job_id)
+        return True
+
+    def failed_file_ids(self, job_id):
+        return [json.loads(f)["id"] for (f,) in self.query(
+            "SELECT file FROM tasks WHERE job_id = ? AND status = 'error'", (job_id,))]
+
+    def finish_job(self, conn, job_id):
+        # The token is only needed while files are left to send; workers
+        # still on the job keep their own copy of the params
+        status, error, total, params = conn.execute("SELECT status, error, total, params FROM jobs WHERE id = ?",
+                                                    (job_id,)).fetchone()
+        ok = conn.execute("SELECT COUNT(*) FROM tasks WHERE job_id = ? AND status = 'done'", (job_id,)).fetchone()[0]
+        conn.execute("UPDATE jobs SET status = ?, finished = ?, worker = NULL, params = ? WHERE id = ?",
+                     ("done" if status in ("running", "listing") else status, time.time(), without_token(params),
+                      job_id))
+        self.append_event(conn, job_id, {"type": "complete", "ok": ok, "total": total,
+                                         **({"error": error} if error else {})})
+
+    def release(self, worker):
+        """Hand back everything `worker` holds, so other workers can claim it right away."""
+        with self.transaction() as conn:
+            conn.execute("UPDATE tasks SET status = 'queued', worker = NULL, lease_until = 0, progress = NULL "
+                         "WHERE worker = ? AND status = 'running'", (worker,))
+            conn.execute("UPDATE jobs SET status = 'queued', worker = NULL, lease_until = 0 "
+                         "WHERE worker = ? AND status = 'listing'", (worker,))
+
+
+class StoredJob:
+    """A job in a TaskStore, with the summary()/subscribe()/unsubscribe() of TransferJob."""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.id = job_id
+        self.followers = {}
+        self.detached = None
+        self.lock = threading.Lock()
+
+    def summary(self):
+        job = self.store.job(self.id) or {"params": {}}
+        counts = self.store.counts(self.id)
+        p = job["params"]
+        return {
+            "id": self.id, "status": job.get("status", "gone"), "error": job.get("error", ""),
+            "share_id": p.get("share_id") or p.get("url", ""), "folder": p.get("folder", ""),
+            "total": job.get("total", 0), "ok": counts.get("done", 0), "failed": counts.get("error", 0),
+            "created": job.get("created"), "started": job.get("started"), "finished": job.get("finished"),
+        }
+
+    def subscribe(self, after=0):
+        """Same contract as TransferJob.subscribe; live events come from polling the store."""
+        q = queue.Queue()
+        backlog = self.store.events_after(self.id, after)
+        progress = self.store.progress(self.id)
+        done = any(e["type"] == "complete" for _, e in backlog)
+        last = backlog[-1][0] if backlog else after
+        backlog += [(None, e) for e in progress.values()]
+        if done or self.detached:
+            if not done:
+                backlog.append((None, self.detached))
+            q.put(None)
+        else:
+            stop = threading.Event()
+            with self.lock:
+                self.followers[q] = stop
+            threading.Thread(target=self.follow, args=(q, stop, last, progress), daemon=True).start()
+        return backlog, q
+
+    def follow(self, q, stop, last, seen):
+        seen = {idx: json.dumps(e, sort_keys=True) for idx, e in seen.items()}
+        while not stop.wait(POLL_SECONDS):
+            for seq, event in self.store.events_after(self.id, last):
+                q.put((seq, event))
+                last = seq
+                if event["type"] == "complete":
+                    q.put(None)
+                    return
+            for idx, event in self.store.progress(self.id).items():
+                encoded = json.dumps(event, sort_keys=True)
+                if seen.get(idx) != encoded:
+                    seen[idx] = encoded
+                    q.put((None, event))
+
+    def unsubscribe(self, q):
+        with self.lock:
+            stop = self.followers.pop(q, None)
+        if stop:
+            stop.set()
+
+    def detach(self, event):
+        """End every live subscription with `event`, as TransferJob.detach does; the workers keep going."""
+        with self.lock:
+            self.detached = event
+            followers, self.followers = self.followers, {}
+        for q, stop in followers.items():
+            stop.set()
+            q.put((None, event))
+            q.put(None)
+
+
+class StoreJobQueue:
+    """JobQueue stand-in for the web app that only enqueues into a TaskStore; workers run the jobs."""
+
+    def __init__(self, path):
+        self.store = TaskStore(path)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.closed = None
+
+    def submit(self, params):
+        return self.get(self.store.create_job(params))
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None and self.store.job(job_id):
+                job = self.jobs[job_id] = StoredJob(self.store, job_id)
+                if self.closed is not None:
+                    job.detached = SHUTDOWN_EVENT
+            return job
+
+    def list(self):
+        return [StoredJob(self.store, job_id).summary() for job_id in self.store.job_ids()]
+
+    def close(self):
+        """Stop the event streams of the jobs this process is following; the jobs themselves go on."""
+        with self.lock:
+            self.closed = time.monotonic()
+            jobs = list(self.jobs.values())
+        for job in jobs:
+            job.detach(SHUTDOWN_EVENT)
+
+    def drain(self, timeout):
+        """Nothing to wait for: the jobs live in the store and the workers keep running them."""
+        self.close()
+        return 0
+
+
+class Worker:
+    """Claims listings and files from a TaskStore on `slots` threads and runs them on `engine`."""
+
+    def __init__(self, store, engine, slots=None):
+        self.store = store
+        self.engine = engine
+        self.slots = slots or JOB_WORKERS
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.stopping = threading.Event()
+        self.existing = {}
+        self.existing_locks = {}  # job id -> lock held while that job's folder is listed
+        self.existing_lock = threading.Lock()
+
+    def run(self):
+        """Work until SIGTERM (finish what was claimed) or Ctrl-C (hand it back right away)."""
+        signal.signal(signal.SIGTERM, lambda *args: self.stopping.set())
+        threads = [threading.Thread(target=self.loop, name=f"pikpak-worker-{n}", daemon=True)
+                   for n in range(self.slots)]
+        threads.append(threading.Thread(target=self.beat, name="pikpak-heartbeat", daemon=True))
+        for t in threads:
+            t.start()
+        try:
+            for t in threads[:-1]:
+                while t.is_alive():
+                    t.join(1)
+        except KeyboardInterrupt:
+            self.stopping.set()
+        finally:
+            self.store.release(self.id)
+
+    def beat(self):
+        while not self.stopping.wait(self.store.lease / 3):
+            try:
+                self.store.heartbeat(self.id)
+            except sqlite3.Error as e:
+                print(f"[{self.id}] heartbeat falhou: {e}", flush=True)
+
+    def loop(self):
+        while not self.stopping.is_set():
+            try:
+                busy = self.step()
+            except sqlite3.Error as e:
+                print(f"[{self.id}] erro no banco de tarefas: {e}", flush=True)
+                busy = False
+            if not busy:
+                self.stopping.wait(POLL_SECONDS)
+
+    def step(self):
+        claimed = self.store.claim_listing(self.id)
+        if claimed:
+            self.list_job(*claimed)
+            return True
+        claimed = self.store.claim_tasks(self.id)
+        if claimed:
+            self.transfer(*claimed)
+            return True
+        return False
+
+    def list_job(self, job_id, p):
+        sync = None
+        try:
+            share_id = extract_share_id(p["url"]) if p.get("url") else p.get("share_id", "")
+            info = self.engine.get_share_info(share_id)
+            if info.get("error"):
+                raise Exception(info.get("error_description", "Erro"))
+            pass_code_token = info.get("pass_code_token", "")
+            selection = ShareSelection.from_params(p)
+            if p.get("sync"):
+                files, sync = plan_sync(self.engine, job_id, p["folder"], share_id, pass_code_token, selection,
+                                        p.get("full"), p.get("delete"))
+                if not sync["first"]:
+                    p = {**p, "skip_existing": False}  # the snapshot already says what is in the folder
+            else:
+                files = self.engine.list_share_files(share_id, pass_code_token, selection=selection)
+        except Exception as e:
+            return self.store.fail_job(job_id, str(e))
+        self.store.finish_listing(job_id, {**p, "share_id": share_id, "pass_code_token": pass_code_token},
+                                  files, sync)
+        if sync and not files:
+            self.commit_sync(job_id, p)
+
+    def finish_task(self, job_id, p, idx, event):
+        if self.store.finish_task(job_id, idx, event) and p.get("sync"):
+            self.commit_sync(job_id, p, self.store.failed_file_ids(job_id))
+
+    def commit_sync(self, job_id, p, failed_ids=()):
+        # Runs in the emit of whichever batch sent the job's last file, so a
+        # failed delete is only logged; the next sync plans it again
+        try:
+            commit_sync(job_id, failed_ids, p["token"])
+        except Exception as e:
+            print(f"[{self.id}] sincronizacao do job {job_id} nao concluida: {transfer_error_detail(e)}", flush=True)
+
+    def existing_index(self, job_id, p):
+        """The job's destination folder listing, shared by this worker's batches for EXISTING_TTL.
+
+        Listing a big folder takes a while, so only batches of the same job
+        wait for it; existing_lock just guards the dicts.
+        """
+        with self.existing_lock:
+            job_lock = self.existing_locks.setdefault(job_id, threading.Lock())
+        with job_lock:
+            with self.existing_lock:
+                cached = self.existing.get(job_id)
+            if cached and time.monotonic() - cached[0] < EXISTING_TTL:
+                return cached[1]
+            try:
+                index = dropbox_folder_index(p["token"], p["folder"])
+            except Exception:
+                index = None  # no listing: upload everything, as run_transfers does
+            with self.existing_lock:
+                now = time.monotonic()
+                self.existing = {k: v for k, v in self.existing.items() if now - v[0] < EXISTING_TTL}
+                self.existing[job_id] = (now, index)
+                self.existing_locks = {k: v for k, v in self.existing_locks.items()
+                                       if k in self.existing or v.locked()}
+            return index
+
+    def transfer(self, job_id, p, claimed):
+        # The folder listing is done once per job here rather than by every
+        # batch's run_transfers
+        if SKIP_EXISTING if p.get("skip_existing") is None else p.get("skip_existing"):
+            index = self.existing_index(job_id, p)
+            pending = []
+            for idx, f in claimed:
+                existing = find_existing(index, dropbox_path_for(p["folder"], f), f)
+                if existing:
+                    metrics.files_transferred.inc(result="skipped")
+                    self.finish_task(job_id, p, idx, {"type": "done", "index": idx, "path": existing["path"],
+                                                      "size": file_size(f), "skipped": True})
+                else:
+                    pending.append((idx, f))
+            claimed = pending
+        if not claimed:
+            return
+        indexes = [idx for idx, _ in claimed]
+        last_progress = {}
+
+        def emit(event):
+            idx = indexes[event["index"]]
+            event = {**event, "index": idx}
+            if event["type"] in PROGRESS_EVENTS:
+                now = time.monotonic()
+                if now - last_progress.get(idx, 0) >= PROGRESS_INTERVAL:
+                    last_progress[idx] = now
+                    self.store.set_progress(job_id, idx, event)
+            elif event["type"] in ("done", "error"):
+                self.finish_task(job_id, p, idx, event)
+            else:
+                self.store.log(job_id, event)
+
+        try:
+            self.engine.run_transfers(p["token"], p["folder"], p.get("share_id", ""), p.get("pass_code_token", ""),
+                                      [f for _, f in claimed], emit, p.get("mode"), p.get("workers"),
+                                      p.get("batch_commit"), p.get("resume", True), False)
+        except Exception as e:
+            for idx, f in claimed:
+                self.finish_task(job_id, p, idx, {"type": "error", "index": idx, "size": file_size(f),
+                                                  "detail": transfer_error_detail(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker de envios do PikPak Link Extractor")
+    parser.add_argument("--store", default=TASK_STORE, help="banco SQLite de tarefas (PIKPAK_TASK_STORE)")
+    parser.add_argument("--slots", type=int, default=JOB_WORKERS,
+                        help="lotes de arquivos processados ao mesmo tempo (PIKPAK_JOB_WORKERS)")
+    args = parser.parse_args()
+    if not args.store:
+        parser.error("informe --store ou PIKPAK_TASK_STORE")
+
+    engine = pikpak_core
+    if ENGINE == "async":
+        from pikpak_async import AsyncEngine
+        engine = AsyncEngine()
+    worker = Worker(TaskStore(args.store), engine, args.slots)
+    print(f"Worker {worker.id}: {args.slots} lotes em paralelo, tarefas em {args.store}", flush=True)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""A local HTTP server standing in for the PikPak API, its CDN and Dropbox, for tests that go over the wire."""
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pikpak_core as core
+
+
+def content_hash(data):
+    hasher = core.DropboxContentHasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def gcid(data):
+    hasher = core.PikPakGcidHasher(len(data))
+    hasher.update(data)
+    return hasher.hexdigest().upper()
+
+
+class FakeServer:
+    """One share ({folder_id: entries}, file bytes by id) and one Dropbox account ({path: bytes}).
+
+    `corrupt` holds ids of files whose CDN download has a byte flipped.
+    `ranges` records the start offset of every CDN request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def reset(self):
+        self.tree = {"": []}
+        self.data = {}
+        self.dropbox = {}
+        self.sessions = {}
+        self.corrupt = set()
+        self.ranges = []
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def add_folder(self, parent_id, folder_id, name):
+        self.tree[parent_id].append({"kind": "drive#folder", "id": folder_id, "name": name,
+                                     "modified_time": "2024-01-01T00:00:00Z"})
+        self.tree[folder_id] = []
+
+    def add_file(self, parent_id, file_id, name, data):
+        self.tree[parent_id].append({"kind": "drive#file", "id": file_id, "name": name, "size": str(len(data)),
+                                     "hash": gcid(data), "mime_type": "video/x-matroska"})
+        self.data[file_id] = data
+
+    def commit(self, commit, data):
+        path = commit["path"]
+        taken = {p.lower(): p for p in self.dropbox}
+        if commit["mode"] != "overwrite" and path.lower() in taken and self.dropbox[taken[path.lower()]] != data:
+            stem, dot, ext = path.rpartition(".")
+            n = 1
+            while f"{stem} ({n}).{ext}".lower() in taken:
+                n += 1
+            path = f"{stem} ({n}).{ext}"
+        elif path.lower() in taken:
+            del self.dropbox[taken[path.lower()]]
+        self.dropbox[path] = data
+        return {"path_display": path, "path_lower": path.lower(), "size": len(data), "content_hash": content_hash(data)}
+
+    def session_data(self, session_id):
+        return b"".join(block for _, block in sorted(self.sessions[session_id].items()))
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, status=200, content_type="application/json", headers=()):
+                if content_type == "application/json":
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if url.path == "/drive/v1/share":
+                    return self.reply({"title": "Share", "pass_code_token": ""})
+                if url.path == "/drive/v1/share/detail":
+                    entries = server.tree[query.get("parent_id", "")]
+                    start, limit = int(query.get("page_token") or 0), int(query["limit"])
+                    next_page = str(start + limit) if start + limit < len(entries) else ""
+                    return self.reply({"files": entries[start:start + limit], "next_page_token": next_page})
+                if url.path == "/drive/v1/share/file_info":
+                    link = f"{server.url}/cdn/{query['file_id']}"
+                    return self.reply({"file_info": {"web_content_link": link}})
+                if url.path.startswith("/cdn/"):
+                    file_id = url.path[5:]
+                    data = server.data[file_id]
+                    if file_id in server.corrupt:
+                        data = data[:-1] + bytes([data[-1] ^ 1])
+                    match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+                    start = int(match.group(1)) if match else 0
+                    end = int(match.group(2) or len(data) - 1) if match else len(data) - 1
+                    with server.lock:
+                        server.ranges.append(start)
+                    if not match:
+                        return self.reply(data, content_type="application/octet-stream")
+                    return self.reply(data[start:end + 1], 206, "application/octet-stream",
+                                      [("Content-Range", f"bytes {start}-{end}/{len(data)}")])
+                self.reply({"error": "not_found"}, 404)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                arg = json.loads(self.headers.get("Dropbox-API-Arg") or body or b"{}")
+                endpoint = urlparse(self.path).path[len("/2/files/"):]
+                with server.lock:
+                    result = self.dropbox(endpoint, arg, body)
+                if result is None:
+                    return self.reply({"error_summary": "not_found/"}, 404)
+                self.reply(result)
+
+            def dropbox(self, endpoint, arg, body):
+                if endpoint == "upload":
+                    return server.commit(arg, body)
+                if endpoint == "upload_session/start":
+                    session_id = f"s{len(server.sessions)}"
+                    server.sessions[session_id] = {0: body} if body else {}
+                    return {"session_id": session_id}
+                if endpoint == "upload_session/append_v2":
+                    server.sessions[arg["cursor"]["session_id"]][arg["cursor"]["offset"]] = body
+                    return {}
+                if endpoint == "upload_session/finish":
+                    session = server.sessions[arg["cursor"]["session_id"]]
+                    if body:
+                        session[arg["cursor"]["offset"]] = body
+                    return server.commit(arg["commit"], server.session_data(arg["cursor"]["session_id"]))
+                if endpoint == "upload_session/finish_batch":
+                    return {".tag": "complete", "entries": [
+                        {".tag": "success", **server.commit(e["commit"], server.session_data(e["cursor"]["session_id"]))}
+                        for e in arg["entries"]]}
+                if endpoint == "list_folder":
+                    return {"entries": [{".tag": "file", "path_display": path, "path_lower": path.lower(),
+                                         "size": len(data), "content_hash": content_hash(data)}
+                                        for path, data in server.dropbox.items()], "has_more": False}
+                if endpoint == "delete_v2":
+                    for path in list(server.dropbox):
+                        if path.lower() == arg["path"].lower():
+                            del server.dropbox[path]
+                    return {}
+                return None
+
+        return Handler
@@ -0,0 +1,33 @@
+"""Stand-ins shared by the tests: a PikPak share tree served through fetch_share_page."""
+
+
+def folder(folder_id, name, mtime):
+    return {"kind": "drive#folder", "id": folder_id, "name": name, "modified_time": mtime}
+
+
+def video(file_id, name, size=100):
+    return {"kind": "drive#file", "id": file_id, "name": name, "size": str(size), "hash": "H" + file_id,
+            "mime_type": "video/x-matroska"}
+
+
+class FakeShare:
+    """A share's folders as {folder_id: entries}, served through fetch_share_page."""
+
+    def __init__(self):
+        self.tree = {
+            "": [video("t", "top.mkv"), folder("A", "A", "1")],
+            "A": [video("one", "one.mkv"), folder("B", "B", "1")],
+            "B": [video("two", "two.mkv"), video("three", "three.mkv")],
+        }
+        self.listed = []
+        self.deleted = []
+
+    def fetch_share_page(self, share_id, pass_code_token, parent_id, page_token, headers):
+        self.listed.append(parent_id)
+        return [dict(f) for f in self.tree[parent_id]], ""
+
+    def touch(self, folder_id, mtime):
+        for entries in self.tree.values():
+            for f in entries:
+                if f["id"] == folder_id:
+                    f["modified_time"] = mtime
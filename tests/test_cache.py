@@ -0,0 +1,84 @@
+"""TTLCache expiry and eviction, and how share info and download links use it."""
+
+import pytest
+
+import pikpak_core as core
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(core, "time", clock)
+    return clock
+
+
+def test_entries_expire_after_their_own_ttl(clock):
+    cache = core.TTLCache(10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=600)
+    cache.set("c", 3, ttl=0)  # not stored at all
+    clock.now += 61
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (None, 2, None)
+    assert cache.stats() == {"entries": 1, "maxsize": 10, "hits": 1, "misses": 2}
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = core.TTLCache(2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_invalidate_drops_matching_keys(clock):
+    cache = core.TTLCache(10, ttl=60)
+    for key in [("s1", "x"), ("s1", "y"), ("s2", "x")]:
+        cache.set(key, key)
+    assert cache.invalidate(lambda k: k[0] == "s1") == 2
+    assert cache.get(("s2", "x")) == ("s2", "x")
+    assert cache.invalidate() == 1
+
+
+@pytest.fixture
+def links(clock, monkeypatch):
+    monkeypatch.setattr(core, "link_cache", core.TTLCache(10, core.LINK_TTL_DEFAULT))
+    fetched = []
+
+    def fetch_file_download_link(share_id, file_id, pass_code_token=""):
+        fetched.append(file_id)
+        return f"https://cdn/{file_id}?e={int(clock.now) + 1000}"
+
+    monkeypatch.setattr(core, "fetch_file_download_link", fetch_file_download_link)
+    return fetched
+
+
+def test_download_link_is_reused_until_shortly_before_it_expires(clock, links):
+    first = core.get_file_download_link("s", "f")
+    assert core.get_file_download_link("s", "f") == first and links == ["f"]
+    clock.now += 1000 - core.LINK_EXPIRY_MARGIN
+    assert core.get_file_download_link("s", "f") != first and links == ["f", "f"]
+    core.get_file_download_link("s", "f", fresh=True)
+    assert links == ["f", "f", "f"]
+
+
+def test_link_without_expiry_gets_the_default_ttl(clock):
+    assert core.link_ttl("https://cdn/f?e=1700000600") == 600 - core.LINK_EXPIRY_MARGIN
+    assert core.link_ttl("https://cdn/f") == core.LINK_TTL_DEFAULT
+
+
+def test_share_info_errors_are_not_cached(clock, monkeypatch):
+    monkeypatch.setattr(core, "share_cache", core.TTLCache(10, 60))
+    answers = [{"error": "share_not_found"}, {"title": "T"}]
+    monkeypatch.setattr(core, "pikpak_api_get", lambda path, params, headers: answers.pop(0))
+    assert core.get_share_info("s") == {"error": "share_not_found"}
+    assert core.get_share_info("s") == {"title": "T"}
+    assert core.get_share_info("s") == {"title": "T"} and not answers
@@ -0,0 +1,124 @@
+"""Both engines against the same fake PikPak and Dropbox: same listing, same events, same Dropbox contents."""
+
+import pytest
+
+import pikpak_core as core
+from fake_server import FakeServer, gcid
+
+MB = 1024 * 1024
+SMALL = bytes(range(256)) * 400  # 100 KiB
+LARGE = bytes(range(251)) * (9 * MB // 251)  # ~9 MiB, a concurrent session of several 4 MiB blocks
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = FakeServer()
+    yield srv
+    srv.close()
+
+
+@pytest.fixture(scope="module")
+def async_engine():
+    pytest.importorskip("aiohttp")
+    import pikpak_async
+    engine = pikpak_async.AsyncEngine()
+    yield engine
+    engine.close()
+
+
+@pytest.fixture(params=["threads", "async"])
+def engine(request, server, tmp_path, monkeypatch):
+    server.reset()
+    for cache in (core.share_cache, core.listing_cache, core.link_cache):
+        cache.invalidate()
+    monkeypatch.setattr(core, "API_BASE", server.url)
+    monkeypatch.setattr(core, "DROPBOX_CONTENT_URL", server.url + "/2")
+    monkeypatch.setattr(core, "DROPBOX_API_URL", server.url + "/2")
+    monkeypatch.setattr(core, "SIMPLE_UPLOAD_MAX", MB)
+    monkeypatch.setattr(core, "JOURNAL_PATH", str(tmp_path / "journal.db"))
+    monkeypatch.setattr(core, "journal", None)
+    return request.getfixturevalue("async_engine") if request.param == "async" else core
+
+
+def share(server):
+    server.add_file("", "a", "a.mkv", SMALL)
+    server.add_folder("", "F", "Season 1")
+    server.add_file("F", "b", "b.mkv", SMALL[::-1])
+    server.add_file("F", "big", "big.mkv", LARGE)
+    return [{"id": f_id, "name": name, "size": str(len(server.data[f_id])), "hash": gcid(server.data[f_id])}
+            for f_id, name in (("a", "a.mkv"), ("b", "Season 1/b.mkv"), ("big", "Season 1/big.mkv"))]
+
+
+def transfer(engine, files, batch_commit=False, skip_existing=False):
+    events = []
+    ok = engine.run_transfers("token", "/D", "share", "", files, events.append, "stream", 4, batch_commit, True,
+                              skip_existing)
+    outcome = sorted((e["index"], e["type"], e.get("path"), e.get("skipped", False), e.get("detail"))
+                     for e in events if e["type"] in ("done", "error"))
+    return ok, outcome
+
+
+def test_listing_pages_through_every_folder(engine, server):
+    share(server)
+    for n in range(150):
+        server.add_file("F", f"x{n}", f"x{n:03}.mkv", b"x")
+    files = engine.list_share_files("share", fresh=True)
+    names = sorted(f["name"] for f in files)
+    assert len(names) == 153
+    assert names[:3] == ["Season 1/b.mkv", "Season 1/big.mkv", "Season 1/x000.mkv"] and names[-1] == "a.mkv"
+
+
+@pytest.mark.parametrize("batch_commit", [False, True])
+def test_files_arrive_intact_and_a_second_run_skips_them(engine, server, batch_commit):
+    files = share(server)
+    assert transfer(engine, files, batch_commit) == (3, [
+        (0, "done", "/D/a.mkv", False, None),
+        (1, "done", "/D/b.mkv", False, None),
+        (2, "done", "/D/big.mkv", False, None),
+    ])
+    assert server.dropbox == {"/D/a.mkv": SMALL, "/D/b.mkv": SMALL[::-1], "/D/big.mkv": LARGE}
+    assert transfer(engine, files)[1] == [
+        (0, "done", "/D/a.mkv", True, None),
+        (1, "done", "/D/b.mkv", True, None),
+        (2, "done", "/D/big.mkv", True, None),
+    ]
+
+
+def test_files_already_in_dropbox_are_skipped_without_the_journal(engine, server):
+    files = share(server)
+    server.dropbox["/D/B.mkv"] = SMALL[::-1]
+    ok, outcome = transfer(engine, files[:2], skip_existing=True)
+    assert outcome[1] == (1, "done", "/D/B.mkv", True, None)
+    assert list(server.dropbox) == ["/D/B.mkv", "/D/a.mkv"]
+
+
+def test_an_open_session_is_resumed_from_its_checkpoint(engine, server):
+    files = share(server)
+    for f_id, name, offset, concurrent in (("b", "Season 1/b.mkv", 4096, False),
+                                           ("big", "Season 1/big.mkv", 4 * MB, True)):
+        server.sessions[f"open-{f_id}"] = {0: server.data[f_id][:offset]}
+        core.get_journal().checkpoint("share", f_id, "/D/" + name.split("/")[-1], f"open-{f_id}", offset, concurrent)
+    assert transfer(engine, files)[0] == 3
+    assert sorted(server.ranges) == [0, 4096, 4 * MB]
+    assert server.dropbox["/D/b.mkv"] == SMALL[::-1] and server.dropbox["/D/big.mkv"] == LARGE
+
+
+def test_a_corrupt_download_fails_and_is_not_committed(engine, server):
+    files = share(server)
+    server.corrupt = {"a", "big"}
+    ok, outcome = transfer(engine, files)
+    assert ok == 1
+    assert [(i, kind) for i, kind, _, _, _ in outcome] == [(0, "error"), (1, "done"), (2, "error")]
+    assert outcome[0][4] == "Arquivo baixado nao confere com o hash do PikPak (a.mkv)"
+    assert outcome[2][4] == "Arquivo baixado nao confere com o hash do PikPak (big.mkv)"
+    assert list(server.dropbox) == ["/D/b.mkv"]
+
+
+def test_a_changed_file_replaces_its_autorenamed_copy(engine, server):
+    files = share(server)
+    server.dropbox["/D/a.mkv"] = b"someone else's file"
+    assert transfer(engine, files[:1])[1] == [(0, "done", "/D/a (1).mkv", False, None)]
+    server.data["a"] = SMALL[:1000]
+    changed = {"id": "a", "name": "a.mkv", "size": "1000", "overwrite": True, "dropbox_path": "/D/a (1).mkv"}
+    assert transfer(engine, [changed])[1] == [(0, "done", "/D/a (1).mkv", False, None)]
+    assert server.dropbox == {"/D/a.mkv": b"someone else's file", "/D/a (1).mkv": SMALL[:1000]}
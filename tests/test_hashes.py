@@ -0,0 +1,63 @@
+"""PikPak gcid and Dropbox content_hash, fed the way downloads arrive: in pieces of any size."""
+
+import hashlib
+
+import pytest
+
+import pikpak_core as core
+
+MIB = 1024 * 1024
+DATA = bytes(range(256)) * 4096  # 1 MiB
+
+
+def fed(hasher, data, piece):
+    for i in range(0, len(data), piece):
+        hasher.update(data[i:i + piece])
+    return hasher.hexdigest()
+
+
+@pytest.mark.parametrize("size, block", [
+    (0, 256 * 1024),
+    (128 * MIB, 256 * 1024),
+    (128 * MIB + 1, 512 * 1024),
+    (512 * MIB, 1024 * 1024),
+    (1024 * MIB + 1, 2 * MIB),
+    (50 * 1024 * MIB, 2 * MIB),
+])
+def test_gcid_block_size(size, block):
+    assert core.gcid_block_size(size) == block
+
+
+@pytest.mark.parametrize("data, expected", [
+    (DATA, "4829EBB1CE133E4AE13939C3DDE953C138E60171"),  # four full 256 KiB blocks
+    (DATA + b"x", "5B8E809E2BA24661303EE0CE3D2DC29C7C02CED3"),  # plus a one-byte block
+    (b"", "DA39A3EE5E6B4B0D3255BFEF95601890AFD80709"),  # no blocks: SHA-1 of nothing
+])
+@pytest.mark.parametrize("piece", [1000, 256 * 1024, 8 * MIB])
+def test_gcid_vectors(data, expected, piece):
+    assert fed(core.PikPakGcidHasher(len(data)), data, piece).upper() == expected
+
+
+def test_dropbox_content_hash_matches_block_definition():
+    data = DATA * 9  # two full 4 MiB blocks and a partial one
+    blocks = b"".join(hashlib.sha256(data[i:i + 4 * MIB]).digest() for i in range(0, len(data), 4 * MIB))
+    assert fed(core.DropboxContentHasher(), data, 3 * MIB + 7) == hashlib.sha256(blocks).hexdigest()
+
+
+def test_download_check_rejects_wrong_gcid_and_size(monkeypatch):
+    monkeypatch.setattr(core, "VERIFY_HASH", True)
+    f = {"name": "A/a.mkv", "hash": "4829ebb1ce133e4ae13939c3dde953c138e60171"}
+    check = core.DownloadCheck(f, len(DATA))
+    check.update(DATA)
+    check.verify()
+
+    check = core.DownloadCheck(f, len(DATA))
+    check.update(DATA[:-1] + b"\x00")
+    with pytest.raises(Exception, match="hash do PikPak") as e:
+        check.verify()
+    assert core.is_corrupt(e.value)
+
+    check = core.DownloadCheck(f, len(DATA))
+    check.update(DATA[:-1])
+    with pytest.raises(Exception, match="incompleto"):
+        check.verify()
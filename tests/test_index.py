@@ -0,0 +1,62 @@
+"""FileIndex: building it from crawled pages and paging through it with sorts and filters."""
+
+import pytest
+
+import pikpak_core as core
+from fakes import folder, video
+
+GCID = "0123456789ABCDEF0123456789ABCDEF01234567"
+
+
+@pytest.fixture
+def index():
+    pages = {
+        ("", 0): [video("t", "top.mkv", 50), folder("A", "A", "1")],
+        ("", 1): [{"kind": "drive#file", "id": "n", "name": "notes.txt", "size": "7", "mime_type": "text/plain"}],
+        ("A", 0): [video("one", "one.mkv", 300), folder("B", "B", "1")],
+        ("B", 0): [video("two", "Two.mkv", 200), video("three", "three.mkv", 100)],
+    }
+    pages["B", 0][0]["hash"] = GCID
+    return core.FileIndex.from_pages(pages)
+
+
+def names(page):
+    return [f["name"] for f in page]
+
+
+def test_rows_are_depth_first_across_pages(index):
+    assert names(index.files()) == ["top.mkv", "A/one.mkv", "A/B/Two.mkv", "A/B/three.mkv", "notes.txt"]
+    assert index.files(prefix="S/", start=2, stop=3) == [
+        {"id": "two", "name": "S/A/B/Two.mkv", "size": "200", "mime_type": "video/x-matroska", "hash": GCID}]
+    assert index.entry(0)["hash"] == ""  # "Ht" isn't a gcid
+
+
+def test_query_pages_in_listing_order(index):
+    assert index.query(0, 2) == (5, index.files(stop=2))
+    total, page = index.query(4, 2)
+    assert (total, names(page)) == (5, ["notes.txt"])
+    assert index.query(10, 2) == (5, [])
+
+
+@pytest.mark.parametrize("sort, desc, expected", [
+    ("name", False, ["A/B/three.mkv", "A/B/Two.mkv", "A/one.mkv", "notes.txt", "top.mkv"]),
+    ("size", False, ["notes.txt", "top.mkv", "A/B/three.mkv", "A/B/Two.mkv", "A/one.mkv"]),
+    ("size", True, ["A/one.mkv", "A/B/Two.mkv", "A/B/three.mkv", "top.mkv", "notes.txt"]),
+    ("bogus", True, ["notes.txt", "A/B/three.mkv", "A/B/Two.mkv", "A/one.mkv", "top.mkv"]),
+])
+def test_query_sorts(index, sort, desc, expected):
+    assert names(index.query(sort=sort, desc=desc)[1]) == expected
+
+
+def test_query_filters_before_paging(index):
+    total, page = index.query(1, 1, sort="name", glob="A/B/*,top.*", min_size=100)
+    assert (total, names(page)) == (2, ["A/B/Two.mkv"])
+    assert names(index.query(glob="T*.MKV")[1]) == ["top.mkv", "A/B/Two.mkv", "A/B/three.mkv"]
+    assert names(index.query(mime="text/,image/")[1]) == ["notes.txt"]
+    assert index.query(min_size=150, max_size=250)[0] == 1
+
+
+def test_selection_prunes_while_building():
+    pages = {("", 0): [video("t", "top.mkv"), folder("A", "A", "1")], ("A", 0): [video("one", "one.mkv")]}
+    selection = core.ShareSelection(exclude="A")
+    assert names(core.FileIndex.from_pages(pages, selection=selection).files()) == ["top.mkv"]
@@ -0,0 +1,106 @@
+"""JobQueue and TransferJob: replaying a job's log, and what close() and drain() do to queued and running jobs."""
+
+import threading
+
+import pytest
+
+import pikpak_core as core
+
+
+class FakeEngine:
+    """run_transfers sends each file's progress, then waits for `release` before reporting it done."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def run_transfers(self, token, folder, share_id, pass_code_token, files, emit, *args):
+        for i, f in enumerate(files):
+            emit({"type": "start", "index": i, "name": f["name"]})
+            emit({"type": "downloading", "index": i, "percent": 10})
+            emit({"type": "downloading", "index": i, "percent": 60})
+        self.started.set()
+        self.release.wait(5)
+        for i in range(len(files)):
+            emit({"type": "done", "index": i, "path": "/D/" + files[i]["name"], "size": 1})
+        return len(files)
+
+
+@pytest.fixture
+def engine():
+    engine = FakeEngine()
+    yield engine
+    engine.release.set()
+
+
+def params(*names):
+    return {"token": "t", "folder": "/D", "share_id": "s", "files": [{"id": n, "name": n, "size": "1"} for n in names]}
+
+
+def drain(q):
+    items = []
+    while not q.empty():
+        items.append(q.get())
+    return items
+
+
+def follow(q):
+    """Live events until the job ends the subscription."""
+    events = []
+    for item in iter(lambda: q.get(timeout=5), None):
+        events.append(item[1])
+    return events
+
+
+def test_a_subscriber_gets_the_log_after_its_seq_and_the_latest_progress(engine):
+    jobs = core.JobQueue(engine, workers=1)
+    job = jobs.submit(params("a.mkv", "b.mkv"))
+    assert engine.started.wait(5)
+    backlog, q = job.subscribe(after=1)
+    assert backlog == [(2, {"type": "start", "index": 0, "name": "a.mkv"}),
+                       (3, {"type": "start", "index": 1, "name": "b.mkv"}),
+                       (None, {"type": "downloading", "index": 0, "percent": 60}),
+                       (None, {"type": "downloading", "index": 1, "percent": 60})]
+    engine.release.set()
+    assert [e["type"] for e in follow(q)] == ["done", "done", "complete"]
+    assert job.summary()["status"] == "done" and (job.ok, job.failed) == (2, 0)
+    backlog, q = job.subscribe(after=4)
+    assert [e["type"] for _, e in backlog] == ["done", "complete"] and q.get_nowait() is None
+
+
+def test_close_fails_queued_jobs_and_detaches_running_ones(engine):
+    jobs = core.JobQueue(engine, workers=1)
+    running = jobs.submit(params("a.mkv"))
+    queued = jobs.submit(params("b.mkv"))
+    assert engine.started.wait(5)
+    _, q = running.subscribe()
+    jobs.close()
+    assert drain(q) == [(None, core.SHUTDOWN_EVENT), None]
+    assert queued.status == "failed" and queued.events[-1]["type"] == "complete" and "error" in queued.events[-1]
+    with pytest.raises(Exception):
+        jobs.submit(params("c.mkv"))
+    backlog, q = running.subscribe()  # re-attaching after shutdown ends at once
+    assert backlog[-1] == (None, core.SHUTDOWN_EVENT) and q.get_nowait() is None
+    assert running.status == "running"
+    engine.release.set()
+    assert jobs.drain(5) == 0
+    assert running.status == "done" and queued.started is None
+
+
+def test_drain_gives_up_after_its_timeout(engine):
+    jobs = core.JobQueue(engine, workers=2)
+    jobs.submit(params("a.mkv"))
+    assert engine.started.wait(5)
+    assert jobs.drain(0) == 1
+    engine.release.set()
+    assert jobs.drain(5) == 0
+
+
+def test_only_the_latest_finished_jobs_are_kept(engine):
+    engine.release.set()
+    jobs = core.JobQueue(engine, workers=1, history=2)
+    for name in ("a.mkv", "b.mkv", "c.mkv"):
+        last = jobs.submit(params(name))
+        follow(last.subscribe()[1])
+    newest = jobs.submit(params("d.mkv"))
+    assert [j["id"] for j in jobs.list()] == [last.id, newest.id]
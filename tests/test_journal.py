@@ -0,0 +1,137 @@
+"""Transfer journal: resuming an interrupted upload, and starting over after a failed check."""
+
+import pytest
+import requests
+
+import pikpak_core as core
+
+CHUNK = 4096
+GOOD = bytes(range(256)) * 64  # 16 KiB, four chunks
+
+
+def gcid(data):
+    hasher = core.PikPakGcidHasher(len(data))
+    hasher.update(data)
+    return hasher.hexdigest().upper()
+
+
+def content_hash(data):
+    hasher = core.DropboxContentHasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+class FakeDropbox:
+    """Stands in for dropbox_upload_chunks: one upload session per file, checkpointed after every chunk."""
+
+    def __init__(self):
+        self.sessions = {}
+        self.resumes = []
+        self.fail_at = None  # chunk number that fails with a connection error
+        self.wrong_hash = False
+        self.stray = b""  # bytes a lost run's in-flight block left in the session past its checkpoint
+        self.deleted = []
+
+    def upload_chunks(self, token, chunks, dropbox_path, total_size=0, progress_callback=None, batch=None,
+                      checkpoint=None, resume=None, overwrite=False):
+        self.resumes.append(tuple(resume[:2]) if resume else None)
+        if resume:
+            session_id, offset = resume[:2]
+            assert len(self.sessions[session_id]) == offset
+        else:
+            session_id, offset = f"s{len(self.sessions)}", 0
+            self.sessions[session_id] = bytearray()
+        for n, chunk in enumerate(chunks):
+            if n == self.fail_at:
+                self.fail_at = None
+                raise requests.ConnectionError("connection reset")
+            self.sessions[session_id] += chunk
+            offset += len(chunk)
+            if checkpoint:
+                checkpoint(session_id, offset)
+        data = bytes(self.sessions[session_id]) + self.stray
+        return {"path_display": dropbox_path, "path_lower": dropbox_path.lower(), "size": len(data),
+                "content_hash": "0" * 64 if self.wrong_hash else content_hash(data)}
+
+    def rpc(self, token, endpoint, payload):
+        assert endpoint == "files/delete_v2"
+        self.deleted.append(payload["path"])
+        return {}
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    dropbox = FakeDropbox()
+    journal = core.TransferJournal(str(tmp_path / "journal.db"))
+    served = {"data": GOOD}
+
+    def open_download(dl_url, start=0, size_hint=0, segments=None):
+        data = served["data"]
+        return len(data), (data[i:i + 1000] for i in range(start, len(data), 1000))
+
+    monkeypatch.setattr(core, "VERIFY_HASH", True)
+    monkeypatch.setattr(core, "CHUNK_SIZE", CHUNK)
+    monkeypatch.setattr(core, "get_journal", lambda: journal)
+    monkeypatch.setattr(core, "open_download", open_download)
+    monkeypatch.setattr(core, "dropbox_upload_chunks", dropbox.upload_chunks)
+    monkeypatch.setattr(core, "dropbox_rpc", dropbox.rpc)
+    return dropbox, journal, served
+
+
+def run(files):
+    events = []
+    core.run_transfers("token", "/D", "share", "", files, events.append, "stream", 1, False, True, False)
+    return [e for e in events if e["type"] in ("done", "error")]
+
+
+def test_interrupted_upload_resumes_from_checkpoint(env):
+    dropbox, journal, _ = env
+    files = [{"id": "f1", "name": "a.mkv", "size": str(len(GOOD)), "hash": gcid(GOOD), "download_url": "u"}]
+    dropbox.fail_at = 2
+    assert run(files)[0]["type"] == "error"
+    assert journal.lookup("share", "f1", "/D/a.mkv")["offset"] == 2 * CHUNK
+
+    assert run(files)[0]["type"] == "done"
+    assert dropbox.resumes == [None, ("s0", 2 * CHUNK)]
+    assert bytes(dropbox.sessions["s0"]) == GOOD
+    assert journal.lookup("share", "f1", "/D/a.mkv")["status"] == "done"
+
+
+def test_gcid_mismatch_starts_over_instead_of_resuming(env):
+    dropbox, journal, served = env
+    files = [{"id": "f1", "name": "a.mkv", "size": str(len(GOOD)), "hash": gcid(GOOD), "download_url": "u"}]
+    served["data"] = GOOD[:-1] + b"\x00"
+    [event] = run(files)
+    assert event["type"] == "error" and "hash do PikPak" in event["detail"]
+    assert journal.lookup("share", "f1", "/D/a.mkv") is None
+
+    served["data"] = GOOD
+    assert run(files)[0]["type"] == "done"
+    assert dropbox.resumes == [None, None]
+    assert bytes(dropbox.sessions["s1"]) == GOOD
+
+
+def test_content_hash_mismatch_deletes_and_forgets(env):
+    dropbox, journal, _ = env
+    files = [{"id": "f1", "name": "a.mkv", "size": str(len(GOOD)), "download_url": "u"}]
+    dropbox.wrong_hash = True
+    [event] = run(files)
+    assert event["type"] == "error" and "content_hash" in event["detail"]
+    assert dropbox.deleted == ["/d/a.mkv"]
+    assert journal.lookup("share", "f1", "/D/a.mkv") is None
+
+
+def test_resumed_upload_of_the_wrong_size_is_deleted_and_forgotten(env):
+    dropbox, journal, _ = env
+    files = [{"id": "f1", "name": "a.mkv", "size": str(len(GOOD)), "hash": gcid(GOOD), "download_url": "u"}]
+    dropbox.fail_at = 2
+    assert run(files)[0]["type"] == "error"
+    dropbox.stray = b"\0" * 5
+    [event] = run(files)
+    assert event["type"] == "error" and "Tamanho no Dropbox" in event["detail"]
+    assert dropbox.deleted == ["/d/a.mkv"]
+    assert journal.lookup("share", "f1", "/D/a.mkv") is None
+
+    dropbox.stray = b""
+    assert run(files)[0]["type"] == "done"
+    assert dropbox.resumes == [None, ("s0", 2 * CHUNK), None]
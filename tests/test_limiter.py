@@ -0,0 +1,81 @@
+"""AdaptiveLimiter: token bucket, concurrency slots, and how both move with throttling."""
+
+import pytest
+
+import pikpak_core as core
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(core, "time", clock)
+    return clock
+
+
+def limiter(rate=10, max_rate=100, max_concurrency=8):
+    return core.AdaptiveLimiter("h", rate, max_rate, max_concurrency)
+
+
+def request(lim, latency=0.1, throttled=False):
+    assert lim.try_acquire() == 0
+    lim.release(latency, throttled)
+
+
+def test_slots_and_tokens_bound_requests(clock):
+    lim = limiter(rate=2, max_concurrency=2)  # starts at half the concurrency cap
+    assert lim.try_acquire() == 0
+    assert lim.try_acquire() == 0.02
+    lim.release(0.1)
+    assert lim.try_acquire() == 0  # second token
+    lim.release(0.1)
+    assert lim.try_acquire() == pytest.approx(1 / lim.rate)  # bucket empty: wait for the next token
+    clock.sleep(1)
+    assert lim.try_acquire() == 0
+
+
+def test_slow_start_grows_five_percent_per_response_up_to_the_caps(clock):
+    lim = limiter(rate=10, max_rate=12, max_concurrency=8)
+    request(lim)
+    assert (lim.rate, lim.limit) == (pytest.approx(10.5), pytest.approx(4.2))
+    for _ in range(20):
+        clock.sleep(1)
+        request(lim)
+    assert (lim.rate, lim.limit) == (12, 8)
+
+
+def test_throttling_cuts_to_70_percent_at_most_once_a_second(clock):
+    lim = limiter(rate=10, max_concurrency=8)
+    request(lim, throttled=True)
+    assert (lim.rate, lim.limit) == (pytest.approx(7), pytest.approx(2.8))
+    request(lim, throttled=True)
+    assert lim.rate == pytest.approx(7)
+    clock.sleep(1)
+    request(lim, throttled=True)
+    assert lim.rate == pytest.approx(1.4)  # 70% of the two requests achieved in the last second
+
+
+def test_after_a_throttle_growth_is_additive(clock):
+    lim = limiter(rate=10, max_concurrency=8)
+    request(lim, throttled=True)
+    clock.sleep(1)
+    request(lim)
+    assert (lim.rate, lim.limit) == (pytest.approx(7.05), pytest.approx(2.8 + 1 / 2.8))
+
+
+def test_a_latency_spike_counts_as_throttling(clock):
+    lim = limiter(rate=10)
+    request(lim, latency=0.1)
+    request(lim, latency=0.1 * core.LATENCY_SPIKE_FACTOR + 0.01)
+    assert lim.rate == pytest.approx(0.7 * 10.5)
+    assert not lim.slow_start
@@ -0,0 +1,73 @@
+"""ProgressTracker: per-chunk events folded into one batch per tick, with rate and ETA."""
+
+import pytest
+
+import pikpak_core as core
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(core, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def tracker(clock):
+    tracker = core.ProgressTracker()
+    tracker.update({"type": "job", "bytes": 1000})
+    return tracker
+
+
+def progress(tracker, i, kind, percent, moved=None):
+    tracker.update({"type": kind, "index": i, "percent": percent, **({"bytes": moved} if moved is not None else {})})
+
+
+def test_a_tick_lists_only_the_files_that_moved(tracker, clock):
+    assert tracker.tick() is None and not tracker.active()
+    for pct in (10, 20, 30):
+        progress(tracker, 2, "downloading", pct)
+    progress(tracker, 0, "downloading", 50)
+    progress(tracker, 0, "uploading", 40)
+    clock.now += 1
+    assert tracker.tick()["files"] == [[0, 50, 40], [2, 30, None]]
+    progress(tracker, 2, "uploading", 5)
+    assert tracker.tick()["files"] == [[2, 30, 5]]
+    assert tracker.tick()["files"] == []  # still in progress, nothing new
+
+
+def test_finished_files_leave_the_batch(tracker):
+    progress(tracker, 0, "downloading", 50)
+    progress(tracker, 1, "downloading", 50)
+    tracker.update({"type": "done", "index": 0, "size": 400})
+    assert tracker.tick()["files"] == [[1, 50, None]]
+    tracker.update({"type": "error", "index": 1, "size": 600})
+    assert tracker.tick() is None and not tracker.active()
+
+
+def test_rate_and_eta_follow_the_bytes_moved(tracker, clock):
+    progress(tracker, 0, "downloading", 20, moved=200)
+    clock.now += 1
+    batch = tracker.tick()
+    assert (batch["bps"], batch["eta"]) == (200, 4)  # 800 bytes left at 200 B/s
+    progress(tracker, 0, "downloading", 60, moved=600)
+    clock.now += 1
+    batch = tracker.tick()
+    assert (batch["bps"], batch["eta"]) == (260, 1)  # 0.7 * 200 + 0.3 * 400
+    tracker.update({"type": "done", "index": 0, "size": 1000})
+    assert tracker.tick() is None and tracker.rate == 0
+
+
+def test_an_idle_gap_is_not_averaged_into_the_rate(tracker, clock):
+    clock.now += 60
+    progress(tracker, 0, "downloading", 10, moved=100)
+    clock.now += 0.5
+    assert tracker.tick()["bps"] == 200
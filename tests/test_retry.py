@@ -0,0 +1,43 @@
+"""Which upstream failures the shared sessions send again."""
+
+import pytest
+from urllib3.exceptions import ConnectTimeoutError, ReadTimeoutError
+
+import pikpak_core as core
+
+
+def retry_of(session):
+    return session.get_adapter("https://api.dropboxapi.com").max_retries
+
+
+@pytest.mark.parametrize("method, status, retried", [
+    ("GET", 500, True),
+    ("GET", 429, True),
+    ("POST", 429, True),
+    ("POST", 503, True),
+    ("POST", 500, False),
+    ("POST", 502, False),
+    ("POST", 404, False),
+])
+def test_statuses(method, status, retried):
+    assert retry_of(core.http_session).is_retry(method, status) is retried
+
+
+def test_post_read_error_is_not_replayed():
+    retry = retry_of(core.http_session)
+    error = ReadTimeoutError(None, "/2/files/upload_session/append_v2", "timed out")
+    with pytest.raises(ReadTimeoutError):
+        retry.increment(method="POST", url="/2/files/upload_session/append_v2", error=error, _stacktrace=None)
+    assert retry.increment(method="GET", url="/file", error=error).total == retry.total - 1
+
+
+def test_post_connect_error_is_retried():
+    retry = retry_of(core.http_session)
+    error = ConnectTimeoutError("connect timed out")
+    assert retry.increment(method="POST", url="/2/files/upload_session/append_v2", error=error).total == retry.total - 1
+
+
+def test_pikpak_session_leaves_429_to_the_limiter():
+    retry = retry_of(core.pikpak_session)
+    assert not retry.is_retry("GET", 429)
+    assert retry.is_retry("GET", 503)
@@ -0,0 +1,67 @@
+"""ShareSelection: which folders a crawl skips and which files it keeps."""
+
+import pytest
+
+import pikpak_core as core
+
+from fakes import FakeShare, video
+
+
+def test_empty_params_select_everything():
+    assert core.ShareSelection.from_params({}) is None
+    assert core.ShareSelection.from_params({"include": "", "exclude": [], "max_depth": "", "mime": None}) is None
+    assert core.ShareSelection.from_params({"min_size": "0"}) is not None
+
+
+def test_bad_number_is_an_error():
+    with pytest.raises(ValueError):
+        core.ShareSelection.from_params({"max_depth": "two"})
+
+
+@pytest.mark.parametrize("params, folders", [
+    ({"max_depth": 0}, {"A/": False}),
+    ({"max_depth": 1}, {"A/": True, "A/B/": False}),
+    ({"exclude": "A/B"}, {"A/": True, "A/B/": False, "A/B/C/": True}),
+    ({"exclude": "b"}, {"A/": True, "A/B/": False}),
+    ({"include": "*.mkv"}, {"A/": True, "A/B/": True}),
+    ({"include": "A/B/*.mkv"}, {"A/": True, "A/B/": True, "X/": False, "A/C/": False}),
+    ({"include": "a/*/x.mkv"}, {"A/": True, "A/B/": True, "A/B/C/": True, "X/": False}),
+    ({"include": "Season*/*.mkv"}, {"Season 1/": True, "Season 1/Extras/": True, "Other/": False}),
+    ({"include": "A/S*1/x.mkv"}, {"A/": True, "A/S2/": True, "A/T1/": False, "B/": False}),
+    ({"include": "*/Season 2/*"}, {"A/": True, "A/B/": True, "Season 2/": True}),
+])
+def test_wants_folder(params, folders):
+    selection = core.ShareSelection.from_params(params)
+    assert {path: selection.wants_folder(path) for path in folders} == folders
+
+
+def test_wants_file():
+    selection = core.ShareSelection.from_params({"include": "*.mkv,*.mp4", "exclude": "*sample*", "mime": "video/",
+                                                 "min_size": "10", "max_size": "100"})
+    assert selection.wants_file(video("a", "a.mkv", 10), "A/a.mkv")
+    assert selection.wants_file(video("a", "a.MP4", 100), "a.MP4")
+    assert not selection.wants_file(video("a", "a.srt", 50), "a.srt")
+    assert not selection.wants_file(video("a", "sample.mkv", 50), "A/sample.mkv")
+    assert not selection.wants_file(video("a", "a.mkv", 9), "a.mkv")
+    assert not selection.wants_file(video("a", "a.mkv", 101), "a.mkv")
+    assert not selection.wants_file({**video("a", "a.mkv", 50), "mime_type": "text/plain"}, "a.mkv")
+
+
+@pytest.fixture
+def share(monkeypatch):
+    share = FakeShare()
+    monkeypatch.setattr(core, "fetch_share_page", share.fetch_share_page)
+    return share
+
+
+@pytest.mark.parametrize("params, listed, names", [
+    ({"max_depth": 1}, ["", "A"], ["A/one.mkv", "top.mkv"]),
+    ({"exclude": "A/B"}, ["", "A"], ["A/one.mkv", "top.mkv"]),
+    ({"include": "A/B/t*.mkv"}, ["", "A", "B"], ["A/B/three.mkv", "A/B/two.mkv"]),
+    ({"include": "X/*.mkv"}, [""], []),
+])
+def test_crawl_skips_pruned_folders(share, params, listed, names):
+    selection = core.ShareSelection.from_params(params)
+    files = core.list_share_files("share", fresh=True, selection=selection)
+    assert sorted(share.listed) == listed
+    assert sorted(f["name"] for f in files) == names
@@ -0,0 +1,147 @@
+"""plan_sync: diffing a share against its last snapshot."""
+
+import pytest
+
+import pikpak_core as core
+
+from fakes import FakeShare, video
+
+
+@pytest.fixture
+def share(tmp_path, monkeypatch):
+    share = FakeShare()
+    store = core.SnapshotStore(str(tmp_path / "snapshots.db"))
+    monkeypatch.setattr(core, "fetch_share_page", share.fetch_share_page)
+    monkeypatch.setattr(core, "get_snapshots", lambda: store)
+    monkeypatch.setattr(core, "get_journal", lambda: None)
+    monkeypatch.setattr(core, "dropbox_delete_paths", lambda token, paths: share.deleted.extend(paths))
+    return share
+
+
+def sync(share, job_id, failed_ids=(), **kwargs):
+    share.listed.clear()
+    files, summary = core.plan_sync(core, job_id, "/D", "share", **kwargs)
+    core.commit_sync(job_id, failed_ids, "token")
+    return {f["name"]: f for f in files}, summary
+
+
+def test_first_sync_sends_everything(share):
+    files, summary = sync(share, "j1")
+    assert sorted(files) == ["A/B/three.mkv", "A/B/two.mkv", "A/one.mkv", "top.mkv"]
+    assert summary["first"] and summary["added"] == 4
+
+
+def test_unchanged_folder_is_reused_but_its_subfolders_are_listed(share):
+    sync(share, "j1")
+    files, summary = sync(share, "j2")
+    assert files == {}
+    assert summary["unchanged"] == 4 and summary["reused_folders"] == 1
+    assert sorted(share.listed) == ["", "B"]
+
+
+def test_change_below_an_unchanged_folder_is_found(share):
+    sync(share, "j1")
+    share.tree["B"].append(video("four", "four.mkv"))
+    share.touch("B", "2")  # only the folder holding the new file changes
+    files, summary = sync(share, "j2")
+    assert list(files) == ["A/B/four.mkv"]
+    assert summary["added"] == 1 and summary["unchanged"] == 4
+
+
+def test_changed_file_is_overwritten_not_deleted_up_front(share):
+    sync(share, "j1")
+    share.tree["A"][0] = video("one2", "one.mkv", size=200)
+    share.touch("A", "2")
+    files, summary = sync(share, "j2")
+    assert list(files) == ["A/one.mkv"] and files["A/one.mkv"]["overwrite"]
+    assert summary["changed"] == 1 and summary["added"] == 0
+    assert share.deleted == []
+
+
+def test_removed_file_is_deleted_only_with_delete(share):
+    sync(share, "j1")
+    share.tree["B"].pop()
+    share.touch("B", "2")
+    _, summary = sync(share, "j2")
+    assert summary["removed"] == 1 and share.deleted == []
+
+    share.tree["B"].pop()
+    share.touch("B", "3")
+    _, summary = sync(share, "j3", delete=True)
+    assert summary["deleted"] == 1 and share.deleted == ["/D/two.mkv"]
+
+
+def test_deletes_wait_for_commit_sync(share):
+    sync(share, "j1")
+    share.tree["B"].pop()
+    share.touch("B", "2")
+    _, summary = core.plan_sync(core, "j2", "/D", "share", delete=True)
+    assert summary["deleted"] == 1 and share.deleted == []  # a job cancelled here deletes nothing
+    core.commit_sync("j2", (), "token")
+    assert share.deleted == ["/D/three.mkv"]
+
+
+def test_failed_delete_leaves_the_snapshot_for_the_next_sync(share, monkeypatch):
+    sync(share, "j1")
+    share.tree["B"].pop()
+    share.touch("B", "2")
+    core.plan_sync(core, "j2", "/D", "share", delete=True)
+    monkeypatch.setattr(core, "dropbox_delete_paths", lambda token, paths: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        core.commit_sync("j2", (), "token")
+    _, summary = core.plan_sync(core, "j3", "/D", "share", delete=True)
+    assert summary["deleted"] == 1
+
+
+def test_failed_file_comes_back_as_new(share):
+    sync(share, "j1", failed_ids=["two"])
+    files, summary = sync(share, "j2")
+    assert list(files) == ["A/B/two.mkv"] and summary["added"] == 1
+
+
+def test_full_lists_every_folder(share):
+    sync(share, "j1")
+    _, summary = sync(share, "j2", full=True)
+    assert summary["reused_folders"] == 0 and sorted(share.listed) == ["", "A", "B"]
+
+
+@pytest.fixture
+def journal(share, tmp_path, monkeypatch):
+    journal = core.TransferJournal(str(tmp_path / "journal.db"))
+    monkeypatch.setattr(core, "get_journal", lambda: journal)
+    return journal
+
+
+def test_autorenamed_copies_are_deleted_and_overwritten_where_they_are(share, journal):
+    sync(share, "j1")
+    journal.complete("share", "three", "/D/three.mkv", "/D/three (1).mkv")
+    journal.complete("share", "one", "/D/one.mkv", "/D/one (1).mkv")
+    share.tree["B"].pop()
+    share.touch("B", "2")
+    share.tree["A"][0] = video("one2", "one.mkv", size=200)
+    share.touch("A", "2")
+    files, _ = sync(share, "j2", delete=True)
+    assert files["A/one.mkv"]["dropbox_path"] == "/D/one (1).mkv"
+    assert core.dropbox_path_for("/D", files["A/one.mkv"]) == "/D/one (1).mkv"
+    assert share.deleted == ["/D/three (1).mkv"]
+    assert journal.lookup("share", "one", "/D/one.mkv") is None  # the old id is sent again if it comes back
+
+
+def test_file_changed_in_place_is_not_skipped_as_already_sent(share, journal):
+    sync(share, "j1")
+    journal.complete("share", "one", "/D/one.mkv", "/D/one.mkv")
+    share.tree["A"][0] = video("one", "one.mkv", size=200)
+    share.touch("A", "2")
+    files, _ = sync(share, "j2")
+    f = files["A/one.mkv"]
+    prior = journal.lookup("share", "one", core.dropbox_path_for("/D", f))
+    assert prior["status"] == "done" and not core.sent_before(prior, f)
+
+
+def test_failed_overwrite_is_still_a_change_next_time(share):
+    sync(share, "j1")
+    share.tree["A"][0] = video("one2", "one.mkv", size=200)
+    share.touch("A", "2")
+    sync(share, "j2", failed_ids=["one2"])
+    files, summary = sync(share, "j3")
+    assert list(files) == ["A/one.mkv"] and files["A/one.mkv"]["overwrite"] and summary["changed"] == 1
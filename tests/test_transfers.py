@@ -0,0 +1,59 @@
+"""run_transfers scheduling and the memory an upload holds."""
+
+import threading
+
+import pikpak_core as core
+
+DATA = b"x" * 10000
+
+
+def test_streamed_download_opens_only_inside_a_session_slot(monkeypatch):
+    state = {"open": 0, "most": 0}
+    lock = threading.Lock()
+
+    def open_download(dl_url, start=0, size_hint=0, segments=None):
+        with lock:
+            state["open"] += 1
+            state["most"] = max(state["most"], state["open"])
+
+        def pieces():
+            yield DATA
+            with lock:
+                state["open"] -= 1
+        return len(DATA), pieces()
+
+    def upload(token, chunks, dropbox_path, *args, **kwargs):
+        data = b"".join(chunks)
+        return {"path_display": dropbox_path, "size": len(data)}
+
+    monkeypatch.setattr(core, "VERIFY_HASH", False)
+    monkeypatch.setattr(core, "dropbox_sessions", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(core, "get_journal", lambda: None)
+    monkeypatch.setattr(core, "open_download", open_download)
+    monkeypatch.setattr(core, "dropbox_upload_chunks", upload)
+    files = [{"id": str(i), "name": f"{i}.mkv", "size": str(len(DATA)), "download_url": "u"} for i in range(6)]
+    events = []
+    assert core.run_transfers("token", "/D", "share", "", files, events.append, "stream", 6, False, False, False) == 6
+    assert state["most"] == 1
+
+
+def test_concurrent_upload_blocks_fit_the_memory_budget(monkeypatch):
+    mib = 1024 * 1024
+    monkeypatch.setattr(core, "UPLOAD_MEMORY", 96 * mib)
+    monkeypatch.setattr(core, "DROPBOX_MAX_SESSIONS", 2)
+    blocks = []
+
+    def dropbox_post(token, endpoint, args, data=None):
+        if endpoint.endswith("/start"):
+            return {"session_id": "s"}
+        if data:
+            blocks.append(len(data))
+        return {"path_display": "/D/a.mkv"}
+
+    monkeypatch.setattr(core, "dropbox_post", dropbox_post)
+    total = 200 * mib
+    pieces = (b"\0" * mib for _ in range(200))
+    core.dropbox_upload_concurrent("token", pieces, "/D/a.mkv", total, workers=2)
+    # 48 MiB per session, four blocks of it held at once; a free-flowing link would otherwise grow them to 64 MiB
+    assert core.upload_block_limit(2) == 12 * mib
+    assert max(blocks) == 12 * mib and sum(blocks) == total
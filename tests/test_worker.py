@@ -0,0 +1,90 @@
+"""TaskStore: how files are claimed by workers and what a finished job keeps."""
+
+import threading
+
+import pytest
+
+import pikpak_worker as worker
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def store(tmp_path):
+    return worker.TaskStore(str(tmp_path / "tasks.db"))
+
+
+def job(store, sizes, workers=4):
+    files = [{"id": str(i), "name": f"{i}.mkv", "size": str(size)} for i, size in enumerate(sizes)]
+    return store.create_job({"token": "secret", "folder": "/D", "share_id": "s", "files": files, "workers": workers})
+
+
+def claim(store, worker_id):
+    result = store.claim_tasks(worker_id)
+    return [idx for idx, _ in result[2]] if result else []
+
+
+def test_small_files_are_claimed_in_one_batch(store):
+    job(store, [MB] * 80)
+    assert len(claim(store, "w1")) == worker.TASK_CLAIM
+    assert len(claim(store, "w2")) == 30
+
+
+def test_large_files_are_spread_across_workers(store):
+    job(store, [700 * MB] * 10)
+    assert claim(store, "w1") == [0, 1, 2, 3]
+    assert claim(store, "w2") == [4, 5, 6, 7]
+    assert claim(store, "w3") == [8, 9]
+
+
+def test_claim_stops_at_the_byte_budget(store):
+    job(store, [100 * MB] * 6 + [MB] * 10, workers=2)
+    assert claim(store, "w1") == [0, 1, 2]
+    assert claim(store, "w2") == [3, 4, 5]
+    assert claim(store, "w3") == list(range(6, 16))
+
+
+def test_folder_listing_only_blocks_batches_of_the_same_job(store, monkeypatch):
+    release = threading.Event()
+    calls, waits = [], []
+
+    def dropbox_folder_index(token, folder):
+        calls.append(folder)
+        if folder == "/slow":
+            waits.append(release.wait(5))
+        return {folder: []}
+
+    monkeypatch.setattr(worker, "dropbox_folder_index", dropbox_folder_index)
+    w = worker.Worker(store, engine=None, slots=3)
+    slow = [threading.Thread(target=w.existing_index, args=("a", {"token": "t", "folder": "/slow"}))
+            for _ in range(2)]
+    for t in slow:
+        t.start()
+    assert w.existing_index("b", {"token": "t", "folder": "/fast"}) == {"/fast": []}
+    release.set()
+    for t in slow:
+        t.join(5)
+    assert sorted(calls) == ["/fast", "/slow"] and waits == [True]
+
+
+def test_finished_job_forgets_the_token(store):
+    job_id = job(store, [MB] * 2)
+    _, params, _ = store.claim_tasks("w1")
+    assert params["token"] == "secret"
+    store.finish_task(job_id, 0, {"type": "done", "index": 0})
+    assert store.job(job_id)["params"]["token"] == "secret"
+    store.finish_task(job_id, 1, {"type": "error", "index": 1})
+    assert "token" not in store.job(job_id)["params"]
+    assert store.job(job_id)["params"]["folder"] == "/D"
+
+    failed = store.create_job({"token": "secret", "url": "https://mypikpak.com/s/x", "folder": "/D"})
+    store.fail_job(failed, "Erro")
+    assert "token" not in store.job(failed)["params"]
+
+
+def test_opening_a_store_drops_tokens_of_old_finished_jobs(store, tmp_path):
+    job_id = job(store, [MB])
+    with store.transaction() as conn:
+        conn.execute("UPDATE jobs SET finished = 1 WHERE id = ?", (job_id,))
+    assert store.job(job_id)["params"]["token"] == "secret"
+    assert "token" not in worker.TaskStore(str(tmp_path / "tasks.db")).job(job_id)["params"]